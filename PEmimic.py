@@ -1,16 +1,35 @@
 # Finds a file-donor according to the selected criteria and transplants its parts.
 # Dependencies: pip install colorama capstone
 import argparse
+import array
+import atexit
+import bisect
+import collections
+import concurrent.futures
+import contextvars
 import copy
 import ctypes as ct
+import functools
+import hashlib
+import heapq
+import http.server
+import itertools
+import json
+import mmap
 import operator
 import os
+import queue
 import signal
+import sqlite3
 import struct
 import sys
+import tarfile
+import threading
 import time
+import traceback
+import zipfile
 from datetime import date
-from random import shuffle
+from random import Random
 
 try:
     from colorama import init, Back
@@ -44,14 +63,29 @@ SYS_DRIVE = os.getenv("SystemDrive")
 # ---  log separator  ---
 SEPARATOR = f'{"=" * 80}'
 
-# ---  file counter   ---
-COUNTER = 0
+# ---   JSON lines log   ---
+LOG_JSONL_BUFFER_SIZE = 0x100000  # buffer of the JSON lines log file
+LOG_JSONL_QUEUE_SIZE = 1024       # records waiting for the log writer thread
 
-# ---   debug info    ---
-# indicates that original PE cannot contain DebugInfo outside the .rsrc section at all
-CREATE_DEBUG_INFO_SESSION = False
-# indicates that original PE cannot contain DebugInfo outside the .rsrc section from current donor
-CREATE_DEBUG_INFO_SAMPLE = False
+# ---   interaction   ---
+# prompt and exit on invalid original files, set only by the single "-in" command line run.
+# Otherwise the messages are logged and OriginalError is raised.
+INTERACTIVE = False
+
+# ---   batch mode    ---
+BATCH_LOG_NAME = '_batch'
+
+# --- donor read-ahead ---
+DONOR_PREFETCH_COUNT = 4  # default count of the donor files read in the background
+DONOR_PREFETCH_MB = 64    # default limit of the donor bytes read ahead
+
+# ---     profile     ---
+PROFILE_FILE_NAME = '_mimic_profile'
+PROFILE_SLOWEST_DONORS = 10  # count of the slowest donor files in the profile report
+
+# ---     metrics     ---
+METRICS_INTERVAL = 10  # seconds between the metrics snapshots of the long runs
+METRICS_PROM_PREFIX = 'pemimic'
 
 # ---    checksum     ---
 USE_CHECKSUM_DLL = None
@@ -59,6 +93,19 @@ DLL_CHECKSUM_FUNC = None
 CHECKSUM_32_DLL_NAME = 'checksum32.dll'
 CHECKSUM_64_DLL_NAME = 'checksum64.dll'
 INTERPRETER_IS_64 = sys.maxsize > 2 ** 32
+CHECKSUM_CHUNK_SIZE = 0x100000
+CHECKSUM_ARRAY_TYPE = 'I' if array.array('I').itemsize == 4 else 'L'
+
+# ---   sample data   ---
+# slices inside the sample smaller than this limit are returned as bytes
+SAMPLE_SLICE_BYTES_LIMIT = 0x10000
+# size of the chunk used when original ranges can not be copied by the OS
+COPY_CHUNK_SIZE = 0x100000
+# maximum count of buffers for one os.writev call
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
 
 # ---   rich consts   ---
 RICH_MARK = b'\x52\x69\x63\x68'  # 0x68636952 == b'\x52\x69\x63\x68' == b'Rich'
@@ -312,20 +359,58 @@ KNOWN_PRODUCT_IDS = {
   270: "Utc1900_POGO_O_CPP"
 }
 
+# ---  delta storage  ---
+DELTA_MAGIC = b'PEMD\x01'
+DELTA_FILE_NAME = '_mimic_delta.pemd'
+DELTA_RECORD_ORIGINAL = b'O'
+DELTA_RECORD_BLOB = b'B'
+DELTA_RECORD_SAMPLE = b'S'
+DELTA_RECORD_HEAD_SIZE = 9  # type (1 byte) + payload size (8 bytes)
+DELTA_OP_COPY = 0  # copy range of the original file
+DELTA_OP_BLOB = 1  # write blob stored in the container
+
+# ---     daemon      ---
+DAEMON_HOST = '127.0.0.1'
+DAEMON_ORIGINALS_LIMIT = 16  # count of the checked originals kept between the jobs
+DAEMON_CACHE_MB = 1024  # default memory budget for the donor bytes kept between the jobs
+
+# --- archive output  ---
+ARCHIVE_FILE_NAME = '_mimic_samples'
+ARCHIVE_INDEX_NAME = '_mimic_index.json'
+
+# --- sample manifest ---
+MANIFEST_FILE_NAME = '_mimic_manifest.db'
+MANIFEST_COMMIT_ROWS = 256  # samples written to the manifest in one transaction
+MANIFEST_TIMEOUT = 60  # seconds to wait for the manifest locked by another process
+# sample part name prefix -> donor part it is taken from
+MANIFEST_PART_SOURCES = {'rich': 'rich', 'timePE': 'stamp', 'sign': 'sign', 'res': 'res', 'vi': 'vi',
+                         'dbg': 'dbg', 'dbgres': 'dbg', 'names': 'names'}
+
+# ---   checkpoint    ---
+CHECKPOINT_FILE_NAME = '_mimic_checkpoint.json'
+CHECKPOINT_INTERVAL = 30  # seconds between the checkpoints of the donor search
+
+# --- result cache  ---
+RESULT_CACHE_VERSION = b'2'  # change when the samples built from the same input change
+# arguments changing the sample built from the donor, the selected parts are taken from Options
+RESULT_CACHE_KEY_ARGS = ('no_rich_fix', 'manifest_allowed', 'store_dbg_to_rsrc', 'upd_checksum', 'seed')
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# --- negative cache  ---
+NEGATIVE_CACHE_PARTS = ('rich', 'stamp', 'sign', 'dbg', 'res', 'vi')  # bit of the part is its index
+NEGATIVE_CACHE_COMMIT_ROWS = 1024  # donors written to the negative cache in one transaction
+
+# --- combined donors ---
+COMBINED_DONOR_NAME = 'combined'  # name of the donor combined from the parts of different donors in sample names
+COMBINED_DONOR_HASH_SIZE = 8  # hex digits of the part sources hash added to the combined donor name
+
 # ---     imports     ---
 IMPORT_NAME_LENGTH_LIMIT = 4096
 NULL_DWORD = b'\x00\x00\x00\x00'
 NULL_QWORD = b'\x00\x00\x00\x00\x00\x00\x00\x00'
 IMPORT_DLL_STRUCT_SIZE = 20
 IMPORT_DLL_EMPTY_STRUCT = b'\x00' * IMPORT_DLL_STRUCT_SIZE
-IMPORT_NAME_MIN_OFFSET = -1
-IMPORT_NAME_MAX_OFFSET = -1
-IMPORT_OFT_MIN_OFFSET = -1
-IMPORT_FT_MIN_OFFSET = -1
-IMPORT_OFT_DELTA = -1
-IMPORT_FT_DELTA = -1
 TARGET_INSTRUCTIONS = ['call', 'jmp', 'mov']
-IMPORT_CALLS = {}  # {func_offset : [instruction_objs]}
 
 
 # parts to search
@@ -346,124 +431,907 @@ class Options:
     remove_vi = False
     remove_dbg = False
 
-    @staticmethod
-    def enable_all_search():
-        Options.search_rich = True
-        Options.search_stamp = True
-        Options.search_sign = True
-        Options.search_vi = True
-        Options.search_dbg = True
-        Options.search_res = True
-        Options.shuffle_imp = True
-        Options.change_names = True
-
-    @staticmethod
-    def enable_all_remove():
-        Options.remove_mode = True
-        Options.remove_rich = True
-        Options.remove_stamp = True
-        Options.remove_sign = True
-        Options.remove_ovl = True
-        Options.remove_vi = True
-        Options.remove_dbg = True
-
-    @staticmethod
-    def disable_all_search():
-        Options.search_rich = False
-        Options.search_stamp = False
-        Options.search_sign = False
-        Options.search_vi = False
-        Options.search_dbg = False
-        Options.search_res = False
-        Options.shuffle_imp = False
-        Options.change_names = False
-
-    @staticmethod
-    def disable_all_remove():
-        Options.remove_rich = False
-        Options.remove_stamp = False
-        Options.remove_sign = False
-        Options.remove_ovl = False
-        Options.remove_vi = False
-        Options.remove_dbg = False
-
-    @staticmethod
-    def get_search_count():
-        return Options.search_rich + Options.search_stamp + Options.search_sign + Options.search_vi + \
-               Options.search_dbg + Options.search_res + Options.shuffle_imp + Options.change_names
-
-    @staticmethod
-    def get_remove_count():
-        return Options.remove_rich + Options.remove_stamp + Options.remove_sign + \
-               Options.remove_ovl + Options.remove_vi + Options.remove_dbg
-
-    @staticmethod
-    def donor_needed():
-        return any([Options.search_rich, Options.search_stamp, Options.search_sign, Options.search_vi,
-                    Options.search_dbg, Options.search_res, Options.change_names])
-
-    @staticmethod
-    def get_string_options():
+    def enable_all_search(self):
+        self.search_rich = True
+        self.search_stamp = True
+        self.search_sign = True
+        self.search_vi = True
+        self.search_dbg = True
+        self.search_res = True
+        self.shuffle_imp = True
+        self.change_names = True
+
+    def enable_all_remove(self):
+        self.remove_mode = True
+        self.remove_rich = True
+        self.remove_stamp = True
+        self.remove_sign = True
+        self.remove_ovl = True
+        self.remove_vi = True
+        self.remove_dbg = True
+
+    def disable_all_search(self):
+        self.search_rich = False
+        self.search_stamp = False
+        self.search_sign = False
+        self.search_vi = False
+        self.search_dbg = False
+        self.search_res = False
+        self.shuffle_imp = False
+        self.change_names = False
+
+    def disable_all_remove(self):
+        self.remove_rich = False
+        self.remove_stamp = False
+        self.remove_sign = False
+        self.remove_ovl = False
+        self.remove_vi = False
+        self.remove_dbg = False
+
+    def get_search_count(self):
+        return self.search_rich + self.search_stamp + self.search_sign + self.search_vi + \
+               self.search_dbg + self.search_res + self.shuffle_imp + self.change_names
+
+    def get_remove_count(self):
+        return self.remove_rich + self.remove_stamp + self.remove_sign + \
+               self.remove_ovl + self.remove_vi + self.remove_dbg
+
+    def donor_needed(self):
+        return any([self.search_rich, self.search_stamp, self.search_sign, self.search_vi,
+                    self.search_dbg, self.search_res, self.change_names])
+
+    def get_string_options(self):
         options = []
-        if Options.search_rich:
+        if self.search_rich:
             options.append('rich')
-        if Options.search_stamp:
+        if self.search_stamp:
             options.append('timePE')
-        if Options.search_sign:
+        if self.search_sign:
             options.append('sign')
-        if Options.search_vi:
+        if self.search_vi:
             options.append('vi')
-        if Options.search_dbg:
+        if self.search_dbg:
             options.append('dbg')
-        if Options.search_res:
+        if self.search_res:
             options.append('res')
-        if Options.shuffle_imp:
+        if self.shuffle_imp:
             options.append('imp')
-        if Options.change_names:
+        if self.change_names:
             options.append('names')
-        if Options.remove_rich:
+        if self.remove_rich:
             options.append('rem_rich')
-        if Options.remove_stamp:
+        if self.remove_stamp:
             options.append('rem_timePE')
-        if Options.remove_sign:
+        if self.remove_sign:
             options.append('rem_sign')
-        if Options.remove_ovl:
+        if self.remove_ovl:
             options.append('rem_ovl')
-        if Options.remove_vi:
+        if self.remove_vi:
             options.append('rem_vi')
-        if Options.remove_dbg:
+        if self.remove_dbg:
             options.append('rem_dbg')
         return '-'.join(options)
 
+    # get options searching for the parts searched by any of the given options
+    @staticmethod
+    def union(options_list):
+        result = Options()
+        for name in ('search_rich', 'search_stamp', 'search_sign', 'search_vi', 'search_dbg', 'search_res',
+                     'shuffle_imp', 'change_names'):
+            setattr(result, name, any(getattr(options, name) for options in options_list))
+        return result
+
+
+# Collects wall and CPU time of the run stages for "-profile".
+# Stages are nested, the time of the stage includes its inner stages,
+# e.g. "parse_donor/get_resources" is a part of "parse_donor".
+# The stages are added to the profiler started in the current context, so the concurrent runs
+# and the daemon jobs are measured separately. Threads of the run get the context with the submitted work.
+class Profiler:
+    __current = contextvars.ContextVar('profiler', default=None)
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__local = threading.local()  # stack of the stages of the current thread
+        self.__stages = {}  # {stage path: [calls, wall, cpu]}
+        self.__donors = {}  # {donor path: wall}
+        self.__start = (time.perf_counter(), time.process_time())
+        self.__token = None
+
+    # measure the stages of the current context
+    def start(self):
+        self.__token = Profiler.__current.set(self)
+
+    # stop the timing, the next daemon jobs without "-profile" are not measured
+    def stop(self):
+        if self.__token is not None:
+            Profiler.__current.reset(self.__token)
+            self.__token = None
+
+    def __add(self, stage, wall, cpu, donor=None):
+        with self.__lock:
+            entry = self.__stages.setdefault(stage, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += wall
+            entry[2] += cpu
+            if donor is not None:
+                self.__donors[donor] = self.__donors.get(donor, 0.0) + wall
+
+    # decorator of the function measured as the stage.
+    # "donor_arg" is the index of the donor path or donor argument, the stage time is added to that donor.
+    @staticmethod
+    def stage(name, donor_arg=None):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                profiler = Profiler.__current.get()
+                if profiler is None:
+                    return func(*args, **kwargs)
+                if not hasattr(profiler.__local, 'stack'):
+                    profiler.__local.stack = []
+                stack = profiler.__local.stack
+                stack.append(name)
+                stage = '/'.join(stack)
+                wall = time.perf_counter()
+                cpu = time.thread_time()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    stack.pop()
+                    donor = None
+                    if donor_arg is not None:
+                        donor = args[donor_arg] if isinstance(args[donor_arg], str) else args[donor_arg].path
+                    profiler.__add(stage, time.perf_counter() - wall, time.thread_time() - cpu, donor)
+            return wrapper
+        return decorator
+
+    # measure getting the items from the iterable as the stage
+    @staticmethod
+    def iterate(name, iterable):
+        profiler = Profiler.__current.get()
+        if profiler is None:
+            return iterable
+        return profiler.__iterate(name, iterable)
+
+    def __iterate(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            wall = time.perf_counter()
+            cpu = time.thread_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.__add(name, time.perf_counter() - wall, time.thread_time() - cpu)
+                return
+            self.__add(name, time.perf_counter() - wall, time.thread_time() - cpu)
+            yield item
+
+    # save JSON report to the directory and show the slowest stages
+    # returns path to the report
+    def save(self, out_dir):
+        report = {'wall': round(time.perf_counter() - self.__start[0], 6),
+                  'cpu': round(time.process_time() - self.__start[1], 6),
+                  'stages': [], 'slowest_donors': []}
+        with self.__lock:
+            for stage, (calls, wall, cpu) in sorted(self.__stages.items(), key=lambda i: i[1][1], reverse=True):
+                report['stages'].append({'stage': stage, 'calls': calls, 'wall': round(wall, 6), 'cpu': round(cpu, 6)})
+            donors = sorted(self.__donors.items(), key=operator.itemgetter(1), reverse=True)
+            for path, wall in donors[:PROFILE_SLOWEST_DONORS]:
+                report['slowest_donors'].append({'path': path, 'wall': round(wall, 6)})
+        report_path = os.path.join(out_dir, f'{PROFILE_FILE_NAME}_{int(time.time())}.json')
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=1)
+        lines = [f'{stage["wall"]:>10.3f}s {stage["cpu"]:>10.3f}s {stage["calls"]:>8}  {stage["stage"]}' for stage in report['stages'][:10]]
+        msg = f'Profile: wall {report["wall"]:.3f}s, cpu {report["cpu"]:.3f}s\n' \
+              f'{"wall":>11} {"cpu":>11} {"calls":>8}  stage\n' + '\n'.join(lines) + f'\nProfile saved in: {report_path}'
+        print(f'{Back.CYAN}{msg}{Back.RESET}')
+        Log.write(msg)
+        return report_path
+
+
+# Counts scanned files, read bytes, rejected donors by reason and written samples for "-metrics".
+# The snapshot is saved every METRICS_INTERVAL seconds and at the end of the run,
+# as Prometheus text file if the file name ends with ".prom" and as JSON otherwise.
+class Metrics:
+    def __init__(self, path):
+        self.__enabled = True
+        self.__lock = threading.Lock()
+        self.__counters = {}  # {(name, label): value}
+        self.__path = path
+        self.__start = time.monotonic()
+        self.__stop = threading.Event()
+        self.__writer = threading.Thread(target=self.__write_periodically, daemon=True)
+        self.__writer.start()
+
+    # add value to the counter, "label" is the reason of the rejection or the missing part
+    def count(self, name, label=None, value=1):
+        if not self.__enabled:
+            return
+        with self.__lock:
+            key = (name, label)
+            self.__counters[key] = self.__counters.get(key, 0) + value
+
+    def __write_periodically(self):
+        while not self.__stop.wait(METRICS_INTERVAL):
+            self.save()
+
+    # get counters with the elapsed time and throughput
+    def get_snapshot(self):
+        snapshot = {}
+        with self.__lock:
+            for (name, label), value in sorted(self.__counters.items(), key=lambda i: (i[0][0], i[0][1] or '')):
+                if label is None:
+                    snapshot[name] = value
+                else:
+                    snapshot.setdefault(name, {})[label] = value
+        elapsed = time.monotonic() - self.__start
+        snapshot['elapsed'] = round(elapsed, 3)
+        snapshot['files_per_sec'] = round(snapshot.get('files_seen', 0) / elapsed, 3) if elapsed else 0
+        snapshot['bytes_per_sec'] = round(snapshot.get('bytes_read', 0) / elapsed, 3) if elapsed else 0
+        return snapshot
+
+    @staticmethod
+    def __to_prometheus(snapshot):
+        lines = []
+        for name, value in snapshot.items():
+            gauge = name in ('elapsed', 'files_per_sec', 'bytes_per_sec')
+            metric = f'{METRICS_PROM_PREFIX}_{name}' if gauge else f'{METRICS_PROM_PREFIX}_{name}_total'
+            lines.append(f'# TYPE {metric} {"gauge" if gauge else "counter"}')
+            if isinstance(value, dict):
+                label = 'part' if name == 'donors_missing_part' else 'reason'
+                lines += [f'{metric}{{{label}="{k}"}} {v}' for k, v in value.items()]
+            else:
+                lines.append(f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
 
+    # save the snapshot, the file is replaced at once, so readers never see a partial file
+    def save(self):
+        if not self.__enabled:
+            return None
+        snapshot = self.get_snapshot()
+        if self.__path.endswith('.prom'):
+            text = Metrics.__to_prometheus(snapshot)
+        else:
+            text = json.dumps(snapshot, indent=1)
+        tmp_path = f'{self.__path}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(text)
+            os.replace(tmp_path, self.__path)
+        except OSError as e:
+            print(f'{Back.RED}Can not save metrics: {e}{Back.RESET}')
+        return snapshot
+
+    # stop the periodic snapshots, save the last one and show it
+    def close(self):
+        if not self.__enabled:
+            return
+        self.__stop.set()
+        self.__writer.join()
+        snapshot = self.save()
+        self.__enabled = False
+        msg = 'Metrics:\n' + '\n'.join(f'{k}: {v}' for k, v in snapshot.items()) + f'\nMetrics saved in: {self.__path}'
+        print(f'{Back.CYAN}{msg}{Back.RESET}')
+        Log.write(msg)
+
+
+# Text log of the run and optional JSON lines log with one record per sample.
+# JSON records are written by the background thread through the buffered file.
+# Messages are written to the log started in the current context, so the concurrent runs
+# and the daemon jobs keep their own logs, and the library calls without the log write nothing.
 class Log:
-    __file = None
+    __current = contextvars.ContextVar('log', default=None)
 
-    @staticmethod
-    def init(args):
+    def __init__(self, args, options):
         global SEPARATOR
+        self.__file = None
+        self.__path = None
+        self.__jsonl_file = None
+        self.__jsonl_path = None
+        self.__jsonl_queue = None
+        self.__jsonl_writer = None
+        self.__token = None
         if not os.path.exists(args.out_dir) or not os.path.isdir(args.out_dir):
             try:
                 os.makedirs(args.out_dir)
             except Exception as e:
                 print(e)
                 exit_program(f'Can not create log directory: {args.out_dir}')
-        log_name = f'_mimic_log_{int(time.time())}_{Options.get_string_options()}.txt'
-        log_path = os.path.join(args.out_dir, log_name)
-        Log.__file = open(log_path, 'a', buffering=1)
+        log_name = f'_mimic_log_{int(time.time())}_{options.get_string_options()}'
+        if args.log in ('text', 'both'):
+            self.__path = os.path.join(args.out_dir, f'{log_name}.txt')
+            self.__file = open(self.__path, 'a', buffering=1)
+        if args.log in ('jsonl', 'both'):
+            self.__jsonl_path = os.path.join(args.out_dir, f'{log_name}.jsonl')
+            self.__jsonl_file = open(self.__jsonl_path, 'a', buffering=LOG_JSONL_BUFFER_SIZE)
+            self.__jsonl_queue = queue.Queue(LOG_JSONL_QUEUE_SIZE)
+            self.__jsonl_writer = threading.Thread(target=Log.__write_records,
+                                                   args=(self.__jsonl_file, self.__jsonl_queue), daemon=True)
+            self.__jsonl_writer.start()
         # log init settings
-        Log.write(f'{" ".join(sys.argv)}\nSearch directory: {args.sd}\n{SEPARATOR}')
+        self.__write(f'{" ".join(sys.argv)}\nSearch directory: {args.sd}\n{SEPARATOR}')
+        self.__write_record({'type': 'run', 'argv': sys.argv, 'sd': args.sd, 'options': options.get_string_options(),
+                             'time': time.time()})
+
+    # write the messages of the current context to this log
+    def start(self):
+        self.__token = Log.__current.set(self)
+
+    def stop(self):
+        if self.__token is not None:
+            Log.__current.reset(self.__token)
+            self.__token = None
 
     @staticmethod
     def write(message):
-        if Log.__file:
-            Log.__file.write(f'{message}\n\n')
+        log = Log.__current.get()
+        if log is not None:
+            log.__write(message)
+
+    def __write(self, message):
+        if self.__file:
+            self.__file.write(f'{message}\n\n')
+
+    # add JSON record to the JSON lines log
+    @staticmethod
+    def write_record(record):
+        log = Log.__current.get()
+        if log is not None:
+            log.__write_record(record)
+
+    def __write_record(self, record):
+        if self.__jsonl_queue:
+            self.__jsonl_queue.put(record)
+
+    # writer thread of the JSON lines log, None in the queue stops it
+    @staticmethod
+    def __write_records(file, records):
+        while True:
+            record = records.get()
+            if record is None:
+                break
+            file.write(json.dumps(record) + '\n')
+
+    def get_path(self):
+        return self.__path
+
+    def get_jsonl_path(self):
+        return self.__jsonl_path
 
     # Close log handle
+    def close(self):
+        self.stop()
+        if self.__file:
+            self.__file.close()
+            self.__file = None
+        if self.__jsonl_file:
+            self.__jsonl_queue.put(None)
+            self.__jsonl_writer.join()
+            self.__jsonl_file.close()
+            self.__jsonl_file = None
+            self.__jsonl_queue = None
+            self.__jsonl_writer = None
+
+
+# SQLite database with one row per sample and one row per transplanted part,
+# so samples can be found by the original, donor or part without walking the output directories.
+# Example: SELECT path FROM samples JOIN parts ON parts.sample_id = samples.id WHERE parts.kind = 'sign'
+class Manifest:
+    def __init__(self, path):
+        self.__path = path
+        self.__hashes = {}  # {file path: sha256}
+        self.__pending = 0
+        self.__connection = None
+        try:
+            self.__connection = sqlite3.connect(path, timeout=MANIFEST_TIMEOUT)
+            self.__connection.executescript('''
+                PRAGMA journal_mode = WAL;
+                CREATE TABLE IF NOT EXISTS samples (
+                    id INTEGER PRIMARY KEY,
+                    original TEXT, original_sha256 TEXT, original_size INTEGER,
+                    sample TEXT, path TEXT, container TEXT,
+                    donor TEXT, donor_sha256 TEXT, donor_size INTEGER,
+                    size INTEGER, checksum INTEGER, build_time REAL, time REAL);
+                CREATE TABLE IF NOT EXISTS parts (
+                    sample_id INTEGER REFERENCES samples(id),
+                    part TEXT, kind TEXT, description TEXT,
+                    donor TEXT, donor_sha256 TEXT);
+                CREATE INDEX IF NOT EXISTS samples_original ON samples(original_sha256);
+                CREATE INDEX IF NOT EXISTS samples_donor ON samples(donor_sha256);
+                CREATE INDEX IF NOT EXISTS parts_sample ON parts(sample_id);
+                CREATE INDEX IF NOT EXISTS parts_kind ON parts(kind);''')
+        except sqlite3.Error as e:
+            self.__connection = None
+            exit_program(f'Can not open the manifest: {path}\n{e}')
+
+    def get_path(self):
+        return self.__path
+
+    # donors keep only the transplanted parts in memory, so the file is read again
+    def __get_file_hash(self, path):
+        if path not in self.__hashes:
+            self.__hashes[path] = get_file_sha256(path)
+        return self.__hashes[path]
+
+    def write(self, pe, sample_name, sample_path, container, donor, parts, size, checksum, build_time):
+        if self.__connection is None:
+            return
+        donor_path = donor_hash = donor_size = None
+        if donor is not None and len(donor.get_source_donors()) == 1:
+            donor_path = donor.path
+            donor_hash = self.__get_file_hash(donor.path)
+            donor_size = donor.size
+        row = (os.path.abspath(pe.path), self.__get_file_hash(pe.path), pe.size, sample_name, sample_path, container,
+               donor_path, donor_hash, donor_size, size, checksum, build_time, time.time())
+        try:
+            cursor = self.__connection.execute(
+                'INSERT INTO samples (original, original_sha256, original_size, sample, path, container, '
+                'donor, donor_sha256, donor_size, size, checksum, build_time, time) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', row)
+            part_rows = []
+            for part, description in parts.items():
+                if part == 'message':
+                    continue
+                kind = part.split('_')[0]
+                source = MANIFEST_PART_SOURCES.get(kind) if donor is not None else None
+                part_donor = donor.get_part_donor(source) if source else None
+                part_rows.append((cursor.lastrowid, part, kind if source else part, description,
+                                  part_donor.path if part_donor else None,
+                                  self.__get_file_hash(part_donor.path) if part_donor else None))
+            self.__connection.executemany(
+                'INSERT INTO parts (sample_id, part, kind, description, donor, donor_sha256) VALUES (?, ?, ?, ?, ?, ?)',
+                part_rows)
+            self.__pending += 1
+            if self.__pending >= MANIFEST_COMMIT_ROWS:
+                self.__connection.commit()
+                self.__pending = 0
+        except sqlite3.Error as e:
+            msg = f'Can not write the sample to the manifest: {sample_name}\n{e}'
+            print(f'{Back.RED}{msg}{Back.RESET}')
+            Log.write(msg)
+
+    # add samples and parts of the shard manifest, the sample paths are moved to the merged directory
+    def merge(self, path, out_dir):
+        connection = self.__connection
+        try:
+            connection.execute('ATTACH DATABASE ? AS shard', (path,))
+            offset = connection.execute('SELECT COALESCE(MAX(id), 0) FROM samples').fetchone()[0]
+            connection.execute(
+                'INSERT INTO samples (id, original, original_sha256, original_size, sample, path, container, '
+                'donor, donor_sha256, donor_size, size, checksum, build_time, time) '
+                'SELECT id + ?, original, original_sha256, original_size, sample, '
+                'CASE WHEN path IS NULL THEN NULL ELSE ? || sample END, container, '
+                'donor, donor_sha256, donor_size, size, checksum, build_time, time FROM shard.samples',
+                (offset, os.path.join(out_dir, '')))
+            connection.execute(
+                'INSERT INTO parts (sample_id, part, kind, description, donor, donor_sha256) '
+                'SELECT sample_id + ?, part, kind, description, donor, donor_sha256 FROM shard.parts', (offset,))
+            connection.commit()
+            connection.execute('DETACH DATABASE shard')
+        except sqlite3.Error as e:
+            exit_program(f'Can not merge the manifest: {path}\n{e}')
+
+    def close(self):
+        if self.__connection is None:
+            return
+        try:
+            self.__connection.commit()
+        except sqlite3.Error as e:
+            print(f'{Back.RED}Can not save the manifest: {e}{Back.RESET}')
+        self.__connection.close()
+        self.__connection = None
+
+
+# Progress of the donor search of one original, saved to the output directory
+# every CHECKPOINT_INTERVAL seconds and on exit, so "-resume" continues the walk with the same sample numbers.
+# The position is the index of the current donor in the walk order with its path and "done" flag,
+# every donor before it is processed: its sample is saved or it is rejected.
+class Checkpoint:
+    def __init__(self, run, argv, state=None):
+        self.__run = run  # None when the search is finished
+        self.__path = os.path.join(run.out_dir, CHECKPOINT_FILE_NAME)
+        self.__argv = argv
+        self.__pending = collections.deque()  # (walk index, path) of the donors read ahead
+        self.__skip = 0                       # count of the walk paths processed before the resume
+        self.__check_index = 0                # walk index of the saved path, which must be the same on the resume
+        self.__check_path = None
+        self.__state = {'position': 0, 'path': None, 'done': False, 'counter': run.counter, 'limit': run.limit}
+        self.__last_save = 0
+        if state is not None:
+            run.counter = state['counter']
+            run.limit = state['limit']
+            run.donor_digests = {bytes.fromhex(digest) for digest in state['donor_digests']}
+            run.sample_digests = {bytes.fromhex(digest) for digest in state['sample_digests']}
+            self.__skip = state['position'] + int(state['done'])
+            self.__check_index = state['position']
+            self.__check_path = state['path']
+            self.__state = {key: state[key] for key in self.__state}
+        self.save()  # the crashed run can be resumed before the first interval ends
+
+    # read the checkpoint from the output directory of the interrupted run
     @staticmethod
-    def close():
-        if Log.__file:
-            Log.__file.close()
+    def load(path):
+        if os.path.isdir(path):
+            path = os.path.join(path, CHECKPOINT_FILE_NAME)
+        try:
+            with open(path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            exit_program(f'Can not read the checkpoint: {path}\n{e}')
+        if state['finished']:
+            exit_program(f'The run is already finished: {state["out_dir"]}', 0)
+        return state
+
+    # skip the paths processed before the resume.
+    # The resume is refused if the walk does not find the saved path at its position,
+    # as the processed donors can not be told apart from the others then.
+    def iter_paths(self, paths):
+        index = -1
+        for index, path in enumerate(paths):
+            if index == self.__check_index and self.__check_path not in (None, path):
+                self.__changed(path)
+            if index < self.__skip:
+                continue
+            self.__pending.append((index, path))
+            yield path
+        if index < self.__check_index and self.__check_path is not None:
+            self.__changed(None)
+
+    def __changed(self, path):
+        exit_program(f'Donor files changed since the checkpoint, the run can not be resumed.\n'
+                     f'Expected donor {self.__check_index + 1}: {self.__check_path}\n'
+                     f'Found: {path}')
+
+    # mark the loaded donor as the current one, when the next donor is taken the previous ones are processed
+    def iter_loaded(self, loaded):
+        for donor_path, data in loaded:
+            index, path = self.__pending.popleft()
+            while path != donor_path:  # unreadable files are processed too
+                index, path = self.__pending.popleft()
+            self.__set_position(index, path)
+            if time.monotonic() - self.__last_save >= CHECKPOINT_INTERVAL:
+                self.save()
+            yield donor_path, data
+
+    def __set_position(self, index, path, done=False):
+        run = self.__run
+        self.__state = {'position': index, 'path': path, 'done': done, 'counter': run.counter, 'limit': run.limit}
+
+    # the sample of the current donor is saved
+    def donor_done(self):
+        if self.__run is not None:
+            self.__set_position(self.__state['position'], self.__state['path'], True)
+
+    def save(self, finished=False):
+        run = self.__run
+        if run is None:
+            return
+        state = {'argv': self.__argv,
+                 'cwd': os.getcwd(),
+                 'in': os.path.abspath(run.path),
+                 'out_dir': os.path.abspath(run.out_dir),
+                 **self.__state,
+                 'donor_digests': [digest.hex() for digest in run.donor_digests],
+                 'sample_digests': [digest.hex() for digest in run.sample_digests],
+                 'finished': finished,
+                 'time': time.time()}
+        tmp_path = f'{self.__path}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.__path)
+        except OSError as e:
+            print(f'{Back.RED}Can not save the checkpoint: {e}{Back.RESET}')
+        self.__last_save = time.monotonic()
+
+    # mark the search as finished, so it is not resumed
+    def finish(self):
+        self.save(finished=True)
+        self.__run = None
+
+    # save the progress of the interrupted search
+    def close(self):
+        if self.__run is not None:
+            self.save()
+            self.__run = None
+
+
+# Content addressed cache of the samples for "-result-cache".
+# The key is the hash of the original file, the donor files of every part, the options and the seed,
+# so the rerun takes the sample from the cache instead of building it and links it to the output directory.
+# Every entry is the sample file and JSON with its size, sha256 and parts, both named by the key.
+class ResultCache:
+    def __init__(self, cache_dir):
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+        except OSError as e:
+            exit_program(f'Can not create the result cache directory: {cache_dir}\n{e}')
+        self.__dir = cache_dir
+        self.__hashes = {}  # {file path: sha256}
+
+    # hashes of the files are kept for the run
+    def __get_file_hash(self, path):
+        if path not in self.__hashes:
+            self.__hashes[path] = get_file_sha256(path)
+        return self.__hashes[path]
+
+    def get_donor_hashes(self, pe, donor):
+        return get_donor_hashes(pe, donor, self.__get_file_hash)
+
+    # get cache path of the sample, None if any of the files can not be read
+    def __get_path(self, pe, donor, args):
+        digest = hashlib.sha256(RESULT_CACHE_VERSION)
+        original_hash = self.__get_file_hash(pe.path)
+        if original_hash is None:
+            return None
+        update_digest(digest, b'original', bytes.fromhex(original_hash))
+        donor_hashes = self.get_donor_hashes(pe, donor)
+        if donor_hashes is None:
+            return None
+        for part, donor_hash in donor_hashes:
+            update_digest(digest, part.encode(), bytes.fromhex(donor_hash))
+        update_digest(digest, b'options', pe.options.get_string_options().encode())
+        update_digest(digest, b'args', json.dumps([getattr(args, name) for name in RESULT_CACHE_KEY_ARGS]).encode())
+        key = digest.hexdigest()
+        return os.path.join(self.__dir, key[:2], key)
+
+    # get the cached sample and fill its parts, None if there is no valid sample in the cache
+    def get(self, pe, donor, args, parts):
+        path = self.__get_path(pe, donor, args)
+        if path is None:
+            return None
+        try:
+            with open(f'{path}.json', 'r') as f:
+                entry = json.load(f)
+            size = os.path.getsize(path)
+        except (OSError, ValueError):
+            return None
+        # output samples are links to the cached files, so the changed sample is built again
+        if size != entry['size'] or get_file_sha256(path) != entry['sha256']:
+            return None
+        try:
+            sample = CachedSample(path)
+        except (OSError, ValueError):
+            return None
+        parts.update(entry['parts'])
+        return sample
+
+    # add sample to the cache, the saved sample file is linked if possible
+    def put(self, pe, donor, args, sample_data, parts, sample_path=None):
+        path = self.__get_path(pe, donor, args)
+        if path is None:
+            return
+        digest = hashlib.sha256()
+        for chunk in iter_sample_chunks(sample_data):
+            digest.update(chunk)
+        entry = {'size': len(sample_data),
+                 'sha256': digest.hexdigest(),
+                 'parts': {k: v for k, v in parts.items() if k != 'message'}}
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if sample_path is None or not link_file(sample_path, tmp_path):
+                write_sample_data(tmp_path, sample_data)
+            os.replace(tmp_path, path)
+            with open(tmp_path, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, f'{path}.json')
+        except OSError as e:
+            msg = f'Can not add the sample to the result cache: {e}'
+            print(f'{Back.RED}{msg}{Back.RESET}')
+            Log.write(msg)
+
+
+# Persistent cache of the donors useless for the search, for "-negative-cache".
+# Invalid PE files and the parts missing in the parsed donors are kept by path, size and modification time,
+# so the next runs skip the donors which can not give any selected part without opening them.
+class NegativeCache:
+    def __init__(self, path):
+        self.__connection = None
+        self.__donors = {}   # {path: (size, mtime, invalid, checked parts, present parts)}
+        self.__pending = 0
+        try:
+            self.__connection = sqlite3.connect(path, timeout=MANIFEST_TIMEOUT)
+            self.__connection.execute(
+                'CREATE TABLE IF NOT EXISTS donors (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, '
+                'invalid INTEGER, checked INTEGER, present INTEGER)')
+            self.__donors = {row[0]: row[1:] for row in
+                             self.__connection.execute('SELECT * FROM donors')}
+        except sqlite3.Error as e:
+            self.__connection = None
+            exit_program(f'Can not open the negative cache: {path}\n{e}')
+
+    @staticmethod
+    def __get_mask(parts):
+        return sum(1 << i for i, part in enumerate(parts) if part)
+
+    @staticmethod
+    def __get_stat_key(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    # check no original can accept the donor: evaluate_donor gives it only the score of the names and imports
+    @staticmethod
+    def __is_useless(record, options_list, args):
+        size, mtime, invalid, checked, present = record
+        if invalid:
+            return True
+        for options in options_list:
+            selected = NegativeCache.__get_mask((options.search_rich, options.search_stamp, options.search_sign,
+                                                 options.search_dbg, options.search_res, options.search_vi))
+            if selected & ~checked or selected & present:
+                return False
+            score = options.change_names + options.shuffle_imp
+            if score > 0 and score >= options.get_search_count() - int(args.approx):
+                return False
+        return True
+
+    # skip the donors useless for all options of the runs
+    def filter(self, paths, options_list, args, metrics=None):
+        if self.__connection is None or not options_list:
+            return paths
+        return self.__filter(paths, options_list, args, metrics)
+
+    def __filter(self, paths, options_list, args, metrics):
+        for path in paths:
+            record = self.__donors.get(path)
+            if record is not None and NegativeCache.__is_useless(record, options_list, args) and \
+                    NegativeCache.__get_stat_key(path) == tuple(record[:2]):
+                if metrics is not None:
+                    metrics.count('files_skipped', 'negative_cache')
+                continue
+            yield path
+
+    # keep the parts of the parsed donor, None donor is not valid PE
+    def add(self, path, options, donor):
+        if self.__connection is None:
+            return
+        stat_key = NegativeCache.__get_stat_key(path)
+        if stat_key is None:
+            return
+        if donor is None:
+            record = (*stat_key, 1, 0, 0)
+        else:
+            checked = NegativeCache.__get_mask((options.search_rich, options.search_stamp, options.search_sign,
+                                                options.search_dbg, options.search_res or options.search_vi,
+                                                options.search_res or options.search_vi))
+            present = NegativeCache.__get_mask((donor.rich, donor.stamp, donor.sign, donor.dbgs,
+                                                donor.res, donor.res and donor.res.vi))
+            old = self.__donors.get(path)
+            if old is not None and tuple(old[:2]) == stat_key and not old[2]:
+                # parts not parsed this time are kept from the previous runs
+                present |= old[4] & ~checked
+                checked |= old[3]
+            record = (*stat_key, 0, checked, present)
+        if self.__donors.get(path) == record:
+            return
+        self.__donors[path] = record
+        try:
+            self.__connection.execute('INSERT OR REPLACE INTO donors VALUES (?, ?, ?, ?, ?, ?)', (path, *record))
+            self.__pending += 1
+            if self.__pending >= NEGATIVE_CACHE_COMMIT_ROWS:
+                self.__connection.commit()
+                self.__pending = 0
+        except sqlite3.Error as e:
+            print(f'{Back.RED}Can not write the negative cache: {e}{Back.RESET}')
+
+    def close(self):
+        if self.__connection is None:
+            return
+        try:
+            self.__connection.commit()
+        except sqlite3.Error as e:
+            print(f'{Back.RED}Can not save the negative cache: {e}{Back.RESET}')
+        self.__connection.close()
+        self.__connection = None
+
+
+# Stores samples as lists of patches against the original file in one container file.
+# The container is a sequence of records: type (1 byte), payload size (8 bytes), payload.
+# Modified parts and donor blobs are stored once in the container and referenced by sha256.
+class DeltaStore:
+    def __init__(self, args, pe):
+        self.__path = os.path.join(args.out_dir, DELTA_FILE_NAME)
+        self.__blobs = set()  # hashes of the blobs written to this container
+        self.__file = open(self.__path, 'wb')
+        self.__file.write(DELTA_MAGIC)
+        original = {'path': os.path.abspath(pe.path),
+                    'size': pe.size,
+                    'sha256': hashlib.sha256(pe.data).hexdigest()}
+        self.__write_record(DELTA_RECORD_ORIGINAL, json.dumps(original).encode())
+
+    def get_path(self):
+        return self.__path
+
+    def __write_record(self, record_type, payload):
+        self.__file.write(record_type + len(payload).to_bytes(8, 'little'))
+        self.__file.write(payload)
+
+    def __add_blob(self, blob):
+        blob_hash = hashlib.sha256(blob).digest()
+        if blob_hash not in self.__blobs:
+            self.__file.write(DELTA_RECORD_BLOB + (len(blob_hash) + len(blob)).to_bytes(8, 'little'))
+            self.__file.write(blob_hash)
+            self.__file.write(blob)
+            self.__blobs.add(blob_hash)
+        return blob_hash.hex()
+
+    def write(self, sample_name, sample_data):
+        ops = []
+        segments = sample_data.segments if isinstance(sample_data, SampleData) else [sample_data]
+        for segment in segments:
+            if isinstance(segment, FileRange):
+                ops.append([DELTA_OP_COPY, segment.offset, segment.size])
+            else:
+                ops.append([DELTA_OP_BLOB, self.__add_blob(segment)])
+        sample = {'name': sample_name,
+                  'size': len(sample_data),
+                  'ops': ops}
+        self.__write_record(DELTA_RECORD_SAMPLE, json.dumps(sample).encode())
+
+    def close(self):
+        if self.__file:
+            self.__file.close()
+            self.__file = None
+
+
+# Streams samples into one tar or zip archive as they are created.
+# On close adds an index of samples with transplanted parts and the log.
+class ArchiveSink:
+    def __init__(self, args):
+        self.__index = []  # samples written to this archive
+        if args.archive == 'zip':
+            self.__path = os.path.join(args.out_dir, f'{ARCHIVE_FILE_NAME}.zip')
+            compression = zipfile.ZIP_DEFLATED if args.compress else zipfile.ZIP_STORED
+            self.__archive = zipfile.ZipFile(self.__path, 'w', compression=compression)
+            self.__is_zip = True
+        else:
+            ext = '.tar.gz' if args.compress else '.tar'
+            self.__path = os.path.join(args.out_dir, f'{ARCHIVE_FILE_NAME}{ext}')
+            # stream mode writes archive sequentially without seeking
+            self.__archive = tarfile.open(self.__path, 'w|gz' if args.compress else 'w|')
+            self.__is_zip = False
+
+    def get_path(self):
+        return self.__path
+
+    def write(self, name, data):
+        size = len(data)
+        if self.__is_zip:
+            info = zipfile.ZipInfo(name, date_time=time.localtime(time.time())[:6])
+            info.compress_type = self.__archive.compression
+            info.file_size = size
+            with self.__archive.open(info, 'w', force_zip64=size >= zipfile.ZIP64_LIMIT) as f:
+                for chunk in iter_sample_chunks(data):
+                    f.write(chunk)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = int(time.time())
+            info.mode = 0o644
+            self.__archive.addfile(info, SampleReader(data))
+
+    # add sample to the index
+    def add_index(self, sample_name, donor_path, parts, part_paths=None):
+        self.__index.append({'name': sample_name,
+                             'donor': donor_path,
+                             'donors': part_paths,
+                             'parts': {k: v for k, v in parts.items() if k != 'message'}})
+
+    # the closed log of the run is added to the archive
+    def close(self, log=None):
+        if self.__archive is None:
+            return
+        self.write(ARCHIVE_INDEX_NAME, json.dumps(self.__index, indent=2).encode())
+        for log_path in (log.get_path(), log.get_jsonl_path()) if log is not None else ():
+            if log_path and os.path.isfile(log_path):
+                with open(log_path, 'rb') as f:
+                    self.write(os.path.basename(log_path), f.read())
+        self.__archive.close()
+        self.__archive = None
 
 
 # contains information about PE section
@@ -659,7 +1527,8 @@ class MimicPart:
 class MimicPE:
     def __init__(self, path_to_file, e_lfanew, is_64, data, size, sections, rich,
                  stamp, sign, dbgs, res, baseofcode=0, entrypoint=0, imagebase=0,
-                 overlay=None, relocs=None, imports=None, section_alignment=None, file_alignment=None):
+                 overlay=None, relocs=None, imports=None, section_alignment=None, file_alignment=None,
+                 options=None, create_dbg_info=False):
         self.path = path_to_file
         self.name = os.path.splitext(os.path.split(path_to_file)[1])[0]
         self.ext = os.path.splitext(os.path.split(path_to_file)[1])[1]
@@ -681,6 +1550,274 @@ class MimicPE:
         self.imports = imports
         self.section_alignment = section_alignment
         self.file_alignment = file_alignment
+        self.options = options
+        # original PE cannot contain DebugInfo outside the .rsrc section at all
+        self.create_dbg_info = create_dbg_info
+        self.part_donors = None  # {part: donor} if the parts are taken from different donors
+
+    # get the donor which the part is taken from
+    def get_part_donor(self, part):
+        if self.part_donors is None:
+            return self
+        return self.part_donors[part]
+
+    # get the donor files which the parts are taken from
+    def get_source_donors(self):
+        if self.part_donors is None:
+            return [self]
+        return list({id(donor): donor for donor in self.part_donors.values()}.values())
+
+    # get {part: donor file path} if the parts are taken from different donors
+    def get_part_paths(self):
+        if self.part_donors is None:
+            return None
+        return {part: donor.path for part, donor in self.part_donors.items()}
+
+
+# state of the samples creation for one original file
+class MimicRun:
+    def __init__(self, path, out_dir, limit):
+        self.path = path
+        self.out_dir = out_dir
+        self.limit = limit
+        self.pe = None
+        self.error = None
+        self.counter = 0
+        self.donor_digests = set()   # digests of transplanted donor parts
+        self.sample_digests = set()  # digests of saved samples
+        # digests of the sample being built are added to the sets above when the donor is done,
+        # so the checkpoint does not make the resumed run skip the interrupted donor as a duplicate
+        self.donor_digest = None
+        self.sample_digest = None
+        self.duplicate_donors = 0
+        self.duplicate_samples = 0
+        self.samples = []  # [(sample name, donor path, {part: donor path} of combined donor, parts)]
+        # outputs of the run
+        self.log = None  # Log started in the context of the run
+        self.delta = None  # DeltaStore of "-delta"
+        self.archive = None  # ArchiveSink of "-archive"
+        self.manifest = None  # Manifest of "-manifest-db"
+        self.result_cache = None  # ResultCache of "-result-cache"
+        self.checkpoint = None  # Checkpoint of the search, saved for "-resume"
+        self.profiler = None  # Profiler of "-profile", started in the context of the run
+        # shared by the runs of the process and closed by the owner of the process
+        self.negative_cache = None  # NegativeCache of "-negative-cache"
+        self.metrics = None  # Metrics of "-metrics"
+
+    # the sample of the donor is saved or skipped, its digests are used to skip the next duplicates
+    def add_digests(self):
+        if self.donor_digest is not None:
+            self.donor_digests.add(self.donor_digest)
+        if self.sample_digest is not None:
+            self.sample_digests.add(self.sample_digest)
+        self.donor_digest = None
+        self.sample_digest = None
+
+    # take the outputs of the batch run, which closes them
+    def share_outputs(self, run):
+        self.archive = run.archive
+        self.manifest = run.manifest
+        self.result_cache = run.result_cache
+        self.negative_cache = run.negative_cache
+        self.metrics = run.metrics
+
+    # close the outputs of the run, the archive is the last as it takes the closed log
+    def close(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+        if self.manifest is not None:
+            self.manifest.close()
+        if self.delta is not None:
+            self.delta.close()
+        if self.log is not None:
+            self.log.close()
+        if self.archive is not None:
+            self.archive.close(self.log)
+
+
+# Keeps parsed donors and originals between the jobs of the daemon.
+# Donors are parsed with all search options, so one entry serves any job options.
+# Entries are checked against the file size and modification time before use.
+# Parsed donor parts are always kept. The transplanted donor ranges and the resource data, which is copied
+# into the parsed resources, are kept within the budget and the least recently used ones are dropped
+# and read again on demand.
+class MimicCache:
+    def __init__(self, budget=DAEMON_CACHE_MB * 1024 * 1024):
+        self.donors = collections.OrderedDict()  # {(path, manifest_allowed): (stat_key, donor or None)}, LRU first
+        self.originals = {}  # {(path, stat_key, options_key): MimicPE}
+        self.budget = budget
+        self.data_size = 0   # size of the donor bytes kept in memory
+        self.hits = 0        # donor found with its bytes
+        self.reloads = 0     # donor found without bytes, which were read again
+        self.misses = 0      # donor parsed
+        self.evictions = 0   # donor bytes dropped
+
+    def get_stats(self):
+        return {'donors': len(self.donors), 'originals': len(self.originals),
+                'donor_bytes': self.data_size, 'budget': self.budget,
+                'hits': self.hits, 'reloads': self.reloads, 'misses': self.misses, 'evictions': self.evictions}
+
+    @staticmethod
+    def get_stat_key(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    # get parsed donor or None if the file is not a valid donor
+    def get_donor(self, donor_path, args, negative_cache=None, metrics=None):
+        stat_key = self.get_stat_key(donor_path)
+        if stat_key is None:
+            return None
+        key = (donor_path, args.manifest_allowed)
+        entry = self.donors.get(key)
+        if entry is not None and entry[0] == stat_key:
+            self.donors.move_to_end(key)
+            donor = entry[1]
+            if donor is None:
+                self.hits += 1
+                return None
+            if donor.data is not None:
+                self.hits += 1
+                return donor
+            data = load_donor(donor_path, args.drop_cache)
+            if data is not None and metrics is not None:
+                metrics.count('bytes_read', value=len(data))
+            if data is not None and len(data) == donor.size:
+                self.reloads += 1
+                self.set_data(donor, data)
+                self.data_size += self.get_data_size(donor)
+                self.evict(key)
+                return donor
+        if entry is not None and entry[1] is not None and entry[1].data is not None:
+            self.data_size -= self.get_data_size(entry[1])
+        self.misses += 1
+        donor = None
+        data = load_donor(donor_path, args.drop_cache)
+        if data is not None:
+            if metrics is not None:
+                metrics.count('bytes_read', value=len(data))
+            donor = parse_donor(donor_path, data, args, Options(), negative_cache, metrics)
+        self.donors[key] = (stat_key, donor)
+        self.donors.move_to_end(key)
+        if donor is not None:
+            self.data_size += self.get_data_size(donor)
+            self.evict(key)
+        return donor
+
+    # get parsed donors of the paths, the stage of the donor search pipeline
+    def iter_donors(self, paths, args, negative_cache=None, metrics=None):
+        for donor_path in paths:
+            if metrics is not None:
+                metrics.count('files_seen')
+            donor = self.get_donor(donor_path, args, negative_cache, metrics)
+            if donor is not None:
+                yield donor
+
+    # drop the bytes of the least recently used donors until they fit the budget.
+    # samples in progress keep their own reference to the bytes.
+    def evict(self, keep_key):
+        for key, (_, donor) in self.donors.items():
+            if self.data_size <= self.budget:
+                break
+            if key == keep_key or donor is None or donor.data is None:
+                continue
+            self.data_size -= self.get_data_size(donor)
+            self.drop_data(donor)
+            self.evictions += 1
+
+    # get data entries of the donor resources, VersionInfo included
+    @staticmethod
+    def iter_res_data(donor):
+        if donor.res is None:
+            return
+        entries = list(donor.res.entries)
+        if donor.res.vi is not None:
+            entries.append(donor.res.vi)
+        while entries:
+            entry = entries.pop()
+            if entry.is_data_next:
+                yield entry.entry
+            else:
+                entries.extend(entry.entry.entries)
+
+    # get size of the donor bytes kept in memory
+    def get_data_size(self, donor):
+        return donor.data.kept_size + sum(len(res_data.data_bytes) for res_data in self.iter_res_data(donor))
+
+    # set the donor bytes from the donor file read again
+    def set_data(self, donor, data):
+        donor.data = DonorData(data, get_donor_ranges(donor))
+        for res_data in self.iter_res_data(donor):
+            res_data.data_bytes = data[res_data.data_offset:res_data.data_offset + res_data.data_size]
+
+    def drop_data(self, donor):
+        donor.data = None
+        for res_data in self.iter_res_data(donor):
+            res_data.data_bytes = None
+
+    # get checked original with its own options
+    def get_original(self, path, args, options):
+        stat_key = self.get_stat_key(path)
+        options_key = (options.get_string_options(), args.store_dbg_to_rsrc, args.manifest_allowed)
+        key = (path, stat_key, options_key)
+        pe = self.originals.get(key)
+        if pe is None:
+            # the original is read instead of being mapped, so the file is not locked between the jobs
+            try:
+                with open(path, 'rb') as file:
+                    data = file.read()
+            except OSError as e:
+                original_failed(f'Can not read the original file: {e}.')
+            pe = parse_original(path, data, args, options)
+            if len(self.originals) >= DAEMON_ORIGINALS_LIMIT:
+                self.originals.pop(next(iter(self.originals)))
+            self.originals[key] = pe
+        return pe
+
+
+# handles jobs of the daemon
+class MimicRequestHandler(http.server.BaseHTTPRequestHandler):
+    cache = None
+    args = None
+    negative_cache = None
+    metrics = None
+
+    def send_json(self, code, result):
+        body = json.dumps(result, indent=1).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # returns cache summary and counters
+    def do_GET(self):
+        self.send_json(200, self.cache.get_stats())
+
+    # runs the job from the JSON body
+    def do_POST(self):
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except (ValueError, TypeError) as e:
+            self.send_json(400, {'error': f'Invalid job: {e}.'})
+            return
+        try:
+            result = run_daemon_job(job, self.args, self.cache, self.negative_cache, self.metrics)
+        except Exception as e:
+            # the unexpected error fails only this job, its traceback is shown in the daemon output
+            msg = f'Job failed: {type(e).__name__}: {e}'
+            print(f'{Back.RED}{msg}{Back.RESET}')
+            traceback.print_exc()
+            self.send_json(500, {'error': f'{msg}.'})
+            return
+        self.send_json(400 if 'error' in result else 200, result)
+
+    def log_message(self, format, *args):
+        Log.write(format % args)
 
 
 # contains information of rich header
@@ -732,6 +1869,14 @@ class ImportDir:
         self.dll_count = dll_count
         self.func_count = func_count
         self.va_list = va_list
+        # offsets of the sequentially placed names and OFT/FT structs, -1 if they are scattered
+        self.name_min_offset = -1
+        self.name_max_offset = -1
+        self.oft_min_offset = -1
+        self.ft_min_offset = -1
+        self.oft_delta = -1
+        self.ft_delta = -1
+        self.calls = {}  # {func_offset : [instruction_objs]}
 
 
 # contains information of imported dll
@@ -821,6 +1966,244 @@ class RelocEntry:
         self.offset = rva + self.rva_offset - delta
 
 
+# contains range of the unmodified original file
+class FileRange:
+    __slots__ = ('offset', 'size')
+
+    def __init__(self, offset, size):
+        self.offset = offset
+        self.size = size
+
+
+# Contains sample data as a sequence of segments.
+# Segment is either a bytes object with modified data or a FileRange of the original file,
+# so unmodified parts of the original are never copied into memory.
+# Supports slicing and concatenation in the same way as bytearray.
+class SampleData:
+    def __init__(self, source, path, segments):
+        self.source = source  # mapped original file
+        self.path = path      # path to the original file to copy ranges from
+        self.segments = []
+        self.starts = []
+        self.size = 0
+        for segment in segments:
+            self.__append(segment)
+
+    @staticmethod
+    def from_original(pe):
+        return SampleData(pe.data, pe.path, [FileRange(0, pe.size)])
+
+    def __append(self, segment):
+        if isinstance(segment, FileRange):
+            if segment.size <= 0:
+                return
+            last = self.segments[-1] if self.segments else None
+            if isinstance(last, FileRange) and last.offset + last.size == segment.offset:
+                self.segments[-1] = FileRange(last.offset, last.size + segment.size)
+                self.size += segment.size
+                return
+            size = segment.size
+        else:
+            size = len(segment)
+            if size == 0:
+                return
+            last = self.segments[-1] if self.segments else None
+            # join small modified parts to keep the segment list short
+            if last is not None and not isinstance(last, FileRange) and len(last) + size <= SAMPLE_SLICE_BYTES_LIMIT:
+                self.segments[-1] = bytes(last) + segment
+                self.size += size
+                return
+            # memoryview refers to the donor blob without copying it,
+            # bytearray is copied as it can be changed after concatenation
+            if isinstance(segment, bytearray) or (isinstance(segment, memoryview) and size <= SAMPLE_SLICE_BYTES_LIMIT):
+                segment = bytes(segment)
+        self.starts.append(self.size)
+        self.segments.append(segment)
+        self.size += size
+
+    def __len__(self):
+        return self.size
+
+    # get segment index by sample offset
+    def __find(self, offset):
+        lo = 0
+        hi = len(self.starts) - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.starts[mid] <= offset:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+    # get segments between two sample offsets
+    def __slice_segments(self, start, stop):
+        result = []
+        if start >= stop:
+            return result
+        i = self.__find(start)
+        while i < len(self.segments) and self.starts[i] < stop:
+            segment = self.segments[i]
+            seg_start = self.starts[i]
+            fst = max(start, seg_start) - seg_start
+            lst = min(stop, seg_start + self.__segment_size(segment)) - seg_start
+            if isinstance(segment, FileRange):
+                result.append(FileRange(segment.offset + fst, lst - fst))
+            else:
+                result.append(segment[fst:lst])
+            i += 1
+        return result
+
+    @staticmethod
+    def __segment_size(segment):
+        return segment.size if isinstance(segment, FileRange) else len(segment)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step != 1:
+                raise ValueError('SampleData does not support slice step.')
+            segments = self.__slice_segments(start, stop)
+            # the head and the tail of the sample are concatenated with the changed parts,
+            # so they keep the original ranges whatever their size is
+            if 0 < start and stop < self.size and stop - start < SAMPLE_SLICE_BYTES_LIMIT:
+                return b''.join(self.segment_bytes(s) for s in segments)
+            return SampleData(self.source, self.path, segments)
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError('SampleData index out of range')
+        i = self.__find(key)
+        segment = self.segments[i]
+        index = key - self.starts[i]
+        if isinstance(segment, FileRange):
+            return self.source[segment.offset + index]
+        return segment[index]
+
+    def __add__(self, other):
+        if isinstance(other, SampleData):
+            segments = self.segments + other.segments
+        elif isinstance(other, (bytes, bytearray, memoryview)):
+            segments = self.segments + [other]
+        else:
+            return NotImplemented
+        return SampleData(self.source, self.path, segments)
+
+    def __radd__(self, other):
+        if isinstance(other, (bytes, bytearray, memoryview)):
+            return SampleData(self.source, self.path, [other] + self.segments)
+        return NotImplemented
+
+    # get bytes of the segment
+    def segment_bytes(self, segment):
+        if isinstance(segment, FileRange):
+            return self.source[segment.offset:segment.offset + segment.size]
+        return segment
+
+    # iterate over sample data in chunks without joining it into one buffer
+    def iter_chunks(self, chunk_size):
+        for segment in self.segments:
+            if isinstance(segment, FileRange):
+                offset = segment.offset
+                end = segment.offset + segment.size
+                while offset < end:
+                    yield self.source[offset:min(offset + chunk_size, end)]
+                    offset += chunk_size
+            else:
+                yield segment
+
+    def has_file_ranges(self):
+        return any(isinstance(s, FileRange) for s in self.segments)
+
+    def to_bytearray(self):
+        return bytearray(b''.join(self.segment_bytes(s) for s in self.segments))
+
+
+# sample taken from the result cache, the cached file is mapped instead of being read.
+# "path" is the cached file, which is linked to the output directory.
+class CachedSample(SampleData):
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            source = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        super().__init__(source, path, [FileRange(0, len(source))])
+
+
+# Contains only the donor byte ranges, which can be transplanted, instead of the whole donor file.
+# Supports slicing by the donor file offsets in the same way as bytearray inside the kept ranges.
+class DonorData:
+    def __init__(self, data, ranges):
+        self.size = len(data)
+        self.starts = []
+        self.chunks = []
+        merged = []
+        for start, stop in sorted(ranges):
+            stop = min(stop, self.size)
+            if start >= stop:
+                continue
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], stop)
+            else:
+                merged.append([start, stop])
+        for start, stop in merged:
+            self.starts.append(start)
+            self.chunks.append(bytes(data[start:stop]))
+        self.kept_size = sum(len(chunk) for chunk in self.chunks)
+
+    def __len__(self):
+        return self.size
+
+    # get kept chunk and its index by donor file offsets
+    def __find(self, start, stop):
+        i = bisect.bisect_right(self.starts, start) - 1
+        if i < 0 or stop > self.starts[i] + len(self.chunks[i]):
+            raise IndexError(f'Donor range {start}-{stop} is not kept.')
+        return self.chunks[i], start - self.starts[i]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step != 1:
+                raise ValueError('DonorData does not support slice step.')
+            if start >= stop:
+                return b''
+            chunk, index = self.__find(start, stop)
+            return chunk[index:index + stop - start]
+        if key < 0:
+            key += self.size
+        chunk, index = self.__find(key, key + 1)
+        return chunk[index]
+
+    # get range without copying it
+    def view(self, start, stop):
+        if start >= stop:
+            return b''
+        chunk, index = self.__find(start, stop)
+        return memoryview(chunk)[index:index + stop - start]
+
+
+# file-like reader of the sample data
+class SampleReader:
+    def __init__(self, sample_data):
+        self.chunks = iter_sample_chunks(sample_data)
+        self.chunk = b''
+        self.pos = 0
+
+    def read(self, size=-1):
+        result = bytearray()
+        while size < 0 or len(result) < size:
+            if self.pos >= len(self.chunk):
+                self.chunk = next(self.chunks, None)
+                self.pos = 0
+                if self.chunk is None:
+                    self.chunk = b''
+                    break
+                continue
+            end = len(self.chunk) if size < 0 else min(len(self.chunk), self.pos + size - len(result))
+            result += self.chunk[self.pos:end]
+            self.pos = end
+        return bytes(result)
+
+
 # cleanup and exit
 def exit_program(message='', code=2):
     colors = {0: Back.BLACK,
@@ -829,11 +2212,51 @@ def exit_program(message='', code=2):
     if message:
         print(f'{colors[code]}{message}{Back.RESET}')
         Log.write(message)
-    Log.close()
     print('Exiting the program...')
     sys.exit(code)
 
 
+# raised instead of exiting when the original file can not be processed in non-interactive run
+class OriginalError(Exception):
+    pass
+
+
+# raised when the donor exceeds "-max-parse-ms" or "-max-res-entries", "reason" is the metrics label
+class DonorLimitError(Exception):
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+# Limits of one donor parsing, created for every donor and passed to the parsing functions,
+# so the donors parsed in parallel threads do not share them. Parsing loops call the checks,
+# so a crafted or corrupted donor is skipped instead of stalling the scan. Originals are not limited.
+class DonorLimits:
+    def __init__(self, args):
+        self.__parse_ms = args.max_parse_ms
+        self.__deadline = time.monotonic() + args.max_parse_ms / 1000 if args.max_parse_ms else None
+        self.__max_res_entries = args.max_res_entries
+        self.__res_entries = args.max_res_entries if args.max_res_entries else None  # remaining resource entries
+
+    def check_time(self):
+        if self.__deadline is not None and time.monotonic() > self.__deadline:
+            raise DonorLimitError('parse_time_limit', f'parse time is over {self.__parse_ms} ms')
+
+    def count_res_entry(self):
+        if self.__res_entries is not None:
+            self.__res_entries -= 1
+            if self.__res_entries < 0:
+                raise DonorLimitError('res_entries_limit', f'more than {self.__max_res_entries} resource entries')
+        self.check_time()
+
+
+# exit the program or raise OriginalError in non-interactive run
+def original_failed(message, code=2):
+    if not INTERACTIVE:
+        raise OriginalError(message)
+    exit_program(message, code)
+
+
 # exit the program with Ctrl + C
 def signal_handler(sig, frame):
     exit_program('KeyboardInterrupt.', 1)
@@ -844,6 +2267,8 @@ def continue_or_exit_msg(message=''):
     if message:
         print(f'{Back.RED}{message}{Back.RESET}')
         Log.write(message)
+    if not INTERACTIVE:
+        return
     print(f'Press {Back.GREEN}Enter{Back.RESET} to continue or {Back.RED}Ctrl + C{Back.RESET} to exit...')
     input()
 
@@ -902,7 +2327,7 @@ def resource_offset_is_valid(offset, prev_offsets, eof, checking_original):
         return False
 
     if offset not in prev_offsets:
-        prev_offsets.append(offset)
+        prev_offsets.add(offset)
         return True
     else:
         if checking_original:
@@ -915,7 +2340,8 @@ def resource_offset_is_valid(offset, prev_offsets, eof, checking_original):
 
 
 # recursively collect all resource entryes
-def get_resource_entries(data, entry_offset, start_offset, offset_va_delta, eof, checking_original, prev_offsets, lvl):
+def get_resource_entries(data, entry_offset, start_offset, offset_va_delta, eof, checking_original, prev_offsets, lvl,
+                         limits=None):
     if lvl > 32:
         if checking_original:
             message = f'Original file contains invalid resource depth.\n' \
@@ -937,6 +2363,8 @@ def get_resource_entries(data, entry_offset, start_offset, offset_va_delta, eof,
         entry_name_indent = int.from_bytes(name_id_bytes[:-1], 'little')
         entry_name_offset = entry_name_indent + start_offset
         entry_bname = get_name_from_offset(data, entry_name_offset)
+    if limits is not None:
+        limits.count_res_entry()
 
     indent_bytes = data[entry_offset + 4:entry_offset + 8]
     next_entry_indent = int.from_bytes(indent_bytes, 'little')
@@ -966,7 +2394,8 @@ def get_resource_entries(data, entry_offset, start_offset, offset_va_delta, eof,
             offset = fst_offset + i * 8
             if not resource_offset_is_valid(offset, prev_offsets, eof, checking_original):
                 return None
-            entry = get_resource_entries(data, offset, start_offset, offset_va_delta, eof, checking_original, prev_offsets, lvl=lvl + 1)
+            entry = get_resource_entries(data, offset, start_offset, offset_va_delta, eof, checking_original, prev_offsets, lvl=lvl + 1,
+                                         limits=limits)
             if entry is None:
                 return None
             else:
@@ -985,8 +2414,8 @@ def get_resource_entries(data, entry_offset, start_offset, offset_va_delta, eof,
 
 
 # collect all resource tables, entries and data
-def get_resource_info(data, res_dir_offset, offset_va_delta, eof, manifest_allowed, checking_original):
-    prev_offsets = []
+def get_resource_info(data, res_dir_offset, offset_va_delta, eof, manifest_allowed, checking_original, limits=None):
+    prev_offsets = set()  # checked for every entry, so the list would make big resource trees quadratic
     res_dir_struct = data[res_dir_offset:res_dir_offset + 16]
     res_dir = ResDir(res_dir_offset, res_dir_struct)
     i = 0
@@ -996,7 +2425,8 @@ def get_resource_info(data, res_dir_offset, offset_va_delta, eof, manifest_allow
         if not resource_offset_is_valid(offset, prev_offsets, eof, checking_original):
             return None
 
-        entry = get_resource_entries(data, offset, res_dir_offset, offset_va_delta, eof, checking_original, prev_offsets, lvl=0)
+        entry = get_resource_entries(data, offset, res_dir_offset, offset_va_delta, eof, checking_original, prev_offsets, lvl=0,
+                                     limits=limits)
         if entry is None:
             return None
         if entry.id is not None:
@@ -1069,6 +2499,9 @@ def get_flat_resources(res_dir):
     lvl = 0
 
     if res_dir.vi is not None:
+        # VersionInfo is placed into the copy of the entries list to keep the parsed resources unchanged
+        res_dir = copy.copy(res_dir)
+        res_dir.entries = list(res_dir.entries)
         if res_dir.vi_idx >= 0:
             res_dir.entries.insert(res_dir.vi_idx, res_dir.vi)
         else:
@@ -1083,7 +2516,8 @@ def get_flat_resources(res_dir):
 
 
 # collect all PE resources
-def get_resources(data, e_lfanew, is_64, sections, eof, manifest_allowed, checking_original=False):
+@Profiler.stage('get_resources')
+def get_resources(data, e_lfanew, is_64, sections, eof, manifest_allowed, checking_original=False, limits=None):
     if is_64:
         hdr_offset = e_lfanew + 152  # Resource Directory if PE32+: e_lfanew + 4 + 20 + 128
     else:
@@ -1108,7 +2542,7 @@ def get_resources(data, e_lfanew, is_64, sections, eof, manifest_allowed, checki
                       f'Delta offset-va:           {delta_offset_va}.'
             continue_or_exit_msg(message)
         return None
-    res_structs = get_resource_info(data, res_dir_offset, delta_offset_va, eof, manifest_allowed, checking_original)
+    res_structs = get_resource_info(data, res_dir_offset, delta_offset_va, eof, manifest_allowed, checking_original, limits)
     return res_structs
 
 
@@ -1141,17 +2575,62 @@ def update_checksum_py(data):
     return data[:checksum_offset] + checksum_bytes + data[checksum_offset + 4:]
 
 
+# Returns SampleData with updated checksum.
+# Sums dwords chunk by chunk, so the original ranges are not joined into one buffer.
+def update_checksum_segments(data: SampleData):
+    e_lfanew = int.from_bytes(data[0x3c:0x40], 'little')
+    checksum_offset = e_lfanew + 4 + 20 + 64  # both PE32 and PE32+
+    data_len = len(data)
+
+    total = 0
+    tail = b''
+    for chunk in data.iter_chunks(CHECKSUM_CHUNK_SIZE):
+        if tail:
+            chunk = tail + chunk
+        aligned = len(chunk) - len(chunk) % 4
+        dwords = array.array(CHECKSUM_ARRAY_TYPE)
+        dwords.frombytes(memoryview(chunk)[:aligned])
+        if sys.byteorder == 'big':
+            dwords.byteswap()
+        total += sum(dwords)
+        tail = bytes(chunk[aligned:])  # memoryview segments can not be concatenated
+    if tail:
+        total += int.from_bytes(tail + b'\x00' * (4 - len(tail)), 'little')
+    # skip the checksum field
+    skip_offset = checksum_offset - checksum_offset % 4
+    skip_bytes = data[skip_offset:skip_offset + 4]
+    total -= int.from_bytes(skip_bytes + b'\x00' * (4 - len(skip_bytes)), 'little')
+
+    # equals to the carry folding after each dword in update_checksum_py
+    checksum = (total - 1) % 0xffffffff + 1 if total > 0 else 0
+    checksum = (checksum & 0xffff) + (checksum >> 16)
+    checksum = checksum + (checksum >> 16)
+    checksum = checksum & 0xffff
+    checksum = checksum + data_len
+
+    checksum_bytes = checksum.to_bytes(4, 'little')
+    return data[:checksum_offset] + checksum_bytes + data[checksum_offset + 4:]
+
+
 # update PE checksum
+@Profiler.stage('update_checksum')
 def update_checksum(data, parts):
     global USE_CHECKSUM_DLL, DLL_CHECKSUM_FUNC, CHECKSUM_32_DLL_NAME, CHECKSUM_64_DLL_NAME, INTERPRETER_IS_64
     parts['chs'] = 'Checksum updated.'
+    if isinstance(data, SampleData):
+        # the sample keeps the original ranges, only the checksum field is changed
+        if data.has_file_ranges():
+            return update_checksum_segments(data)
+        data = data.to_bytearray()
+    elif not isinstance(data, bytearray):
+        data = bytearray(data)  # the checksum dll updates the buffer in place
     if USE_CHECKSUM_DLL is None:
         module_path = os.path.dirname(os.path.abspath(__file__))
         if INTERPRETER_IS_64:  # python interpreter is 64 bit
             dll_path = os.path.join(module_path, CHECKSUM_64_DLL_NAME)
         else:
             dll_path = os.path.join(module_path, CHECKSUM_32_DLL_NAME)
-        if os.path.exists(dll_path):
+        if os.path.exists(dll_path) and hasattr(ct, 'WinDLL'):  # checksum dll is available on Windows only
             dll = ct.WinDLL(dll_path)
             DLL_CHECKSUM_FUNC = dll.UpdChecksum
             DLL_CHECKSUM_FUNC.argtypes = [ct.POINTER(ct.c_ubyte), ct.c_uint32]
@@ -1170,7 +2649,8 @@ def update_checksum(data, parts):
 
 
 # collect PE sections data
-def get_sections(data, e_lfanew, eof, checking_original=False):
+@Profiler.stage('get_sections')
+def get_sections(data, e_lfanew, eof, checking_original=False, limits=None):
     sec_count = int.from_bytes(data[e_lfanew + 6:e_lfanew + 8], 'little')  # NumberOfSections
     sooh = int.from_bytes(data[e_lfanew + 20:e_lfanew + 22], 'little')  # SizeOfOptionalHeader: e_lfanew + 4 + 16
     sec_table_offset = e_lfanew + 24 + sooh  # Section Table: e_lfanew + 4 + 20 + SizeOfOptionalHeader
@@ -1181,12 +2661,14 @@ def get_sections(data, e_lfanew, eof, checking_original=False):
                       f'NumberOfSections: {sec_count}\n' \
                       f'SizeOfOptionalHeader: {sooh}\n' \
                       f'Section Table offset: {sec_table_offset}'
-            exit_program(message)
+            original_failed(message)
         return None
 
     sections = []
     i = sec_count
     while i > 0:
+        if limits is not None:
+            limits.check_time()  # NumberOfSections of the donor can be up to 65535
         sections.append(Section(struct_offset=sec_table_offset,
                                 section_struct=data[sec_table_offset:sec_table_offset + 40]))
         i -= 1
@@ -1197,6 +2679,7 @@ def get_sections(data, e_lfanew, eof, checking_original=False):
 
 
 # change source PE section names to donor PE section names
+@Profiler.stage('change_section_names')
 def change_section_names(sample_data, sections_orig, sections_donor, parts):
     osc = len(sections_orig)    # original section counter
     dsc = len(sections_donor)   # donor section counter
@@ -1245,6 +2728,7 @@ def get_space_for_rich(data, e_lfanew):
 
 # get PE rich
 # if original PE does not contain rich header, then a search will be made for a space to place it
+@Profiler.stage('get_rich')
 def get_rich(data, e_lfanew, remove_mode=False, checking_original=False):
     global RICH_MARK, DANS_MARK_B, RICH_START_OFFSET, RICH_MIN_SIZE
     rich_tail_offset = 0
@@ -1405,8 +2889,8 @@ def fix_rich_checksum(data, start_offset, rich: RichParsed, e_lfanew):
 # get debug info
 # if original PE does not contain debug info and store_to_rsrc == True,
 # then donor debug info will be placed in resources
-def get_dbg(data, e_lfanew, is_64, sections, eof, checking_original=False, store_to_rsrc=False):
-    global CREATE_DEBUG_INFO_SESSION
+@Profiler.stage('get_dbg')
+def get_dbg(data, e_lfanew, is_64, sections, eof, checking_original=False, store_to_rsrc=False, limits=None):
     if is_64:
         hdr_offset = e_lfanew + 184  # Debug Directory if PE32+: e_lfanew + 4 + 20 + 160
     else:
@@ -1418,7 +2902,6 @@ def get_dbg(data, e_lfanew, is_64, sections, eof, checking_original=False, store
             print(f'{Back.CYAN}{message}{Back.RESET}')
             Log.write(message)
             if store_to_rsrc:
-                CREATE_DEBUG_INFO_SESSION = True
                 return [MimicPart(hdr_offset=hdr_offset,
                                   hdr_size=8,
                                   struct_offset=0,
@@ -1438,7 +2921,6 @@ def get_dbg(data, e_lfanew, is_64, sections, eof, checking_original=False, store
                       f'Struct full size: {struct_full_size}.'
             continue_or_exit_msg(message)
             if store_to_rsrc:
-                CREATE_DEBUG_INFO_SESSION = True
                 return [MimicPart(hdr_offset=hdr_offset,
                                   hdr_size=8,
                                   struct_offset=0,
@@ -1450,11 +2932,15 @@ def get_dbg(data, e_lfanew, is_64, sections, eof, checking_original=False, store
 
     dbgs = []
     while struct_count > 0:
+        if limits is not None:
+            limits.check_time()
         check_start = int.from_bytes(data[struct_offset:struct_offset + 4], 'little')
         data_va = int.from_bytes(data[struct_offset + 20:struct_offset + 24], 'little')
         data_offset = int.from_bytes(data[struct_offset + 24:struct_offset + 28], 'little')
         data_size = int.from_bytes(data[struct_offset + 16:struct_offset + 20], 'little')
-        if check_start != 0 or data_offset > data_va or data_offset >= eof or data_size >= eof:
+        # entries past the end of file are read as zeros, so they are invalid too
+        if check_start != 0 or data_offset > data_va or data_offset >= eof or data_size >= eof or \
+                struct_offset + 28 > eof:
             if checking_original:
                 message = f'Original file contains invalid Debug Directory entry at {hex(struct_offset)}.\n' \
                           f'Entry check bytes: {check_start}.\n' \
@@ -1463,7 +2949,6 @@ def get_dbg(data, e_lfanew, is_64, sections, eof, checking_original=False, store
                           f'Entry SizeOfData: {data_size}.'
                 continue_or_exit_msg(message)
                 if store_to_rsrc:
-                    CREATE_DEBUG_INFO_SESSION = True
                     return [MimicPart(hdr_offset=hdr_offset,
                                       hdr_size=8,
                                       struct_offset=0,
@@ -1483,6 +2968,7 @@ def get_dbg(data, e_lfanew, is_64, sections, eof, checking_original=False, store
 
 
 # get time stamp
+@Profiler.stage('get_stamp')
 def get_stamp(data, e_lfanew, remove_mode=False, checking_original=False):
     tds_offset = e_lfanew + 8
     if data[tds_offset:tds_offset + 4] == b'\x00\x00\x00\x00':
@@ -1499,6 +2985,7 @@ def get_stamp(data, e_lfanew, remove_mode=False, checking_original=False):
 
 
 # get authenticode sign
+@Profiler.stage('get_sign')
 def get_sign(data, e_lfanew, is_64, eof, remove_mode=False, checking_original=False):
     if is_64:
         hdr_offset = e_lfanew + 168  # Security Directory if PE32+: e_lfanew + 4 + 20 + 144
@@ -1754,6 +3241,7 @@ def get_dll_funcs(data, eof, sections, IAT_section, lib, pe_is_64, imagebase, va
     return functions
 
 
+@Profiler.stage('get_imports')
 def get_imports(data, e_lfanew, is_64, sections, eof, baseofcode, entrypoint, imagebase):
     global IMPORT_DLL_STRUCT_SIZE, IMPORT_DLL_EMPTY_STRUCT
     if is_64:
@@ -1822,7 +3310,6 @@ def get_imports(data, e_lfanew, is_64, sections, eof, baseofcode, entrypoint, im
         func_count += len(lib.funcs)
         dll_offset += IMPORT_DLL_STRUCT_SIZE
         index += 1
-    check_import_offsets(dlls)
     imports = ImportDir(hdr_offset=hdr_offset,
                         struct_offset=struct_offset,
                         struct_size=struct_size,
@@ -1830,13 +3317,14 @@ def get_imports(data, e_lfanew, is_64, sections, eof, baseofcode, entrypoint, im
                         dll_count=dll_count,
                         func_count=func_count,
                         va_list=va_list)
+    check_import_offsets(imports)
     collect_import_calls(data, imports, sections, baseofcode, entrypoint, imagebase, is_64)
     return imports
 
 
 # get the lowest name offset
-def check_import_offsets(dlls):
-    global IMPORT_NAME_MIN_OFFSET, IMPORT_NAME_MAX_OFFSET, IMPORT_OFT_MIN_OFFSET, IMPORT_FT_MIN_OFFSET, IMPORT_OFT_DELTA, IMPORT_FT_DELTA
+def check_import_offsets(imports):
+    dlls = imports.dlls
     func_names = []
     dll_padded_names = []
     dll_not_padded_names = []
@@ -1870,8 +3358,8 @@ def check_import_offsets(dlls):
         else:
             name_ok = True
     if name_ok:
-        IMPORT_NAME_MIN_OFFSET = name_sequence[0]
-        IMPORT_NAME_MAX_OFFSET = name_sequence[-1]
+        imports.name_min_offset = name_sequence[0]
+        imports.name_max_offset = name_sequence[-1]
     # check oft and ft structs for sequential placement
     oft_sequence.sort()
     for i in range(1, len(oft_sequence)):
@@ -1888,17 +3376,16 @@ def check_import_offsets(dlls):
     else:
         ft_ok = len(ft_sequence) > 0
     if oft_ok:
-        IMPORT_OFT_MIN_OFFSET = oft_sequence[0]
-        IMPORT_OFT_DELTA = dlls[0].oft_delta
+        imports.oft_min_offset = oft_sequence[0]
+        imports.oft_delta = dlls[0].oft_delta
     if ft_ok:
-        IMPORT_FT_MIN_OFFSET = ft_sequence[0]
-        IMPORT_FT_DELTA = dlls[0].ft_delta
+        imports.ft_min_offset = ft_sequence[0]
+        imports.ft_delta = dlls[0].ft_delta
 
 
-def shuffle_names(sample_data, pe, imports):
-    global IMPORT_NAME_MIN_OFFSET, IMPORT_NAME_MAX_OFFSET
-    offset = IMPORT_NAME_MIN_OFFSET
-    max_offset = IMPORT_NAME_MAX_OFFSET
+def shuffle_names(sample_data, pe, imports, rnd):
+    offset = pe.imports.name_min_offset
+    max_offset = pe.imports.name_max_offset
     # check free space for names
     while max_offset < pe.size and sample_data[max_offset] == 0:
         max_offset += 1
@@ -1910,7 +3397,7 @@ def shuffle_names(sample_data, pe, imports):
         dll.name_offset = name_offset
         dll.name_rva = dll.name_delta + name_offset
         name_offset += dll.name_len + 1
-        shuffle(dll.funcs)
+        rnd.shuffle(dll.funcs)
         for func in dll.funcs:
             if not func.is_ordinal:
                 if name_offset % 2 > 0:
@@ -1928,19 +3415,20 @@ def shuffle_names(sample_data, pe, imports):
     return sample_data
 
 
-def shuffle_imports(sample_data, pe, parts):
-    global IMPORT_DLL_EMPTY_STRUCT, IMPORT_NAME_MIN_OFFSET, IMPORT_OFT_MIN_OFFSET, IMPORT_FT_MIN_OFFSET, IMPORT_OFT_DELTA, IMPORT_FT_DELTA
+@Profiler.stage('shuffle_imports')
+def shuffle_imports(sample_data, pe, parts, rnd):
+    global IMPORT_DLL_EMPTY_STRUCT
     dlls = copy.deepcopy(pe.imports.dlls)
     parts['imp'] = f'Imports shuffled -> dll count: {pe.imports.dll_count} -> func count: {pe.imports.func_count}.'
-    shuffle(dlls)
-    if IMPORT_NAME_MIN_OFFSET > 0:
-        sample_data = shuffle_names(sample_data, pe, dlls)
-    oft_offset = IMPORT_OFT_MIN_OFFSET
-    ft_offset = IMPORT_FT_MIN_OFFSET
+    rnd.shuffle(dlls)
+    if pe.imports.name_min_offset > 0:
+        sample_data = shuffle_names(sample_data, pe, dlls, rnd)
+    oft_offset = pe.imports.oft_min_offset
+    ft_offset = pe.imports.ft_min_offset
     dll_block = bytearray()
     for dll in dlls:
-        if IMPORT_NAME_MIN_OFFSET < 0:
-            shuffle(dll.funcs)  # if it is not possible to shuffle the names, shuffle the OFT/FT
+        if pe.imports.name_min_offset < 0:
+            rnd.shuffle(dll.funcs)  # if it is not possible to shuffle the names, shuffle the OFT/FT
         # collect OFT/FT block
         oft_ft_block = bytearray()
         f_count = 0
@@ -1948,12 +3436,12 @@ def shuffle_imports(sample_data, pe, parts):
             # store func rva to fix code section
             if dll.oft_rva:
                 if oft_offset > 0:
-                    func.func_va = oft_offset + IMPORT_OFT_DELTA + (f_count * func.struct_size) + pe.imagebase
+                    func.func_va = oft_offset + pe.imports.oft_delta + (f_count * func.struct_size) + pe.imagebase
                 else:
                     func.func_va = dll.oft_rva + (f_count * func.struct_size) + pe.imagebase
             if dll.ft_rva:
                 if ft_offset > 0:
-                    func.func_va = ft_offset + IMPORT_FT_DELTA + (f_count * func.struct_size) + pe.imagebase
+                    func.func_va = ft_offset + pe.imports.ft_delta + (f_count * func.struct_size) + pe.imagebase
                 else:
                     func.func_va = dll.ft_rva + (f_count * func.struct_size) + pe.imagebase
             f_count += 1
@@ -1985,17 +3473,16 @@ def shuffle_imports(sample_data, pe, parts):
     # set dll structs
     sample_data = sample_data[:pe.imports.dlls[0].struct_offset] + dll_block + sample_data[pe.imports.dlls[0].struct_offset + len(dll_block):]
     # fix func references
-    sample_data = fix_shuffled_funcs(sample_data, dlls)
+    sample_data = fix_shuffled_funcs(sample_data, dlls, pe.imports.calls)
     return sample_data
 
 
 # fix references to shuffled functions
-def fix_shuffled_funcs(sample_data, dlls):
-    global IMPORT_CALLS
+def fix_shuffled_funcs(sample_data, dlls, calls):
     for dll in dlls:
         for func in dll.funcs:
-            if func.func_rva in IMPORT_CALLS:
-                instructions = IMPORT_CALLS[func.func_rva]
+            if func.func_rva in calls:
+                instructions = calls[func.func_rva]
                 for ins in instructions:
                     if ins.is_absolute:
                         operand_val = func.func_va
@@ -2007,8 +3494,9 @@ def fix_shuffled_funcs(sample_data, dlls):
 
 
 # collect instructions with import calls
+@Profiler.stage('collect_import_calls')
 def collect_import_calls(data, imports, sections, baseofcode, entrypoint, imagebase, pe_is_64):
-    global TARGET_INSTRUCTIONS, IMPORT_CALLS
+    global TARGET_INSTRUCTIONS
     # get code section
     for section in sections:
         if section.vaddr <= baseofcode < section.vaddr + section.rsize:
@@ -2074,10 +3562,10 @@ def collect_import_calls(data, imports, sections, baseofcode, entrypoint, imageb
                 ins.operand_offset = ins.imm_offset
                 ins.operand_size = ins.imm_size
             func_rva = operand_va - imagebase
-            if func_rva in IMPORT_CALLS:
-                IMPORT_CALLS[func_rva].append(ins)
+            if func_rva in imports.calls:
+                imports.calls[func_rva].append(ins)
             else:
-                IMPORT_CALLS[func_rva] = [ins]
+                imports.calls[func_rva] = [ins]
 
 
 # set "-out" path without collisions
@@ -2103,15 +3591,29 @@ def all_search_exclude_selected(args):
 # check arguments
 def check_args(args):
     global SYS_DRIVE
-    # check "-in" file
-    if not os.path.exists(args.in_file) or not os.path.isfile(args.in_file):
-        exit_program(f'Can not access the "-in" file: {args.in_file}')
-    # check "-out" dir
-    if args.out_dir is None:
-        path_parts = os.path.split(args.in_file)
-        args.out_dir = set_out_path(path_parts[0], path_parts[1])
+    # check "-in" file or "-batch" originals
+    if args.batch is not None:
+        if not os.path.exists(args.batch):
+            exit_program(f'Can not access the "-batch" path: {args.batch}')
+        # samples of every original are saved next to the batch, the batch log gets its own directory
+        if args.out_dir is None:
+            args.batch_root = args.batch if os.path.isdir(args.batch) else os.path.split(args.batch)[0]
+        else:
+            args.batch_root = args.out_dir
+        args.out_dir = set_out_path(args.batch_root, BATCH_LOG_NAME)
     else:
-        args.out_dir = set_out_path(args.out_dir, os.path.split(args.in_file)[1])
+        if args.in_file is None:
+            exit_program('The "-in" file is required.')
+        if not os.path.exists(args.in_file) or not os.path.isfile(args.in_file):
+            exit_program(f'Can not access the "-in" file: {args.in_file}')
+        # check "-out" dir
+        if args.resume:
+            args.out_dir = args.resume  # samples of the resumed run are added to its directory
+        elif args.out_dir is None:
+            path_parts = os.path.split(args.in_file)
+            args.out_dir = set_out_path(path_parts[0], path_parts[1])
+        else:
+            args.out_dir = set_out_path(args.out_dir, os.path.split(args.in_file)[1])
     if not os.path.exists(args.out_dir):
         try:
             os.makedirs(args.out_dir)
@@ -2127,6 +3629,35 @@ def check_args(args):
             args.limit = sys.maxsize
         else:
             exit_program(f'Invalid value for "-limit": {args.limit}.')
+    # check number of processes
+    if args.jobs < 0:
+        exit_program(f'Invalid value for "-jobs": {args.jobs}.')
+    if args.jobs == 0:
+        args.jobs = os.cpu_count() or 1
+    # check donor shard
+    if args.shard is not None:
+        try:
+            index, count = (int(value) for value in args.shard.split('/'))
+        except ValueError:
+            exit_program(f'Invalid value for "-shard": {args.shard}.')
+        if count < 1 or not 1 <= index <= count:
+            exit_program(f'Invalid value for "-shard": {args.shard}.')
+        args.shard = (index, count)
+    # check donor size range
+    if args.min_size < 0:
+        exit_program(f'Invalid value for "-min-size": {args.min_size}.')
+    if args.max_size is not None and args.max_size < args.min_size:
+        exit_program(f'Invalid value for "-max-size": {args.max_size}.')
+    # check donor parse limits
+    if args.max_parse_ms < 0:
+        exit_program(f'Invalid value for "-max-parse-ms": {args.max_parse_ms}.')
+    if args.max_res_entries < 0:
+        exit_program(f'Invalid value for "-max-res-entries": {args.max_res_entries}.')
+    # check donor read-ahead
+    if args.prefetch < 0:
+        exit_program(f'Invalid value for "-prefetch": {args.prefetch}.')
+    if args.prefetch_mb < 0:
+        exit_program(f'Invalid value for "-prefetch-mb": {args.prefetch_mb}.')
     # check search depth
     if args.depth < 0:
         exit_program(f'Invalid value for "-d": {args.d}.')
@@ -2161,6 +3692,35 @@ def check_args(args):
         warnings.append(f'{Back.RED}"-no-res"{Back.RESET} \tcannot be used at the same time with {Back.GREEN}"-res"{Back.RESET}.')
     if args.imp and args.no_imp:
         warnings.append(f'{Back.RED}"-no-imp"{Back.RESET} \tcannot be used at the same time with {Back.GREEN}"-imp"{Back.RESET}.')
+    if args.delta and args.archive:
+        warnings.append(f'{Back.RED}"-delta"{Back.RESET} \tcannot be used at the same time with {Back.RED}"-archive"{Back.RESET}.')
+    if args.batch and args.in_file:
+        warnings.append(f'{Back.RED}"-in"{Back.RESET} \tcannot be used at the same time with {Back.GREEN}"-batch"{Back.RESET}.')
+    if args.batch and args.delta:
+        warnings.append(f'{Back.RED}"-delta"{Back.RESET} \tcannot be used with {Back.GREEN}"-batch"{Back.RESET}. '
+                        f'Use {Back.GREEN}"-archive"{Back.RESET} to store the samples of the batch in one file.')
+    if args.jobs != 1 and not (args.batch and any([args.clear, args.remove_rich, args.remove_timePE, args.remove_sign,
+                                                    args.remove_overlay, args.remove_vi, args.remove_dbg])):
+        warnings.append(f'{Back.RED}"-jobs"{Back.RESET} \tcannot be used without {Back.GREEN}"-batch"{Back.RESET} '
+                        f'and {Back.GREEN}"-rem-*"{Back.RESET} commands.')
+    if args.jobs != 1 and args.archive:
+        warnings.append(f'{Back.RED}"-jobs"{Back.RESET} \tcannot be used at the same time with {Back.RED}"-archive"{Back.RESET}.')
+    if args.combine and args.limit == sys.maxsize:
+        warnings.append(f'{Back.RED}"-combine"{Back.RESET} \tcannot be used without {Back.GREEN}"-limit"{Back.RESET}. '
+                        f'The number of combinations grows as the product of the donor counts.')
+    if args.combine and args.approx:
+        warnings.append(f'{Back.RED}"-approx"{Back.RESET} \tcannot be used at the same time with {Back.GREEN}"-combine"{Back.RESET}.')
+    if args.combine and args.batch:
+        warnings.append(f'{Back.RED}"-combine"{Back.RESET} \tcannot be used with {Back.GREEN}"-batch"{Back.RESET}.')
+    if args.drop_cache and not hasattr(os, 'posix_fadvise'):
+        warnings.append(f'{Back.RED}"-drop-cache"{Back.RESET} \tis not supported on this system, the page cache is used as usual.')
+    if args.cache_mb is not None and args.serve is None:
+        warnings.append(f'{Back.RED}"-cache-mb"{Back.RESET} \tcannot be used without {Back.GREEN}"-serve"{Back.RESET}.')
+    if args.result_cache and args.delta:
+        warnings.append(f'{Back.RED}"-result-cache"{Back.RESET} \tcannot be used with {Back.GREEN}"-delta"{Back.RESET}. '
+                        f'The container keeps only the changed parts of the samples, cached samples are whole files.')
+    if args.compress and not args.archive:
+        warnings.append(f'{Back.RED}"-compress"{Back.RESET} \tcannot be used without {Back.GREEN}"-archive"{Back.RESET}.')
     if args.names and args.no_names:
         warnings.append(f'{Back.RED}"-no-names"{Back.RESET} \tcannot be used at the same time with {Back.GREEN}"-names"{Back.RESET}.')
     if any([args.rich, args.timePE, args.sign, args.vi, args.dbg, args.res, args.imp, args.names]) and \
@@ -2184,7 +3744,7 @@ def check_args(args):
     # register SIGINT handler
     signal.signal(signal.SIGINT, signal_handler)
     # check admin privileges if system drive is selected
-    if args.sd[0] == SYS_DRIVE[0]:
+    if SYS_DRIVE and args.sd[0] == SYS_DRIVE[0]:
         is_admin = ct.windll.shell32.IsUserAnAdmin() != 0
         if not is_admin:
             msg = 'System drive selected as "-sd" but no admin privileges granted,\n' \
@@ -2193,26 +3753,26 @@ def check_args(args):
 
 
 # set search options
-def set_options(args):
+def set_options(args, options):
     if args.clear:
-        Options.disable_all_search()
-        Options.enable_all_remove()
+        options.disable_all_search()
+        options.enable_all_remove()
         return
     if any([args.remove_rich, args.remove_timePE, args.remove_sign, args.remove_overlay, args.remove_vi, args.remove_dbg]):
-        Options.disable_all_search()
-        Options.remove_mode = True
+        options.disable_all_search()
+        options.remove_mode = True
         if args.remove_rich:
-            Options.remove_rich = True
+            options.remove_rich = True
         if args.remove_timePE:
-            Options.remove_stamp = True
+            options.remove_stamp = True
         if args.remove_sign:
-            Options.remove_sign = True
+            options.remove_sign = True
         if args.remove_overlay:
-            Options.remove_ovl = True
+            options.remove_ovl = True
         if args.remove_vi:
-            Options.remove_vi = True
+            options.remove_vi = True
         if args.remove_dbg:
-            Options.remove_dbg = True
+            options.remove_dbg = True
         return
     # no options selected == all search options selected
     if all([args.rich, args.timePE, args.sign, args.vi, args.dbg, args.res, args.imp, args.names]) \
@@ -2221,41 +3781,41 @@ def set_options(args):
         return
     # enable specified options
     if any([args.rich, args.timePE, args.sign, args.vi, args.dbg, args.res, args.imp, args.names]):
-        Options.disable_all_search()
+        options.disable_all_search()
         if args.rich:
-            Options.search_rich = True
+            options.search_rich = True
         if args.timePE:
-            Options.search_stamp = True
+            options.search_stamp = True
         if args.sign:
-            Options.search_sign = True
+            options.search_sign = True
         if args.vi:
-            Options.search_vi = True
+            options.search_vi = True
         if args.dbg:
-            Options.search_dbg = True
+            options.search_dbg = True
         if args.res:
-            Options.search_res = True
+            options.search_res = True
         if args.imp:
-            Options.shuffle_imp = True
+            options.shuffle_imp = True
         if args.names:
-            Options.change_names = True
+            options.change_names = True
     else:  # disable specified options
-        Options.enable_all_search()
+        options.enable_all_search()
         if args.no_rich:
-            Options.search_rich = False
+            options.search_rich = False
         if args.no_timePE:
-            Options.search_stamp = False
+            options.search_stamp = False
         if args.no_sign:
-            Options.search_sign = False
+            options.search_sign = False
         if args.no_vi:
-            Options.search_vi = False
+            options.search_vi = False
         if args.no_dbg:
-            Options.search_dbg = False
+            options.search_dbg = False
         if args.no_res:
-            Options.search_res = False
+            options.search_res = False
         if args.no_imp:
-            Options.shuffle_imp = False
+            options.shuffle_imp = False
         if args.no_names:
-            Options.change_names = False
+            options.change_names = False
     return
 
 
@@ -2267,20 +3827,32 @@ def check_64(data, e_lfanew, checking_original=False):
     elif magic == b'\x0b\x02':  # b'\x0b\x02' == 0x20B == PE32+
         return True
     elif checking_original:
-        exit_program(f'Original file contains invalid Magic value: {magic}.')
+        original_failed(f'Original file contains invalid Magic value: {magic}.')
     else:
         return None
 
 
-# check original PE parts
-def check_original(args):
-    global SEPARATOR, CREATE_DEBUG_INFO_SESSION, IMPORT_NAME_MIN_OFFSET, IMPORT_NAME_MAX_OFFSET
-    with open(args.in_file, 'rb') as file:
-        data = bytearray(file.read())
+# check original PE file
+@Profiler.stage('check_original')
+def check_original(path, args, options):
+    # the original is mapped instead of being read, samples refer to its unmodified ranges
+    with open(path, 'rb') as file:
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError) as e:
+            original_failed(f'Can not map the original file: {e}.')
+    return parse_original(path, data, args, options)
+
+
+# check original PE parts.
+# "options" are changed according to the parts found in the original and stored in the result
+@Profiler.stage('parse_original')
+def parse_original(path, data, args, options):
+    global SEPARATOR
     pe_size = len(data)
     e_lfanew = int.from_bytes(data[0x3c:0x40], 'little')
     if e_lfanew == 0 or e_lfanew >= pe_size:
-        exit_program(f'Original file contains invalid e_lfanew value: {hex(e_lfanew)}.')
+        original_failed(f'Original file contains invalid e_lfanew value: {hex(e_lfanew)}.')
     is_64 = check_64(data, e_lfanew, checking_original=True)
     # get AddressOfEntryPoint
     orig_entrypoint = int.from_bytes(data[e_lfanew + 40:e_lfanew + 44], 'little')
@@ -2317,88 +3889,90 @@ def check_original(args):
                   f'SectionAlignment must be greater than FileAlignment'
         continue_or_exit_msg(message)
     # check original rich
-    if Options.search_rich or Options.remove_rich:
-        orig_rich = get_rich(data, e_lfanew, remove_mode=Options.remove_mode, checking_original=True)
+    if options.search_rich or options.remove_rich:
+        orig_rich = get_rich(data, e_lfanew, remove_mode=options.remove_mode, checking_original=True)
         if orig_rich is None:
-            Options.search_rich = False
-            Options.remove_rich = False
+            options.search_rich = False
+            options.remove_rich = False
     else:
         orig_rich = None
     # check original debug info
-    if Options.search_dbg or Options.remove_dbg:
+    if options.search_dbg or options.remove_dbg:
         orig_dbgs = get_dbg(data, e_lfanew, is_64, orig_sections, pe_size, checking_original=True,
-                            store_to_rsrc=(args.store_dbg_to_rsrc and not Options.remove_mode))
+                            store_to_rsrc=(args.store_dbg_to_rsrc and not options.remove_mode))
         if orig_dbgs is None:
-            Options.search_dbg = False
-            Options.remove_dbg = False
+            options.search_dbg = False
+            options.remove_dbg = False
     else:
         orig_dbgs = None
+    # placeholder entry means Debug Info can be added only to the resources
+    create_dbg_info = orig_dbgs is not None and orig_dbgs[0].struct_offset == 0
     # check original imports
-    if Options.shuffle_imp:
+    if options.shuffle_imp:
         orig_imports = get_imports(data, e_lfanew, is_64, orig_sections, pe_size, orig_baseofcode, orig_entrypoint, orig_imagebase)
         if orig_imports is None:
-            Options.shuffle_imp = False
+            options.shuffle_imp = False
     else:
         orig_imports = None
 
     # check original resources
-    if any([Options.search_res, Options.search_vi, Options.remove_vi, Options.search_dbg and args.store_dbg_to_rsrc]):
+    if any([options.search_res, options.search_vi, options.remove_vi, options.search_dbg and args.store_dbg_to_rsrc]):
         orig_res = get_resources(data, e_lfanew, is_64, orig_sections, pe_size, args.manifest_allowed, checking_original=True)
         if orig_res is None:
-            if Options.search_res:
-                Options.search_res = False
-            if Options.remove_vi:
-                Options.remove_vi = False
-            if Options.search_vi:
-                Options.search_vi = False
+            if options.search_res:
+                options.search_res = False
+            if options.remove_vi:
+                options.remove_vi = False
+            if options.search_vi:
+                options.search_vi = False
                 message = 'Due to lack of resource section, can not append VersionInfo.'
                 print(f'{Back.CYAN}{message}{Back.RESET}')
                 Log.write(message)
-            if Options.search_dbg and CREATE_DEBUG_INFO_SESSION:
-                Options.search_dbg = False
+            if options.search_dbg and create_dbg_info:
+                options.search_dbg = False
                 message = 'Due to lack of resource section, can not append Debug Info.'
                 print(f'{Back.CYAN}{message}{Back.RESET}')
                 Log.write(message)
         else:
-            if (Options.search_vi or Options.remove_vi) and orig_res.vi is None:
-                if Options.remove_vi:
-                    Options.remove_vi = False
+            if (options.search_vi or options.remove_vi) and orig_res.vi is None:
+                if options.remove_vi:
+                    options.remove_vi = False
                 message = 'Original file does not contain VersionInfo.'
                 print(f'{Back.CYAN}{message}{Back.RESET}')
                 Log.write(message)
     else:
         orig_res = None
     # check original time stamp
-    if Options.search_stamp or Options.remove_stamp:
-        orig_stamp = get_stamp(data, e_lfanew, remove_mode=Options.remove_mode, checking_original=True)
-        if orig_stamp is None and Options.remove_stamp:
-            Options.remove_stamp = False
+    if options.search_stamp or options.remove_stamp:
+        orig_stamp = get_stamp(data, e_lfanew, remove_mode=options.remove_mode, checking_original=True)
+        if orig_stamp is None and options.remove_stamp:
+            options.remove_stamp = False
     else:
         orig_stamp = None
     # check original authenticode sign
-    if Options.search_sign or Options.remove_sign or Options.remove_ovl:
-        orig_sign = get_sign(data, e_lfanew, is_64, pe_size, remove_mode=Options.remove_mode, checking_original=True)
-        if orig_sign is None and Options.remove_sign:
-            Options.remove_sign = False
+    if options.search_sign or options.remove_sign or options.remove_ovl:
+        orig_sign = get_sign(data, e_lfanew, is_64, pe_size, remove_mode=options.remove_mode, checking_original=True)
+        if orig_sign is None and options.remove_sign:
+            options.remove_sign = False
     else:
         orig_sign = None
     # check overlay if remove mode enabled
-    if Options.remove_ovl:
+    if options.remove_ovl:
         orig_overlay = get_overlay(orig_sign, data, orig_sections, checking_original=True)
         if orig_overlay is None:
-            Options.remove_ovl = False
+            options.remove_ovl = False
     else:
         orig_overlay = None
     # check if there are search or remove options left
-    if Options.get_search_count() == 0 and Options.get_remove_count() == 0:
-        if Options.remove_mode:
+    if options.get_search_count() == 0 and options.get_remove_count() == 0:
+        if options.remove_mode:
             msg = 'Nothing to remove.'
         else:
             msg = 'Nothing to search.'
-        exit_program(msg, 0)
+        original_failed(msg, 0)
     Log.write(SEPARATOR)
     # collect received data
-    return MimicPE(path_to_file=args.in_file,
+    return MimicPE(path_to_file=path,
                    e_lfanew=e_lfanew,
                    baseofcode=orig_baseofcode,
                    entrypoint=orig_entrypoint,
@@ -2415,7 +3989,9 @@ def check_original(args):
                    res=orig_res,
                    imports=orig_imports,
                    section_alignment=sec_alignment,
-                   file_alignment=fl_alignment)
+                   file_alignment=fl_alignment,
+                   options=options,
+                   create_dbg_info=create_dbg_info)
 
 
 # remove rich
@@ -2486,95 +4062,234 @@ def remove_vi(pe, parts):
 
 
 # remove specified parts
-def clear_original(pe, args):
+def clear_original(run, args):
+    pe = run.pe
+    options = pe.options
     parts = {}
     last_offset = 0
-    if Options.remove_rich:
+    pe.data = SampleData.from_original(pe)
+    if options.remove_rich:
         remove_rich(pe, parts)
-    if Options.remove_stamp:
+    if options.remove_stamp:
         remove_stamp(pe, parts)
-    if Options.remove_dbg:
+    if options.remove_dbg:
         remove_dbg(pe, parts)
-    if Options.remove_vi:
+    if options.remove_vi:
         last_offset = remove_vi(pe, parts)
-        if not Options.remove_sign:
+        if not options.remove_sign:
             fix_sign(pe, last_offset)
-    if Options.remove_sign:
+    if options.remove_sign:
         remove_sign(pe, last_offset, parts)
-    if Options.remove_ovl:
+    if options.remove_ovl:
         remove_overlay(pe, last_offset, parts)
-    save_sample(pe.data, pe, pe, args, parts)
+    save_sample(pe.data, run, pe, args, parts)
 
 
-# check PE for transplant parts
-def get_donor(pe, donor_path, args):
+# get sha256 of the whole file, None if it can not be read
+def get_file_sha256(path):
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+# get hashes of the donor files of every transplanted part, None if any of the files can not be read.
+# returns list of tuple(part, sha256)
+def get_donor_hashes(pe, donor, get_hash=get_file_sha256):
+    hashes = []
+    for part in get_combine_parts(pe.options):
+        donor_hash = get_hash(donor.get_part_donor(part).path)
+        if donor_hash is None:
+            return None
+        hashes.append((part, donor_hash))
+    return hashes
+
+
+# create hard link to the file, False if the file system does not support it
+def link_file(src_path, dst_path):
+    try:
+        os.link(src_path, dst_path)
+    except (OSError, NotImplementedError):
+        return False
+    return True
+
+
+# read donor file.
+# With "drop_cache" the file is read sequentially and its pages are dropped from the OS page cache,
+# so the scan does not push out the cached files of other processes.
+@Profiler.stage('load_donor', donor_arg=0)
+def load_donor(donor_path, drop_cache=False):
+    drop_cache = drop_cache and hasattr(os, 'posix_fadvise')
     try:
         with open(donor_path, 'rb') as donor_file:
+            if drop_cache:
+                os.posix_fadvise(donor_file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
             data = bytearray(donor_file.read())
+            if drop_cache:
+                # the donor is in memory now, its pages are not needed anymore
+                os.posix_fadvise(donor_file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+            return data
     except (FileNotFoundError, PermissionError, OSError):
         return None
+
+
+# collect donor parts selected in Options
+@Profiler.stage('parse_donor', donor_arg=0)
+def parse_donor(donor_path, data, args, options, negative_cache=None, metrics=None):
+    try:
+        donor = get_donor_parts(donor_path, data, args, options, DonorLimits(args), metrics)
+        if negative_cache is not None:
+            negative_cache.add(donor_path, options, donor)
+        return donor
+    except DonorLimitError as e:
+        if metrics is not None:
+            metrics.count('donors_rejected', e.reason)
+        Log.write(f'Donor skipped, {e}: {donor_path}')
+        return None
+
+
+# parse donor headers and the parts selected in Options, None if donor is not valid PE
+def get_donor_parts(donor_path, data, args, options, limits, metrics=None):
     size = len(data)
     e_lfanew = int.from_bytes(data[0x3c:0x40], 'little')
     if e_lfanew == 0 or e_lfanew >= size:
+        if metrics is not None:
+            metrics.count('donors_rejected', 'invalid_e_lfanew')
         return None
     is_64 = check_64(data, e_lfanew)
     if is_64 is None:  # is_64 == None means donor is not valid PE, so go next
+        if metrics is not None:
+            metrics.count('donors_rejected', 'not_pe')
         return None
-    score = 0
-    donor_sections = get_sections(data, e_lfanew, size)
+    donor_sections = get_sections(data, e_lfanew, size, limits=limits)
     if donor_sections is None:
+        if metrics is not None:
+            metrics.count('donors_rejected', 'invalid_sections')
         return None
-    if Options.change_names:
+    limits.check_time()
+    donor_rich = None
+    if options.search_rich:
+        donor_rich = get_rich(data, e_lfanew)
+        limits.check_time()
+    donor_sign = None
+    if options.search_sign:
+        donor_sign = get_sign(data, e_lfanew, is_64, size)
+        limits.check_time()
+    donor_stamp = None
+    if options.search_stamp:
+        donor_stamp = get_stamp(data, e_lfanew)
+    donor_dbgs = None
+    if options.search_dbg:
+        donor_dbgs = get_dbg(data, e_lfanew, is_64, donor_sections, size, limits=limits)
+    limits.check_time()
+    donor_res = None
+    if options.search_res or options.search_vi:
+        donor_res = get_resources(data, e_lfanew, is_64, donor_sections, size, args.manifest_allowed, limits=limits)
+    donor = MimicPE(path_to_file=donor_path,
+                    e_lfanew=e_lfanew,
+                    is_64=is_64,
+                    data=None,
+                    size=size,
+                    sections=donor_sections,
+                    rich=donor_rich,
+                    stamp=donor_stamp,
+                    sign=donor_sign,
+                    dbgs=donor_dbgs,
+                    res=donor_res)
+    # resources and section names are already copied into the parsed structures
+    donor.data = DonorData(data, get_donor_ranges(donor))
+    return donor
+
+
+# get donor file ranges read by the transplant
+def get_donor_ranges(donor):
+    ranges = []
+    if donor.rich:
+        ranges.append((donor.rich.struct_offset, donor.rich.struct_offset + donor.rich.struct_size))
+    if donor.stamp:
+        ranges.append((donor.stamp.struct_offset, donor.stamp.struct_offset + donor.stamp.struct_size))
+    if donor.sign:
+        ranges.append((donor.sign.data_offset, donor.sign.data_offset + donor.sign.data_size))
+    if donor.dbgs:
+        for dbg in donor.dbgs:
+            ranges.append((dbg.struct_offset, dbg.struct_offset + 20))
+            ranges.append((dbg.data_offset, dbg.data_offset + dbg.data_size))
+    return ranges
+
+
+# check parsed donor matches the original PE criteria.
+# "metrics" is None when the caller counts the donor itself, as the batch search does.
+# returns donor with the parts to transplant or None
+@Profiler.stage('evaluate_donor', donor_arg=1)
+def evaluate_donor(pe, donor, args, metrics=None):
+    options = pe.options
+    score = 0
+    if options.change_names:
         score += 1
-    if Options.shuffle_imp:
+    if options.shuffle_imp:
         score += 1
     donor_rich = None
-    if Options.search_rich:
-        donor_rich = get_rich(data, e_lfanew)
-        if pe.rich.fits(donor_rich):  # check if it fits as there are size restrictions
+    if options.search_rich:
+        if pe.rich.fits(donor.rich):  # check if it fits as there are size restrictions
+            donor_rich = donor.rich
             score += 1
-        else:
-            donor_rich = None
     donor_sign = None
-    if Options.search_sign:
-        donor_sign = get_sign(data, e_lfanew, is_64, size)
+    if options.search_sign:
+        donor_sign = donor.sign
         if donor_sign:
             score += 1
     donor_stamp = None
-    if Options.search_stamp:
-        donor_stamp = get_stamp(data, e_lfanew)
+    if options.search_stamp:
+        donor_stamp = donor.stamp
         if donor_stamp:
             score += 1
     donor_dbgs = None
-    if Options.search_dbg:
-        donor_dbgs = get_dbg(data, e_lfanew, is_64, donor_sections, size)
+    if options.search_dbg:
+        # debug entries are reordered during transplant, so each sample gets its own list
+        donor_dbgs = list(donor.dbgs) if donor.dbgs is not None else None
         if donor_dbgs:
             score += 1
     donor_res = None
-    if Options.search_res or Options.search_vi:
-        donor_res = get_resources(data, e_lfanew, is_64, donor_sections, size, args.manifest_allowed)
-        if Options.search_res and donor_res:
+    if options.search_res or options.search_vi:
+        donor_res = donor.res
+        if options.search_res and donor_res:
             score += 1
-        if Options.search_vi and donor_res and donor_res.vi:
+        if options.search_vi and donor_res and donor_res.vi:
             score += 1
 
-    if score > 0 and score >= Options.get_search_count() - int(args.approx):
-        return MimicPE(path_to_file=donor_path,
-                       e_lfanew=e_lfanew,
-                       is_64=is_64,
-                       data=data,
-                       size=size,
-                       sections=donor_sections,
+    if score > 0 and score >= options.get_search_count() - int(args.approx):
+        if metrics is not None:
+            metrics.count('donors_accepted')
+        return MimicPE(path_to_file=donor.path,
+                       e_lfanew=donor.e_lfanew,
+                       is_64=donor.is_64,
+                       data=donor.data,
+                       size=donor.size,
+                       sections=donor.sections,
                        rich=donor_rich,
                        stamp=donor_stamp,
                        sign=donor_sign,
                        dbgs=donor_dbgs,
                        res=donor_res)
-    else:
-        return None
+    elif metrics is not None:
+        metrics.count('donors_rejected', 'parts_mismatch')
+        for part, selected, found in (('rich', options.search_rich, donor_rich),
+                                      ('sign', options.search_sign, donor_sign),
+                                      ('timePE', options.search_stamp, donor_stamp),
+                                      ('dbg', options.search_dbg, donor_dbgs),
+                                      ('res', options.search_res, donor_res),
+                                      ('vi', options.search_vi, donor_res and donor_res.vi)):
+            if selected and not found:
+                metrics.count('donors_missing_part', part)
+    return None
 
 
 # set donor rich to sample
+@Profiler.stage('set_rich')
 def set_rich(sample_data, pe, donor, args, parts):
     donor_rich_data = donor.data[donor.rich.struct_offset:donor.rich.struct_offset + donor.rich.struct_size]
     if not args.no_rich_fix:
@@ -2593,6 +4308,7 @@ def set_rich(sample_data, pe, donor, args, parts):
 
 
 # set donor time stamp to sample
+@Profiler.stage('set_stamp')
 def set_stamp(sample_data, pe, donor, parts):
     parts['timePE'] = 'PE time stamp changed.'
     return sample_data[:pe.stamp.struct_offset] + \
@@ -2641,13 +4357,16 @@ def dbg_to_resource_block(pe: MimicPE, start_offset, start_va):
 
 
 # set donor debug info to sample
+# returns tuple(sample_data, create_dbg_info)
+@Profiler.stage('set_dbg')
 def set_dbg(sample_data, pe, donor, parts, dbg_to_rsrc):
-    global CREATE_DEBUG_INFO_SAMPLE
-    pe.dbgs.sort(key=operator.attrgetter('data_size'))
+    create_dbg_info = False
+    # the original is shared between samples, so its entries are sorted into a new list
+    orig_dbgs = sorted(pe.dbgs, key=operator.attrgetter('data_size'))
     donor.dbgs.sort(key=operator.attrgetter('data_size'), reverse=True)
     count = 0
 
-    for odbg in pe.dbgs:
+    for odbg in orig_dbgs:
         ddc = 0
         while ddc < len(donor.dbgs):
             if odbg.fits(donor.dbgs[ddc]):
@@ -2670,16 +4389,17 @@ def set_dbg(sample_data, pe, donor, parts, dbg_to_rsrc):
     if count > 0:
         parts[f'dbg_{count}of{len(pe.dbgs)}'] = f'Debug info changed -> total count: {len(pe.dbgs)} -> changed count: {count}.'
     elif dbg_to_rsrc:
-        CREATE_DEBUG_INFO_SAMPLE = True
+        # debug info of the current donor does not fit, it is added to the resources
+        create_dbg_info = True
     else:
         parts[f'dbg_{count}of{len(pe.dbgs)}'] = f'Debug info NOT changed. None of the records fit.'
-    return sample_data
+    return tuple([sample_data, create_dbg_info])
 
 
 # add donor resources to sample
 # returns tuple(sample_data, end_of_rsrc_data)
-def set_resources(sample_data, pe, donor, parts, search_res, search_vi, remove_mode=False):
-    global CREATE_DEBUG_INFO_SESSION, CREATE_DEBUG_INFO_SAMPLE
+@Profiler.stage('set_resources')
+def set_resources(sample_data, pe, donor, parts, search_res, search_vi, remove_mode=False, create_dbg_info=False):
     if not remove_mode and donor.res:
         merged_res = merge_resources(pe.res, donor.res, search_vi, search_res)
         flat_resources = get_flat_resources(merged_res)
@@ -2726,8 +4446,8 @@ def set_resources(sample_data, pe, donor, parts, search_res, search_vi, remove_m
     if pad > 0:
         rsrc_bytes += (pe.file_alignment - pad) * b'\x00'
         rsrc_rsz = len(rsrc_bytes)
-    if CREATE_DEBUG_INFO_SESSION or CREATE_DEBUG_INFO_SAMPLE:
-        if CREATE_DEBUG_INFO_SAMPLE:
+    if pe.create_dbg_info or create_dbg_info:
+        if create_dbg_info:
             # clear prev debug info
             sample_data = clear_dbg(sample_data, pe.dbgs)
         dbg_raddr = rsrc_section.raddr + rsrc_rsz
@@ -2746,7 +4466,6 @@ def set_resources(sample_data, pe, donor, parts, search_res, search_vi, remove_m
             rsrc_bytes += (16 - pad) * b'\x00'
             rsrc_rsz = len(rsrc_bytes)
         parts[f'dbgres_{len(donor.dbgs)}'] = f'Debug info added -> prev count: {len(pe.dbgs) * int(pe.dbgs[0].struct_offset > 0)} -> new count: {len(donor.dbgs)}.'
-        CREATE_DEBUG_INFO_SAMPLE = False
     sample_end_of_data = rsrc_section.raddr + rsrc_rsz
     if rsrc_rsz != rsrc_section.rsize:
         # change SizeOfRawData in .rsrc section struct
@@ -2796,6 +4515,7 @@ def set_resources(sample_data, pe, donor, parts, search_res, search_vi, remove_m
 
 
 # set donor sign to sample
+@Profiler.stage('set_sign')
 def set_sign(sample_data, pe, donor, parts, sample_end_of_data):
     if sample_end_of_data < pe.sign.data_offset:
         sample_end_of_data = pe.sign.data_offset
@@ -2813,37 +4533,41 @@ def set_sign(sample_data, pe, donor, parts, sample_end_of_data):
     else:
         parts['sign'] = f'Sign changed -> prev size: {pe.sign.data_size} bytes -> new size: {donor.sign.data_size} bytes.'
     return sample_data[:sample_end_of_data] + \
-        donor.data[donor.sign.data_offset:donor.sign.data_offset + donor.sign.data_size] + \
+        donor.data.view(donor.sign.data_offset, donor.sign.data_offset + donor.sign.data_size) + \
         sample_data[sample_end_of_data + pe.sign.data_size:]
 
 
-# collect data for new sample
-def get_sample_data(pe, donor, args, parts):
-    global CREATE_DEBUG_INFO_SESSION, CREATE_DEBUG_INFO_SAMPLE
-    sample_data = bytearray(pe.data)
+# collect data for new sample.
+# "rnd" is random.Random of the import shuffling, an unseeded one is created if it is not given
+@Profiler.stage('get_sample_data', donor_arg=1)
+def get_sample_data(pe, donor, args, parts, rnd=None):
+    options = pe.options
+    sample_data = SampleData.from_original(pe)
     # transplant rich from donor
-    if Options.search_rich and donor.rich:
-        sample_data = set_rich(sample_data, pe, donor, args, parts)
+    if options.search_rich and donor.rich:
+        sample_data = set_rich(sample_data, pe, donor.get_part_donor('rich'), args, parts)
     # transplant time stamp from donor
-    if Options.search_stamp and donor.stamp:
-        sample_data = set_stamp(sample_data, pe, donor, parts)
+    if options.search_stamp and donor.stamp:
+        sample_data = set_stamp(sample_data, pe, donor.get_part_donor('stamp'), parts)
     # shuffle imports
-    if Options.shuffle_imp:
-        sample_data = shuffle_imports(sample_data, pe, parts)
+    if options.shuffle_imp:
+        sample_data = shuffle_imports(sample_data, pe, parts, Random() if rnd is None else rnd)
     # transplant debug info from donor
-    if Options.search_dbg and donor.dbgs and not CREATE_DEBUG_INFO_SESSION:
-        sample_data = set_dbg(sample_data, pe, donor, parts, args.store_dbg_to_rsrc)
+    create_dbg_info = False
+    if options.search_dbg and donor.dbgs and not pe.create_dbg_info:
+        sample_data, create_dbg_info = set_dbg(sample_data, pe, donor, parts, args.store_dbg_to_rsrc)
     sample_end_of_data = 0
     # transplant resources from donor
-    if ((Options.search_res or Options.search_vi) and donor.res) or ((CREATE_DEBUG_INFO_SESSION or CREATE_DEBUG_INFO_SAMPLE) and pe.res):
-        resource_result = set_resources(sample_data, pe, donor, parts, Options.search_res, Options.search_vi)
+    if ((options.search_res or options.search_vi) and donor.res) or ((pe.create_dbg_info or create_dbg_info) and pe.res):
+        resource_result = set_resources(sample_data, pe, donor, parts, options.search_res, options.search_vi,
+                                        create_dbg_info=create_dbg_info)
         sample_data = resource_result[0]
         sample_end_of_data = resource_result[1]
     # transplant authenticode sign from donor
-    if Options.search_sign and donor.sign:
-        sample_data = set_sign(sample_data, pe, donor, parts, sample_end_of_data)
+    if options.search_sign and donor.sign:
+        sample_data = set_sign(sample_data, pe, donor.get_part_donor('sign'), parts, sample_end_of_data)
     # change original section names
-    if Options.change_names:
+    if options.change_names:
         sample_data = change_section_names(sample_data, pe.sections, donor.sections, parts)
     # update checksum
     if args.upd_checksum:
@@ -2851,78 +4575,1013 @@ def get_sample_data(pe, donor, args, parts):
     return sample_data
 
 
+# copy range of the source file directly to the output file
+# without passing it through python memory if the OS allows it.
+# "source" is the mapped source file used when the OS can not copy the range.
+def copy_file_part(src, dst, source, offset, size):
+    dst.flush()
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while size > 0:
+                copied = os.copy_file_range(src.fileno(), dst.fileno(), size, offset)
+                if copied == 0:
+                    break
+                offset += copied
+                size -= copied
+        except OSError:
+            pass
+    if size > 0 and hasattr(os, 'sendfile'):
+        try:
+            while size > 0:
+                copied = os.sendfile(dst.fileno(), src.fileno(), offset, size)
+                if copied == 0:
+                    break
+                offset += copied
+                size -= copied
+        except OSError:
+            pass
+    # fallback: write from the mapped original by chunks
+    while size > 0:
+        chunk_size = min(size, COPY_CHUNK_SIZE)
+        dst.write(source[offset:offset + chunk_size])
+        offset += chunk_size
+        size -= chunk_size
+
+
+# write buffers with gather writes, so they are not joined into one buffer
+def write_buffers(dst, buffers):
+    if not buffers:
+        return
+    if not hasattr(os, 'writev'):
+        for buffer in buffers:
+            dst.write(buffer)
+        return
+    dst.flush()
+    views = [memoryview(b) for b in buffers]
+    while views:
+        written = os.writev(dst.fileno(), views[:IOV_MAX])
+        if written == 0:
+            raise OSError(f'Can not write to the file: {dst.name}')
+        # skip written buffers and continue from the partially written one
+        i = 0
+        while i < len(views) and written >= len(views[i]):
+            written -= len(views[i])
+            i += 1
+        views = views[i:]
+        if written > 0:
+            views[0] = views[0][written:]
+
+
+# iterate over sample data in chunks
+def iter_sample_chunks(sample_data):
+    if isinstance(sample_data, SampleData):
+        return sample_data.iter_chunks(COPY_CHUNK_SIZE)
+    return iter([sample_data])
+
+
+# write sample data to the file segment by segment
+def write_sample_data(sample_path, sample_data):
+    with open(sample_path, 'wb') as f:
+        if not isinstance(sample_data, SampleData):
+            f.write(sample_data)
+            return
+        src = None
+        buffers = []
+        try:
+            for segment in sample_data.segments:
+                if isinstance(segment, FileRange):
+                    write_buffers(f, buffers)
+                    buffers = []
+                    if src is None:
+                        src = open(sample_data.path, 'rb')
+                    copy_file_part(src, f, sample_data.source, segment.offset, segment.size)
+                else:
+                    buffers.append(segment)
+            write_buffers(f, buffers)
+        finally:
+            if src is not None:
+                src.close()
+
+
+# get number of the sample for its name.
+# Shard i of N numbers its samples i, i + N, i + 2N..., so the samples of all shards can be merged.
+def get_sample_number(run, args):
+    if args.shard is None:
+        return run.counter
+    index, count = args.shard
+    return (run.counter - 1) * count + index
+
+
 # save sample with verbose name
-def save_sample(sample_data, pe, donor, args, parts):
-    global COUNTER, SEPARATOR
-    COUNTER += 1
-    args.limit -= 1
-    if Options.donor_needed():
-        sample_name = f'{str(COUNTER)}_{pe.name}_{donor.name}-{"-".join(parts.keys())}{pe.ext}'
-        sample_path = os.path.join(args.out_dir, sample_name)
-        parts['message'] = f'Donor : {donor.path}\nSample: {sample_path}'
+@Profiler.stage('save_sample')
+def save_sample(sample_data, run, donor, args, parts, build_time=None):
+    global SEPARATOR
+    pe = run.pe
+    run.counter += 1
+    run.limit -= 1
+    number = get_sample_number(run, args)
+    if pe.options.donor_needed():
+        sample_name = f'{str(number)}_{pe.name}_{donor.name}-{"-".join(parts.keys())}{pe.ext}'
+        sample_path = os.path.join(run.out_dir, sample_name)
+        if donor.part_donors is None:
+            parts['message'] = f'Donor : {donor.path}\nSample: {sample_path}'
+        else:
+            part_lines = '\n'.join(f'  {part}: {path}' for part, path in donor.get_part_paths().items())
+            parts['message'] = f'Donors:\n{part_lines}\nSample: {sample_path}'
     else:
-        sample_name = f'{str(COUNTER)}_{pe.name}-{"-".join(parts.keys())}{pe.ext}'
-        sample_path = os.path.join(args.out_dir, sample_name)
+        sample_name = f'{str(number)}_{pe.name}-{"-".join(parts.keys())}{pe.ext}'
+        sample_path = os.path.join(run.out_dir, sample_name)
         parts['message'] = f'Sample: {sample_path}'
     Log.write(sample_name)
     Log.write(f'\n{"-" * 22}\n'.join([parts[k] for k in parts.keys()]))
-    with open(sample_path, 'wb') as f:
-        f.write(sample_data)
+    run.samples.append(tuple([sample_name, donor.path if pe.options.donor_needed() else None,
+                              donor.get_part_paths() if pe.options.donor_needed() else None, parts]))
+    if args.delta:
+        run.delta.write(sample_name, sample_data)
+    elif args.archive:
+        run.archive.write(sample_name, sample_data)
+        run.archive.add_index(sample_name, donor.path if pe.options.donor_needed() else None, parts,
+                              donor.get_part_paths() if pe.options.donor_needed() else None)
+    elif not isinstance(sample_data, CachedSample) or not link_file(sample_data.path, sample_path):
+        write_sample_data(sample_path, sample_data)
     print(sample_name)
-    if args.with_donor and Options.donor_needed():
-        donor_name = f'{str(COUNTER)}_{donor.name}{donor.ext}'
-        donor_path = os.path.join(args.out_dir, donor_name)
-        with open(donor_path, 'wb') as f:
-            f.write(donor.data)
+    if run.metrics is not None:
+        run.metrics.count('samples_written')
+    checksum_offset = pe.e_lfanew + 4 + 20 + 64  # both PE32 and PE32+
+    checksum = int.from_bytes(sample_data[checksum_offset:checksum_offset + 4], 'little')
+    Log.write_record({'type': 'sample',
+                      'original': pe.path,
+                      'sample': sample_name,
+                      'path': None if args.delta or args.archive else sample_path,
+                      'donor': donor.path if pe.options.donor_needed() else None,
+                      'donors': donor.get_part_paths() if pe.options.donor_needed() else None,
+                      'parts': {k: v for k, v in parts.items() if k != 'message'},
+                      'size': len(sample_data),
+                      'checksum': checksum,
+                      'build_time': build_time,
+                      'time': time.time()})
+    if isinstance(sample_data, CachedSample):
+        Log.write(f'Sample taken from the result cache: {sample_data.path}')
+    elif args.result_cache and pe.options.donor_needed():
+        run.result_cache.put(pe, donor, args, sample_data, parts, None if args.delta or args.archive else sample_path)
+    if args.manifest_db:
+        container = run.delta.get_path() if args.delta else run.archive.get_path() if args.archive else None
+        run.manifest.write(pe, sample_name, None if container else sample_path, container,
+                            donor if pe.options.donor_needed() else None, parts, len(sample_data), checksum, build_time)
+    if args.with_donor and pe.options.donor_needed():
+        for source in donor.get_source_donors():
+            donor_name = f'{str(number)}_{source.name}{source.ext}'
+            # donor keeps only the transplanted parts, so the copy is read from the donor file
+            donor_data = load_donor(source.path, args.drop_cache)
+            if donor_data is None:
+                msg = f'Can not read the donor file to copy: {source.path}'
+                print(f'{Back.RED}{msg}{Back.RESET}')
+                Log.write(msg)
+            elif args.archive:
+                run.archive.write(donor_name, donor_data)
+            else:
+                donor_path = os.path.join(run.out_dir, donor_name)
+                with open(donor_path, 'wb') as f:
+                    f.write(donor_data)
     Log.write(SEPARATOR)
 
 
+# read records of the delta container
+# returns tuple(original_info, {blob_hash: (blob_offset, blob_size)}, [sample_info])
+def read_delta_container(container):
+    original = None
+    blobs = {}
+    samples = []
+    with open(container, 'rb') as f:
+        if f.read(len(DELTA_MAGIC)) != DELTA_MAGIC:
+            exit_program(f'File is not a delta container: {container}')
+        while True:
+            head = f.read(DELTA_RECORD_HEAD_SIZE)
+            if len(head) < DELTA_RECORD_HEAD_SIZE:
+                break
+            record_type = head[:1]
+            size = int.from_bytes(head[1:], 'little')
+            offset = f.tell()
+            if record_type == DELTA_RECORD_BLOB:
+                blobs[f.read(32).hex()] = (offset + 32, size - 32)
+                f.seek(offset + size)
+                continue
+            payload = f.read(size)
+            if len(payload) < size:
+                break  # container of the interrupted run
+            if record_type == DELTA_RECORD_ORIGINAL:
+                original = json.loads(payload)
+            elif record_type == DELTA_RECORD_SAMPLE:
+                samples.append(json.loads(payload))
+    if original is None:
+        exit_program(f'Delta container does not contain original file info: {container}')
+    return original, blobs, samples
+
+
+# check the sample is selected with "-sample" option by name or number
+def sample_selected(sample_name, selected):
+    if not selected:
+        return True
+    return sample_name in selected or sample_name.split('_', 1)[0] in selected
+
+
+# create full samples from the delta container
+def materialize_samples(args):
+    container = args.materialize
+    if not os.path.isfile(container):
+        exit_program(f'Can not access the delta container: {container}')
+    original, blobs, samples = read_delta_container(container)
+    for sample in samples:
+        # names are taken from the container, so they must not lead out of the "-out" directory
+        name = sample['name']
+        if not name or name in ('.', '..') or '/' in name or '\\' in name or \
+                os.path.isabs(name) or os.path.splitdrive(name)[0]:
+            exit_program(f'Invalid sample name in the delta container: {name!r}')
+    orig_path = args.in_file if args.in_file else original['path']
+    if not os.path.isfile(orig_path):
+        exit_program(f'Can not access the original file: {orig_path}\n'
+                     f'Use "-in" to set the path to the original file.')
+    out_dir = args.out_dir if args.out_dir else os.path.dirname(os.path.abspath(container))
+    if not os.path.exists(out_dir):
+        try:
+            os.makedirs(out_dir)
+        except Exception as e:
+            print(e)
+            exit_program(f'Can not create "-out" directory: {out_dir}')
+    count = 0
+    with open(orig_path, 'rb') as orig_file, open(container, 'rb') as container_file:
+        orig_data = mmap.mmap(orig_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(orig_data) != original['size'] or hashlib.sha256(orig_data).hexdigest() != original['sha256']:
+            exit_program(f'Original file does not match the delta container: {orig_path}')
+        container_data = mmap.mmap(container_file.fileno(), 0, access=mmap.ACCESS_READ)
+        for sample in samples:
+            if not sample_selected(sample['name'], args.sample):
+                continue
+            sample_path = os.path.join(out_dir, sample['name'])
+            with open(sample_path, 'wb') as f:
+                for op in sample['ops']:
+                    if op[0] == DELTA_OP_COPY:
+                        copy_file_part(orig_file, f, orig_data, op[1], op[2])
+                    else:
+                        blob_offset, blob_size = blobs[op[1]]
+                        copy_file_part(container_file, f, container_data, blob_offset, blob_size)
+            print(sample['name'])
+            count += 1
+    return count
+
+
+# check the shard directory is the sample directory of a single "-in" run with samples as files.
+# "-delta" and "-archive" containers and "-batch" directories of the originals can not be merged.
+def check_shard_dir(shard_dir):
+    if not os.path.isdir(shard_dir):
+        exit_program(f'Can not access the shard directory: {shard_dir}')
+    for entry in os.scandir(shard_dir):
+        if entry.is_dir():
+            exit_program(f'The shard directory contains directory: {entry.path}\n'
+                         f'Shards of "-batch" are merged by the sample directories of every original.')
+        if entry.name == DELTA_FILE_NAME or entry.name.startswith(f'{ARCHIVE_FILE_NAME}.'):
+            exit_program(f'The shard samples are stored in the container: {entry.path}\n'
+                         f'Shards of "-delta" and "-archive" runs can not be merged.')
+
+
+# combine sample directories of the "-shard" runs into one directory.
+# Samples are linked (copied if links are not supported), text logs are joined,
+# JSON lines logs are merged by the record time and manifests are joined into one.
+# returns count of the merged samples
+def merge_shards(args):
+    if args.out_dir is None:
+        exit_program('The "-out" directory is required for "-merge".')
+    for shard_dir in args.merge:
+        check_shard_dir(shard_dir)  # nothing is merged if any shard can not be
+    out_dir = os.path.abspath(args.out_dir)
+    try:
+        os.makedirs(out_dir, exist_ok=True)
+    except OSError as e:
+        exit_program(f'Can not create "-out" directory: {out_dir}\n{e}')
+    count = 0
+    text_logs = []
+    jsonl_logs = []
+    manifests = []
+    for shard_dir in args.merge:
+        for entry in sorted(os.scandir(shard_dir), key=lambda e: e.name):
+            if not entry.is_file():
+                continue
+            if entry.name.startswith('_mimic_log_'):
+                (jsonl_logs if entry.name.endswith('.jsonl') else text_logs).append(entry.path)
+            elif entry.name == MANIFEST_FILE_NAME:
+                manifests.append(entry.path)
+            elif not entry.name.startswith('_mimic'):
+                sample_path = os.path.join(out_dir, entry.name)
+                if os.path.exists(sample_path):
+                    print(f'{Back.RED}Sample already exists, skipped: {sample_path}{Back.RESET}')
+                    continue
+                if not link_file(entry.path, sample_path):
+                    with open(entry.path, 'rb') as f:
+                        write_sample_data(sample_path, f.read())
+                print(entry.name)
+                count += 1
+    log_name = f'_mimic_log_{int(time.time())}_merged'
+    if text_logs:
+        with open(os.path.join(out_dir, f'{log_name}.txt'), 'w') as merged_log:
+            for log_path in text_logs:
+                merged_log.write(f'Shard log: {log_path}\n\n')
+                with open(log_path, 'r') as f:
+                    for line in f:
+                        merged_log.write(line)
+    if jsonl_logs:
+        files = [open(log_path, 'r') for log_path in jsonl_logs]
+        try:
+            with open(os.path.join(out_dir, f'{log_name}.jsonl'), 'w') as merged_log:
+                # every log is ordered by the time already
+                for record in heapq.merge(*[map(json.loads, f) for f in files], key=lambda r: r.get('time', 0)):
+                    if record.get('type') == 'sample' and record.get('path'):
+                        record['path'] = os.path.join(out_dir, record['sample'])
+                    merged_log.write(json.dumps(record) + '\n')
+        finally:
+            for f in files:
+                f.close()
+    if manifests:
+        manifest = Manifest(os.path.join(out_dir, MANIFEST_FILE_NAME))
+        for manifest_path in manifests:
+            manifest.merge(manifest_path, out_dir)
+        manifest.close()
+    return count
+
+
+# add tagged data to the digest
+def update_digest(digest, tag, data):
+    digest.update(tag + len(data).to_bytes(8, 'little'))
+    digest.update(data)
+
+
+# add resource tree to the digest
+def update_resource_digest(digest, entry):
+    update_digest(digest, b'id', entry.bname if entry.id is None else entry.id.to_bytes(4, 'little'))
+    if entry.is_data_next:
+        update_digest(digest, b'cp', entry.entry.code_page.to_bytes(4, 'little'))
+        update_digest(digest, b'data', entry.entry.data_bytes)
+    else:
+        update_digest(digest, b'dir', entry.entry.to_bytes())
+        for next_entry in entry.entry.entries:
+            update_resource_digest(digest, next_entry)
+
+
+# get digest of the donor parts which will be transplanted to the sample
+def get_donor_digest(donor, options):
+    digest = hashlib.sha256()
+    if options.search_rich and donor.rich:
+        data = donor.get_part_donor('rich').data
+        update_digest(digest, b'rich', data[donor.rich.struct_offset:donor.rich.struct_offset + donor.rich.struct_size])
+    if options.search_stamp and donor.stamp:
+        data = donor.get_part_donor('stamp').data
+        update_digest(digest, b'stamp', data[donor.stamp.struct_offset:donor.stamp.struct_offset + donor.stamp.struct_size])
+    if options.search_sign and donor.sign:
+        data = donor.get_part_donor('sign').data
+        update_digest(digest, b'sign', data[donor.sign.data_offset:donor.sign.data_offset + donor.sign.data_size])
+    if options.search_dbg and donor.dbgs:
+        for dbg in donor.dbgs:
+            # AddressOfRawData and PointerToRawData are not transplanted
+            update_digest(digest, b'dbg', donor.data[dbg.struct_offset:dbg.struct_offset + 20])
+            update_digest(digest, b'dbgdata', donor.data[dbg.data_offset:dbg.data_offset + dbg.data_size])
+    if donor.res:
+        if options.search_vi and donor.res.vi:
+            update_resource_digest(digest, donor.res.vi)
+        if options.search_res:
+            for entry in donor.res.entries:
+                update_resource_digest(digest, entry)
+    if options.change_names:
+        update_digest(digest, b'names', b''.join(section.bname for section in donor.sections))
+    return digest.digest()
+
+
+# check the donor parts are identical to the parts of already used donor
+def donor_is_duplicate(run, donor):
+    digest = get_donor_digest(donor, run.pe.options)
+    if digest in run.donor_digests:
+        run.duplicate_donors += 1
+        if run.metrics is not None:
+            run.metrics.count('donors_rejected', 'duplicate_donor')
+        Log.write(f'Duplicate donor skipped: {donor.path}')
+        return True
+    run.donor_digest = digest
+    return False
+
+
+# check the sample is identical to already saved sample.
+# Only the content is hashed, the same bytes split into other segments are the same sample.
+def sample_is_duplicate(run, sample_data, donor):
+    digest = hashlib.sha256()
+    for chunk in iter_sample_chunks(sample_data):
+        digest.update(chunk)
+    digest = digest.digest()
+    if digest in run.sample_digests:
+        run.duplicate_samples += 1
+        if run.metrics is not None:
+            run.metrics.count('samples_skipped', 'duplicate_sample')
+        Log.write(f'Duplicate sample skipped. Donor: {donor.path}')
+        return True
+    run.sample_digest = digest
+    return False
+
+
 # create new sample
-def parts_transplant(pe, donor, args):
-    parts = {}
-    sample_data = get_sample_data(pe, donor, args, parts)
-    save_sample(sample_data, pe, donor, args, parts)
+def parts_transplant(run, donor, args):
+    for sample_data, sample_donor, parts, build_time in iter_samples(run, [donor], args):
+        save_sample(sample_data, run, sample_donor, args, parts, build_time)
+        run.add_digests()
 
 
-# check files in search dir
-def search_donors(pe, args):
+# Donor search is a pipeline of generator stages:
+# paths -> loaded files -> parsed donors -> donors evaluated for the original -> samples -> written samples.
+# Each stage pulls from the previous one only when it needs the next item,
+# so nothing is read or built after the limit is reached.
+
+# collect donor files of the directory in the same order as os.walk does.
+# Directory entries keep the file info from scandir, so it is not requested again.
+# "level" is the nesting level relative to the search dir, the search dir itself is 0
+def iter_donor_entries(dir_path, level, args):
+    try:
+        with os.scandir(dir_path) as scan:
+            entries = list(scan)
+    except OSError:
+        return
+    subdirs = []
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if is_dir:
+            # deeper directories and links to directories are not walked
+            if level < args.depth and not entry.is_symlink():
+                subdirs.append(entry.path)
+        elif entry.name.endswith(args.ext):
+            yield entry
+    for subdir in subdirs:
+        yield from iter_donor_entries(subdir, level + 1, args)
+
+
+# check the donor file size is in the "-min-size" and "-max-size" range
+def donor_size_fits(entry, args, metrics=None):
+    try:
+        size = entry.stat().st_size
+    except OSError:
+        return False
+    if size >= args.min_size and (args.max_size is None or size <= args.max_size):
+        return True
+    if metrics is not None:
+        metrics.count('files_skipped', 'size')
+    return False
+
+
+# get key to sort donor files in the order of their placement on the disk
+def get_entry_disk_order(entry):
+    try:
+        return entry.stat().st_dev, entry.inode()
+    except OSError:
+        return 0, 0
+
+
+# collect paths of the donors in search dir
+def iter_donor_paths(args, metrics=None):
     if os.path.isfile(args.sd):
-        donor = get_donor(pe, args.sd, args)
-        if donor is not None:
-            parts_transplant(pe, donor, args)
+        yield args.sd
+        return
+    entries = iter_donor_entries(args.sd, 0, args)
+    if args.shard is not None:
+        entries = (entry for entry in entries if donor_in_shard(entry.path, args))
+    if args.min_size or args.max_size is not None:
+        entries = (entry for entry in entries if donor_size_fits(entry, args, metrics))
+    if args.order == 'inode':
+        # all files are collected first, then read in the inode order to reduce disk seeks
+        entries = sorted(entries, key=get_entry_disk_order)
+    for entry in entries:
+        yield entry.path
+
+
+# check the donor belongs to the "-shard".
+# Donors are assigned by the hash of the path relative to "-sd", so every host gets the same split without coordination.
+def donor_in_shard(path, args):
+    index, count = args.shard
+    rel_path = os.path.relpath(path, args.sd).replace(os.sep, '/')
+    digest = hashlib.sha256(rel_path.encode('utf-8', 'surrogateescape')).digest()
+    return int.from_bytes(digest[:8], 'little') % count == index - 1
+
+
+# read donor files, unreadable files are skipped
+# yields tuple(path, data)
+def iter_loaded_donors(paths, drop_cache=False, metrics=None):
+    for donor_path in paths:
+        data = load_donor(donor_path, drop_cache)
+        if metrics is not None:
+            count_loaded_donor(metrics, data)
+        if data is not None:
+            yield donor_path, data
+
+
+# count the file seen by the search and its read bytes, "data" is None if the file is unreadable
+def count_loaded_donor(metrics, data):
+    metrics.count('files_seen')
+    if data is None:
+        metrics.count('files_skipped', 'unreadable')
     else:
-        # check initial nesting level of directory
-        base_depth = len(args.sd.split("\\"))
-        for dirpath, dirnames, filenames in os.walk(args.sd):
-            if args.limit == 0:
-                msg = 'Limit reached.'
-                print(f'{Back.CYAN}{msg}{Back.RESET}')
-                Log.write(msg)
-                break
-            cur_level = len(dirpath.split("\\"))
-            if cur_level > base_depth + args.depth:
-                continue
-            for filename in [f for f in filenames if f.endswith(args.ext)]:
-                if args.limit == 0:
+        metrics.count('bytes_read', value=len(data))
+
+
+# read donor files in background threads while the previous donors are parsed.
+# Up to "count" files and "max_bytes" are read ahead, the files are yielded in the order of the paths.
+# yields tuple(path, data)
+def iter_prefetched_donors(paths, count, max_bytes, drop_cache=False, metrics=None):
+    if count <= 0:
+        yield from iter_loaded_donors(paths, drop_cache, metrics)
+        return
+    paths = iter(paths)
+    pending = collections.deque()  # [(path, size, future)]
+    in_flight = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=count) as executor:
+        try:
+            while True:
+                # the first file is read even if it is bigger than the limit
+                while len(pending) < count and (not pending or in_flight < max_bytes):
+                    donor_path = next(paths, None)
+                    if donor_path is None:
+                        break
+                    try:
+                        size = os.path.getsize(donor_path)
+                    except OSError:
+                        if metrics is not None:
+                            count_loaded_donor(metrics, None)
+                        continue
+                    # the stages of the thread are measured by the profiler of the search
+                    future = executor.submit(contextvars.copy_context().run, load_donor, donor_path, drop_cache)
+                    pending.append((donor_path, size, future))
+                    in_flight += size
+                if not pending:
                     break
-                donor_path = os.path.join(dirpath, filename)
-                donor = get_donor(pe, donor_path, args)
-                if donor is None:
-                    continue
-                parts_transplant(pe, donor, args)
+                donor_path, size, future = pending.popleft()
+                in_flight -= size
+                data = future.result()
+                if metrics is not None:
+                    count_loaded_donor(metrics, data)
+                if data is not None:
+                    yield donor_path, data
+        finally:
+            # the search is stopped, files which are not read yet are dropped
+            for _, _, future in pending:
+                future.cancel()
+
+
+# read donor files of the search, ahead of the parsing if "-prefetch" allows it.
+# "-profile" stage "donor_files" is the time of waiting for the read files, including the "walk" time.
+# The checkpoint, the negative cache and the metrics of the run are used by the stages.
+def iter_search_donors(run, args, options_list=None):
+    paths = iter_donor_paths(args, run.metrics)
+    if run.checkpoint is not None:
+        paths = run.checkpoint.iter_paths(paths)
+    if run.negative_cache is not None:
+        # donors skipped by the negative cache are counted as processed by the checkpoint
+        paths = run.negative_cache.filter(paths, options_list, args, run.metrics)
+    paths = Profiler.iterate('walk', paths)
+    loaded = iter_prefetched_donors(paths, args.prefetch, args.prefetch_mb * 1024 * 1024, args.drop_cache, run.metrics)
+    loaded = Profiler.iterate('donor_files', loaded)
+    if run.checkpoint is not None:
+        loaded = run.checkpoint.iter_loaded(loaded)
+    return loaded
+
+
+# parse loaded donors with the options, invalid PE files are skipped
+def iter_parsed_donors(run, loaded, args, options):
+    for donor_path, data in loaded:
+        donor = parse_donor(donor_path, data, args, options, run.negative_cache, run.metrics)
+        if donor is not None:
+            yield donor
 
 
-if __name__ == '__main__':
+# select donors that match the original criteria
+def iter_evaluated_donors(run, donors, args):
+    for donor in donors:
+        run_donor = evaluate_donor(run.pe, donor, args, run.metrics)
+        if run_donor is not None:
+            yield run_donor
+
+
+# build samples of the original from the donors, duplicates are skipped
+# yields tuple(sample_data, donor, parts, build time in seconds)
+def iter_samples(run, donors, args):
+    for donor in donors:
+        if args.dedup and donor_is_duplicate(run, donor):
+            continue
+        parts = {}
+        build_start = time.perf_counter()
+        sample_data = run.result_cache.get(run.pe, donor, args, parts) if args.result_cache else None
+        if sample_data is not None and run.metrics is not None:
+            run.metrics.count('samples_reused')
+        if sample_data is None:
+            rnd = None
+            if args.seed is not None:
+                # the same donor files give the same import shuffling in every run with the seed,
+                # the path is used only if the donor file can not be read again
+                if args.result_cache:
+                    donor_hashes = run.result_cache.get_donor_hashes(run.pe, donor)
+                else:
+                    donor_hashes = get_donor_hashes(run.pe, donor)
+                rnd = Random(f'{args.seed}:{donor.path if donor_hashes is None else donor_hashes}')
+            sample_data = get_sample_data(run.pe, donor, args, parts, rnd)
+        build_time = time.perf_counter() - build_start
+        if args.dedup_samples and sample_is_duplicate(run, sample_data, donor):
+            run.add_digests()
+            continue
+        yield sample_data, donor, parts, build_time
+
+
+# save samples until the limit is reached
+def write_samples(run, samples, args):
+    for sample_data, donor, parts, build_time in samples:
+        save_sample(sample_data, run, donor, args, parts, build_time)
+        if run.checkpoint is not None:
+            run.checkpoint.donor_done()
+        run.add_digests()
+        if run.limit == 0:
+            msg = 'Limit reached.'
+            print(f'{Back.CYAN}{msg}{Back.RESET}')
+            Log.write(msg)
+            break
+    if args.dedup or args.dedup_samples:
+        log_duplicates(run)
+
+
+# show and log deduplication counters of the original
+def log_duplicates(run):
+    msg = f'Duplicate donors skipped: {run.duplicate_donors}.\n' \
+          f'Duplicate samples skipped: {run.duplicate_samples}.'
+    print(f'{Back.CYAN}{msg}{Back.RESET}')
+    Log.write(msg)
+
+
+# check files in search dir
+def search_donors(run, args):
+    loaded = iter_search_donors(run, args, [run.pe.options])
+    donors = iter_parsed_donors(run, loaded, args, run.pe.options)
+    samples = iter_samples(run, iter_evaluated_donors(run, donors, args), args)
+    write_samples(run, samples, args)
+
+
+# get parts taken from the donors in the order of transplant
+def get_combine_parts(options):
+    parts = []
+    if options.search_rich:
+        parts.append('rich')
+    if options.search_stamp:
+        parts.append('stamp')
+    if options.search_dbg:
+        parts.append('dbg')
+    if options.search_res:
+        parts.append('res')
+    if options.search_vi:
+        parts.append('vi')
+    if options.search_sign:
+        parts.append('sign')
+    if options.change_names:
+        parts.append('names')
+    return parts
+
+
+# check the donor can give the part to the original
+def donor_has_part(pe, donor, part):
+    if part == 'rich':
+        return bool(donor.rich) and pe.rich.fits(donor.rich)
+    if part == 'stamp':
+        return bool(donor.stamp)
+    if part == 'dbg':
+        return bool(donor.dbgs)
+    if part == 'res':
+        return bool(donor.res)
+    if part == 'vi':
+        return bool(donor.res) and donor.res.vi is not None
+    if part == 'sign':
+        return bool(donor.sign)
+    return True  # section names
+
+
+# create donor with the parts taken from different donors
+def combine_donors(pe, part_donors):
+    options = pe.options
+    sources = list({id(donor): donor for donor in part_donors.values()}.values())
+    dbg_donor = part_donors.get('dbg')
+    res_donor = part_donors.get('res')
+    vi_donor = part_donors.get('vi')
+    res = None
+    if res_donor is not None:
+        res = res_donor.res
+        if vi_donor is not None and vi_donor is not res_donor:
+            res = copy.copy(res)
+            res.vi = vi_donor.res.vi
+    elif vi_donor is not None:
+        res = vi_donor.res
+    names_donor = part_donors.get('names', sources[0])
+    donor = MimicPE(path_to_file=sources[0].path,
+                    e_lfanew=sources[0].e_lfanew,
+                    is_64=sources[0].is_64,
+                    # debug info is moved to the resources together with its data
+                    data=dbg_donor.data if dbg_donor is not None else None,
+                    size=sources[0].size,
+                    sections=names_donor.sections,
+                    rich=part_donors['rich'].rich if options.search_rich else None,
+                    stamp=part_donors['stamp'].stamp if options.search_stamp else None,
+                    sign=part_donors['sign'].sign if options.search_sign else None,
+                    # debug entries are reordered during transplant, so each sample gets its own list
+                    dbgs=list(dbg_donor.dbgs) if dbg_donor is not None else None,
+                    res=res)
+    donor.part_donors = part_donors
+    if len(sources) > 1:
+        donor.path = ' + '.join(source.path for source in sources)
+        # the name is a part of the sample file name, so its length does not depend on the sources count.
+        # The sources of the parts are written to the log, the manifest and the archive index.
+        sources_key = '\n'.join(f'{part}:{source.path}' for part, source in part_donors.items())
+        sources_hash = hashlib.sha256(sources_key.encode()).hexdigest()
+        donor.name = f'{COMBINED_DONOR_NAME}_{sources_hash[:COMBINED_DONOR_HASH_SIZE]}'
+    return donor
+
+
+# generate donors combined from the parts of the scanned donors.
+# Every new donor is combined only with the donors scanned before it,
+# so combinations are produced while the scan goes on and each of them once.
+def iter_donor_combinations(pe, donors):
+    parts = get_combine_parts(pe.options)
+    if not parts:
+        return
+    pools = {part: [] for part in parts}
+    for donor in donors:
+        for i, part in enumerate(parts):
+            if not donor_has_part(pe, donor, part):
+                continue
+            choices = [pools[p] for p in parts[:i]] + [[donor]] + [pools[p] for p in parts[i + 1:]]
+            for combination in itertools.product(*choices):
+                yield combine_donors(pe, dict(zip(parts, combination)))
+            pools[part].append(donor)
+
+
+# create samples from the parts of different donors
+def search_donors_combined(run, args):
+    donors = iter_parsed_donors(run, iter_search_donors(run, args), args, run.pe.options)
+    samples = iter_samples(run, iter_donor_combinations(run.pe, donors), args)
+    write_samples(run, samples, args)
+
+
+# collect paths of the batch originals
+def get_batch_paths(args):
+    if os.path.isdir(args.batch):
+        paths = [os.path.join(args.batch, f) for f in sorted(os.listdir(args.batch)) if f.endswith(args.ext)]
+        return [path for path in paths if os.path.isfile(path)]
+    try:
+        with open(args.batch, 'r') as batch_file:
+            return [line.strip() for line in batch_file if line.strip()]
+    except (OSError, UnicodeDecodeError) as e:
+        exit_program(f'Can not read the "-batch" list: {e}.')
+
+
+# check all batch originals, every one gets its own copy of the options
+# returns list of MimicRun sharing the outputs of the batch run
+def check_batch_originals(batch_run, args, options):
+    global SEPARATOR
+    runs = []
+    for path in get_batch_paths(args):
+        run = MimicRun(path, set_out_path(args.batch_root, os.path.split(path)[1]), args.limit)
+        run.share_outputs(batch_run)
+        msg = f'Original: {path}'
+        print(f'{Back.CYAN}{msg}{Back.RESET}')
+        Log.write(msg)
+        try:
+            if not os.path.isfile(path):
+                original_failed(f'Can not access the original file: {path}')
+            run.pe = check_original(path, args, copy.copy(options))
+            if not args.archive:
+                os.makedirs(run.out_dir, exist_ok=True)
+        except OriginalError as e:
+            run.error = str(e)
+            Log.write(SEPARATOR)
+        except OSError as e:
+            run.error = f'Can not create output directory: {e}.'
+            Log.write(SEPARATOR)
+        runs.append(run)
+    return runs
+
+
+# search donors for all batch originals at once.
+# Each donor is read and parsed once and then evaluated against every original which has not reached the limit.
+def search_donors_batch(batch_run, runs, args):
+    for donor_path, data in iter_search_donors(batch_run, args, [run.pe.options for run in runs]):
+        active = [run for run in runs if run.limit > 0]
+        # parse the parts searched for any of the originals
+        donor = parse_donor(donor_path, data, args, Options.union([run.pe.options for run in active]),
+                            batch_run.negative_cache, batch_run.metrics)
+        if donor is None:
+            continue
+        accepted = False
+        for run in active:
+            run_donor = evaluate_donor(run.pe, donor, args)
+            if run_donor is not None:
+                accepted = True
+                parts_transplant(run, run_donor, args)
+        # the donor is counted once, not once per original
+        if batch_run.metrics is not None:
+            if accepted:
+                batch_run.metrics.count('donors_accepted')
+            else:
+                batch_run.metrics.count('donors_rejected', 'parts_mismatch')
+        if all(run.limit == 0 for run in runs):
+            msg = 'Limit reached.'
+            print(f'{Back.CYAN}{msg}{Back.RESET}')
+            Log.write(msg)
+            break
+
+
+# remove parts from one batch original in the worker process.
+# The worker keeps its own log in the output directory of the original, like a single "-in" run.
+# Errors of the original are returned, so they never stop the other workers.
+# returns tuple(path, count of samples, error message)
+def clear_batch_original(path, out_dir, args, options):
+    run = MimicRun(path, out_dir, args.limit)
+    manifest_path = os.path.join(args.out_dir, MANIFEST_FILE_NAME)
+    args.out_dir = out_dir
+    try:
+        if not os.path.isfile(path):
+            original_failed(f'Can not access the original file: {path}')
+        run.log = Log(args, options)
+        run.log.start()
+        if args.manifest_db:
+            # every process writes to the batch manifest through its own connection
+            run.manifest = Manifest(manifest_path)
+        run.pe = check_original(path, args, options)
+        clear_original(run, args)
+    except OriginalError as e:
+        Log.write(str(e))
+        return path, run.counter, str(e)
+    except SystemExit as e:
+        # exit_program in the worker stops only this original
+        error = f'Processing stopped, exit code: {e.code}.'
+        Log.write(error)
+        return path, run.counter, error
+    except Exception as e:
+        error = f'Processing failed: {type(e).__name__}: {e}.'
+        Log.write(error)
+        return path, run.counter, error
+    finally:
+        run.close()
+    return path, run.counter, None
+
+
+# remove parts from all batch originals in "-jobs" processes
+# returns count of the processed originals
+def clear_batch_parallel(args, options):
+    out_dirs = {}
+    for path in get_batch_paths(args):
+        # directories are created here, so originals with the same name get different ones
+        out_dirs[path] = set_out_path(args.batch_root, os.path.split(path)[1])
+        try:
+            os.makedirs(out_dirs[path])
+        except OSError as e:
+            exit_program(f'Can not create output directory: {e}.')
+    processed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs, initializer=init) as executor:
+        futures = {executor.submit(clear_batch_original, path, out_dir, args, options): path
+                   for path, out_dir in out_dirs.items()}
+        results = []
+        for future, path in futures.items():
+            # the worker process itself can fail, e.g. be killed or fail to get the arguments
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append((path, 0, f'Worker failed: {type(e).__name__}: {e}.'))
+    # show results of every original
+    for path, count, error in results:
+        if error is None:
+            processed += 1
+            msg = f'Original: {path}\nSamples created: {count}\nSamples saved in: {out_dirs[path]}'
+            print(f'{Back.CYAN}{msg}{Back.RESET}')
+        else:
+            msg = f'Original skipped: {path}\n{error}'
+            print(f'{Back.RED}{msg}{Back.RESET}')
+        Log.write(msg)
+    return processed
+
+
+# process all originals of the batch sharing a single donor scan
+# returns count of the processed originals
+def run_batch(batch_run, args, options):
+    if options.remove_mode and args.jobs > 1:
+        return clear_batch_parallel(args, options)
+    runs = []
+    for run in check_batch_originals(batch_run, args, options):
+        if run.error is None:
+            runs.append(run)
+        else:
+            msg = f'Original skipped: {run.path}\n{run.error}'
+            print(f'{Back.RED}{msg}{Back.RESET}')
+            Log.write(msg)
+    if options.remove_mode:
+        for run in runs:
+            clear_original(run, args)
+    elif runs:
+        search_donors_batch(batch_run, runs, args)
+    # show results of every original
+    for run in runs:
+        msg = f'Original: {run.path}\nSamples created: {run.counter}'
+        if not args.archive:
+            msg += f'\nSamples saved in: {run.out_dir}'
+        print(f'{Back.CYAN}{msg}{Back.RESET}')
+        Log.write(msg)
+        if args.dedup or args.dedup_samples:
+            log_duplicates(run)
+    return len(runs)
+
+
+# command line arguments
+def get_parser():
     parser = argparse.ArgumentParser(description='By default the script includes all attributes for search.', formatter_class=argparse.RawTextHelpFormatter)
-    parser.add_argument('-in', dest='in_file', metavar='path/to/file', required=True, type=str, help='path to input file.')
+    parser.add_argument('-in', dest='in_file', metavar='path/to/file', type=str, default=None, help='path to input file.')
+    parser.add_argument('-batch', metavar='path/to/originals', type=str, default=None,
+                        help='directory with the input files or text file with one input file path per line.\n'
+                             'donors are searched once for all input files.')
+    parser.add_argument('-jobs', metavar='int', type=int, default=1,
+                        help='number of processes for "-batch" with "-rem-*" commands. 0 is the number of CPUs. 1 is default.')
+    parser.add_argument('-serve', metavar='port', type=int, default=None,
+                        help=f'run as the daemon which keeps parsed donors in memory and accepts JSON jobs\n'
+                             f'posted to http://{DAEMON_HOST}:port. "-sd" and "-d" are the defaults for the jobs.')
+    parser.add_argument('-cache-mb', dest='cache_mb', metavar='int', type=int, default=None,
+                        help=f'memory budget in MB for the donor bytes kept by "-serve". {DAEMON_CACHE_MB} is default.\n'
+                             f'parsed donor parts are kept anyway, dropped bytes are read again when needed.')
     parser.add_argument('-out', dest='out_dir', metavar='path/to/dir', type=str, default=None, help='path to output dir. "-in" file path is default.')
     parser.add_argument('-sd', metavar='search/dir/path', type=str, default=f'{SYS_DRIVE}\\Windows',
                         help=f'path to the donor or to the directory to search for a donor. "{SYS_DRIVE}\\Windows" is default.')
     parser.add_argument('-d', dest='depth', metavar='depth', type=int, default=5, help='directory search depth. 5 is default.')
     parser.add_argument('-limit', metavar='int', type=int, default=0, help='required number of samples to create. all found variants is default. ')
+    parser.add_argument('-shard', metavar='i/N', type=str, default=None,
+                        help='process only the donors of the shard i of N, donors are split by the hash of the path in "-sd".\n'
+                             'samples of the shard are numbered i, i + N, i + 2N... to be merged with "-merge".')
+    parser.add_argument('-merge', metavar='path/to/dir', action='append', default=None,
+                        help='combine samples, logs and manifests of the "-shard" sample directories to the "-out" directory.\n'
+                             'multiple "-merge" supported.')
+    parser.add_argument('-order', choices=['walk', 'inode'], default='walk',
+                        help='order of the donor files. "walk" is the directory listing order and default.\n'
+                             '"inode" collects all files first and reads them in the inode order,\n'
+                             'which follows the placement on the disk on most file systems and reduces seeking.')
+    parser.add_argument('-min-size', dest='min_size', metavar='bytes', type=int, default=0,
+                        help='skip donor files smaller than the size without reading them.')
+    parser.add_argument('-max-size', dest='max_size', metavar='bytes', type=int, default=None,
+                        help='skip donor files bigger than the size without reading them.')
+    parser.add_argument('-max-parse-ms', dest='max_parse_ms', metavar='int', type=int, default=0,
+                        help='skip the donor if parsing takes longer than the time in milliseconds. 0 is no limit and default.')
+    parser.add_argument('-max-res-entries', dest='max_res_entries', metavar='int', type=int, default=0,
+                        help='skip the donor with more resource entries than the number. 0 is no limit and default.')
+    parser.add_argument('-drop-cache', dest='drop_cache', action='store_true',
+                        help='read the donor files sequentially and drop them from the OS page cache after reading,\n'
+                             'so the search does not push out the cached files of other processes. POSIX only.')
+    parser.add_argument('-prefetch', metavar='int', type=int, default=DONOR_PREFETCH_COUNT,
+                        help=f'number of donor files read in the background while the current donor is parsed.\n'
+                             f'0 reads the donors one by one. {DONOR_PREFETCH_COUNT} is default.')
+    parser.add_argument('-prefetch-mb', dest='prefetch_mb', metavar='int', type=int, default=DONOR_PREFETCH_MB,
+                        help=f'limit in MB for the donor bytes read ahead by "-prefetch". {DONOR_PREFETCH_MB} is default.')
     parser.add_argument('-ext', metavar='.extension', action='append', default=None,
                         help='file extensions to process. multiple "-ext" supported. Default: ".exe" & ".dll".')
     parser.add_argument('-with-donor', dest='with_donor', action='store_true', help='create copy of the donor in the "-out" directory.')
+    parser.add_argument('-delta', action='store_true', help=f'store samples as patches against the "-in" file in one "{DELTA_FILE_NAME}" file.')
+    parser.add_argument('-archive', choices=['tar', 'zip'], default=None,
+                        help=f'stream samples into one "{ARCHIVE_FILE_NAME}" tar or zip archive in the "-out" directory.')
+    parser.add_argument('-compress', action='store_true', help='compress the "-archive" (gzip for tar, deflate for zip).')
+    parser.add_argument('-materialize', metavar='path/to/container', type=str, default=None,
+                        help='create samples from the "-delta" container to the "-out" directory.\n'
+                             '"-in" is used if the original file was moved.')
+    parser.add_argument('-sample', metavar='name', action='append', default=None,
+                        help='name or number of the sample to materialize. multiple "-sample" supported.')
+    parser.add_argument('-log', choices=['text', 'jsonl', 'both'], default='text',
+                        help='format of the run log. "text" is default. "jsonl" writes one JSON record per sample\n'
+                             'with the donor, sample path, parts, size, checksum and build time.')
+    parser.add_argument('-profile', action='store_true',
+                        help=f'save wall and CPU time of the run stages and the slowest donor files\n'
+                             f'to the "{PROFILE_FILE_NAME}_*.json" file in the log directory.')
+    parser.add_argument('-manifest-db', dest='manifest_db', action='store_true',
+                        help=f'write the "{MANIFEST_FILE_NAME}" SQLite database with the original, donor, parts, size\n'
+                             f'and checksum of every sample to the log directory.')
+    parser.add_argument('-resume', metavar='path/to/dir', type=str, default=None,
+                        help=f'continue the interrupted donor search from the "{CHECKPOINT_FILE_NAME}" in the sample directory.\n'
+                             f'samples are added to the same directory, other switches are taken from the checkpoint.')
+    parser.add_argument('-negative-cache', dest='negative_cache', metavar='path/to/file', type=str, default=None,
+                        help='SQLite file of the invalid donors and the parts missing in the donors, kept between the runs.\n'
+                             'donors without any selected part are skipped without reading them while their size and time are the same.')
+    parser.add_argument('-result-cache', dest='result_cache', metavar='path/to/dir', type=str, default=None,
+                        help='directory of the samples cached by the original, donors, options and "-seed".\n'
+                             'samples built before are linked from the cache instead of building them again.')
+    parser.add_argument('-seed', metavar='int', type=int, default=None,
+                        help='seed of the import shuffling, samples from the same donor are the same in every run.')
+    parser.add_argument('-metrics', metavar='path/to/file', type=str, default=None,
+                        help=f'save counters of scanned files, read bytes, rejected donors by reason and written samples\n'
+                             f'every {METRICS_INTERVAL} seconds and at the end of the run. JSON or Prometheus text file if ends with ".prom".')
+    parser.add_argument('-dedup', action='store_true', help='skip donors whose transplanted parts are identical to an already used donor.')
+    parser.add_argument('-dedup-samples', dest='dedup_samples', action='store_true', help='skip samples identical to an already saved sample.')
+    parser.add_argument('-combine', action='store_true',
+                        help='combine parts of different donors in one sample. every selected part is taken\n'
+                             'from any donor which has it, so a donor does not need all of them. use with "-limit".')
     parser.add_argument('-approx', action='store_true',
                         help='use of variants with incomplete match.\n'
                         '-------------------------------------------------------------------------------------')
@@ -2956,16 +5615,246 @@ if __name__ == '__main__':
                         help='do not add Debug Info to the resources if it is missing or does not fit in size.')
     parser.add_argument('-res-manifest', dest='manifest_allowed', action='store_true', help='allow adding donor manifest.')
     parser.add_argument('-no-checksum', dest='upd_checksum', action='store_false', help='do not update the checksum.')
-    initargs = parser.parse_args()
+    return parser
+
+
+# search donors for the daemon job using the parsed donors of the cache
+def search_donors_cached(run, args, cache):
+    paths = iter_donor_paths(args, run.metrics)
+    if run.negative_cache is not None:
+        paths = run.negative_cache.filter(paths, [run.pe.options], args, run.metrics)
+    donors = cache.iter_donors(Profiler.iterate('walk', paths), args, run.negative_cache, run.metrics)
+    samples = iter_samples(run, iter_evaluated_donors(run, donors, args), args)
+    write_samples(run, samples, args)
+
+
+# run the daemon job.
+# The job is a dict: {"in": path, "out": dir, "limit": int, "sd": path, "options": ["-rich", ...]},
+# only "in" is required, "sd" and "-d" of the daemon are used by default.
+# returns dict with the output directory, log path and samples or with the error message
+def run_daemon_job(job, args, cache, negative_cache=None, metrics=None):
+    if not isinstance(job, dict) or not isinstance(job.get('in'), str):
+        return {'error': 'The "in" file is required.'}
+    argv = [str(option) for option in job.get('options', [])]
+    argv += ['-in', job['in'], '-sd', str(job.get('sd', args.sd)), '-d', str(args.depth)]
+    if job.get('out'):
+        argv += ['-out', str(job['out'])]
+    if job.get('limit'):
+        argv += ['-limit', str(job['limit'])]
+    try:
+        job_args = get_parser().parse_args(argv)
+        if job_args.batch or job_args.materialize or job_args.merge or job_args.serve or job_args.metrics or \
+                job_args.negative_cache:
+            return {'error': '"-batch", "-materialize", "-merge", "-serve", "-metrics" and "-negative-cache" '
+                             'can not be used in the job.'}
+        check_args(job_args)
+    except SystemExit as e:
+        return {'error': f'Invalid job options, exit code: {e.code}. See the daemon output.'}
+    finally:
+        # Ctrl + C stops the daemon instead of the job
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+    options = Options()
+    set_options(job_args, options)
+    run = MimicRun(job_args.in_file, job_args.out_dir, job_args.limit)
+    run.negative_cache = negative_cache
+    run.metrics = metrics
+    profile_path = None
+    try:
+        run.log = Log(job_args, options)
+        run.log.start()
+        if job_args.manifest_db:
+            run.manifest = Manifest(os.path.join(job_args.out_dir, MANIFEST_FILE_NAME))
+        if job_args.result_cache:
+            run.result_cache = ResultCache(job_args.result_cache)
+        if job_args.profile:
+            run.profiler = Profiler()
+            run.profiler.start()
+        if options.remove_mode:
+            # parts are removed from the parsed original, so it is not cached
+            run.pe = check_original(job_args.in_file, job_args, options)
+        else:
+            run.pe = cache.get_original(job_args.in_file, job_args, options)
+        if job_args.delta:
+            run.delta = DeltaStore(job_args, run.pe)
+        elif job_args.archive:
+            run.archive = ArchiveSink(job_args)
+        if options.remove_mode:
+            clear_original(run, job_args)
+        elif job_args.combine:
+            # pooled donors must keep their bytes, so they are not taken from the cache
+            search_donors_combined(run, job_args)
+        else:
+            search_donors_cached(run, job_args, cache)
+        if job_args.profile:
+            profile_path = run.profiler.save(run.out_dir)
+    except OriginalError as e:
+        return {'error': str(e), 'log': run.log.get_path() if run.log else None}
+    except SystemExit as e:
+        return {'error': f'Job failed, exit code: {e.code}. See the log.', 'log': run.log.get_path() if run.log else None}
+    finally:
+        run.close()
+    samples = []
+    for sample_name, donor_path, part_paths, parts in run.samples:
+        sample = {'name': sample_name, 'donor': donor_path, 'donors': part_paths,
+                  'parts': {k: v for k, v in parts.items() if k != 'message'}}
+        if not job_args.delta and not job_args.archive:
+            sample['path'] = os.path.join(run.out_dir, sample_name)
+        samples.append(sample)
+    result = {'out_dir': run.out_dir, 'log': run.log.get_path(), 'samples': samples}
+    if run.log.get_jsonl_path():
+        result['jsonl_log'] = run.log.get_jsonl_path()
+    if profile_path:
+        result['profile'] = profile_path
+    if job_args.manifest_db:
+        result['manifest'] = run.manifest.get_path()
+    return result
+
+
+# serve mimic jobs on the localhost port until Ctrl + C
+def run_daemon(args):
+    cache_mb = DAEMON_CACHE_MB if args.cache_mb is None else args.cache_mb
+    if cache_mb < 0:
+        exit_program(f'Invalid value for "-cache-mb": {args.cache_mb}.')
+    MimicRequestHandler.cache = MimicCache(cache_mb * 1024 * 1024)
+    MimicRequestHandler.args = args
+    if args.metrics:
+        MimicRequestHandler.metrics = Metrics(args.metrics)  # counters are shared by all jobs of the daemon
+    if args.negative_cache:
+        MimicRequestHandler.negative_cache = NegativeCache(args.negative_cache)  # shared by all jobs of the daemon
+    try:
+        server = http.server.HTTPServer((DAEMON_HOST, args.serve), MimicRequestHandler)
+    except OSError as e:
+        exit_program(f'Can not start the daemon on port {args.serve}: {e}.')
+    msg = f'Daemon is listening on http://{DAEMON_HOST}:{server.server_port}'
+    print(f'{Back.CYAN}{msg}{Back.RESET}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        # the sinks of the daemon are closed only on its shutdown, never by the jobs
+        if MimicRequestHandler.metrics is not None:
+            MimicRequestHandler.metrics.close()
+        if MimicRequestHandler.negative_cache is not None:
+            MimicRequestHandler.negative_cache.close()
+    stats = MimicRequestHandler.cache.get_stats()
+    msg = 'Donor cache: ' + ', '.join(f'{k}: {v}' for k, v in stats.items())
+    print(f'{Back.CYAN}{msg}{Back.RESET}')
+
+
+# get arguments for the library functions in the command line format.
+# get_args(['-rich', '-sign', '-no-checksum']) selects the parts as the same command line switches.
+def get_args(argv=None):
+    args = get_parser().parse_args([] if argv is None else argv)
+    if args.ext:
+        args.ext = tuple(args.ext)
+    else:
+        args.ext = ('.exe', '.dll')
+    return args
+
+
+# check original PE in memory.
+# "data" is bytes, bytearray or mmap, "path" is used only for the names of the samples.
+# returns MimicPE with its own options, raises OriginalError if the file can not be used.
+def analyze(data, args=None, path='original.exe'):
+    if args is None:
+        args = get_args()
+    options = Options()
+    set_options(args, options)
+    return parse_original(path, data, args, options)
+
+
+# check donor PE in memory matches the original returned by analyze
+# returns MimicPE with the parts to transplant or None
+def match_donor(original, data, args=None, path='donor.exe'):
+    if args is None:
+        args = get_args()
+    donor = parse_donor(path, data, args, original.options)
+    if donor is None:
+        return None
+    return evaluate_donor(original, donor, args)
+
+
+# create sample from the original returned by analyze and the donor returned by match_donor.
+# The original is not changed, so samples of the same original can be built concurrently.
+# "parts" dict receives descriptions of the transplanted parts.
+def build_sample(original, donor, args=None, parts=None):
+    if args is None:
+        args = get_args()
+    if parts is None:
+        parts = {}
+    sample_data = get_sample_data(original, donor, args, parts)
+    if isinstance(sample_data, SampleData):
+        sample_data = sample_data.to_bytearray()
+    return bytes(sample_data)
 
+
+if __name__ == '__main__':
+    initargs = get_parser().parse_args()
+    resume_state = None
+    if initargs.resume:
+        resume_state = Checkpoint.load(initargs.resume)     # continue the interrupted search with its arguments
+        os.chdir(resume_state['cwd'])                       # saved paths are relative to the first run directory
+        initargs = get_parser().parse_args(resume_state['argv'])
+        initargs.resume = resume_state['out_dir']
+    INTERACTIVE = initargs.batch is None                    # batch runs do not wait for input
     init()                                                  # Colorama initialization
+    if initargs.materialize:
+        materialized = materialize_samples(initargs)        # create samples from the delta container
+        exit_program(f'Samples materialized: {materialized}', 0)
+    if initargs.merge:
+        merged = merge_shards(initargs)                     # combine sample directories of the shards
+        exit_program(f'Samples merged: {merged}\nFiles saved in: {os.path.abspath(initargs.out_dir)}', 0)
+    if initargs.serve is not None:
+        INTERACTIVE = False
+        run_daemon(initargs)                                # serve jobs until Ctrl + C
+        exit_program('Daemon stopped.', 0)
     check_args(initargs)                                    # check for argument conflicts
-    set_options(initargs)                                   # set options for search
-    Log.init(initargs)                                      # Log initialization
-    original_pe = check_original(initargs)                  # check original file
-    if Options.remove_mode:
-        clear_original(original_pe, initargs)               # remove specified parts
+    initoptions = Options()
+    set_options(initargs, initoptions)                      # set options for search
+    initrun = MimicRun(initargs.batch or initargs.in_file, initargs.out_dir, initargs.limit)  # batch run shares its outputs
+    initrun.log = Log(initargs, initoptions)                # Log initialization
+    initrun.log.start()
+    if initargs.metrics:
+        initrun.metrics = Metrics(initargs.metrics)         # run counters initialization
+        atexit.register(initrun.metrics.close)              # saved at any exit of the process
+    if initargs.negative_cache:
+        initrun.negative_cache = NegativeCache(initargs.negative_cache)  # useless donors of the previous runs
+        atexit.register(initrun.negative_cache.close)       # committed at any exit of the process
+    atexit.register(initrun.close)                          # outputs of the run are closed at any exit of the process
+    if initargs.profile:
+        initrun.profiler = Profiler()                       # stage timing initialization
+        initrun.profiler.start()
+    if initargs.manifest_db:
+        initrun.manifest = Manifest(os.path.join(initargs.out_dir, MANIFEST_FILE_NAME))  # sample database initialization
+    if initargs.result_cache:
+        initrun.result_cache = ResultCache(initargs.result_cache)  # sample cache initialization
+    if initargs.batch:
+        if initargs.archive:
+            initrun.archive = ArchiveSink(initargs)         # archive initialization
+        batch_count = run_batch(initrun, initargs, initoptions)  # check originals and search donors for all of them
+        if initargs.profile:
+            initrun.profiler.save(initargs.out_dir)         # save stage timing report
+        exit_program(f'Originals processed: {batch_count}\nLog saved in: {initargs.out_dir}', 0)
+    initrun.pe = check_original(initargs.in_file, initargs, initoptions)  # check original file
+    if initargs.delta:
+        initrun.delta = DeltaStore(initargs, initrun.pe)    # delta container initialization
+    elif initargs.archive:
+        initrun.archive = ArchiveSink(initargs)             # archive initialization
+    if initoptions.remove_mode:
+        clear_original(initrun, initargs)                   # remove specified parts
+    elif initargs.combine:
+        search_donors_combined(initrun, initargs)           # combine parts of different donors
     else:
-        search_donors(original_pe, initargs)                # search donors for original file
-    os.startfile(initargs.out_dir)                          # open sample directory in explorer
+        if not initargs.delta and not initargs.archive:
+            argv = resume_state['argv'] if resume_state else sys.argv[1:]
+            initrun.checkpoint = Checkpoint(initrun, argv, resume_state)  # progress for "-resume"
+        search_donors(initrun, initargs)                    # search donors for original file
+        if initrun.checkpoint is not None:
+            initrun.checkpoint.finish()
+    if initargs.profile:
+        initrun.profiler.save(initargs.out_dir)             # save stage timing report
+    if hasattr(os, 'startfile'):
+        os.startfile(initargs.out_dir)                      # open sample directory in explorer
     exit_program(f'Files savad in: {initargs.out_dir}', 0)  # cleanup and exit
@@ -0,0 +1,161 @@
+import json
+import os
+import random
+import re
+import signal
+import struct
+import subprocess
+import sys
+import types
+import urllib.request
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, 'PEmimic.py')
+sys.path.insert(0, ROOT)
+
+
+# Rich Header with "count" values xored with "key"
+def get_rich(count, key):
+    values = [(0x0102 << 16 | 0x7809, 5), (258 << 16 | 1, 3), (1 << 16, 7)][:count]
+    dwords = [0x536e6144 ^ key, key, key, key]
+    for comp_id, uses in values:
+        dwords += [comp_id ^ key, uses ^ key]
+    return b''.join(v.to_bytes(4, 'little') for v in dwords) + b'Rich' + key.to_bytes(4, 'little')
+
+
+def with_rich(data, count, key):
+    data = bytearray(data)
+    rich = get_rich(count, key)
+    data[0x80:0x80 + len(rich)] = rich
+    return data
+
+
+def with_stamp(data, stamp):
+    data = bytearray(data)
+    e_lfanew = struct.unpack_from('<I', data, 0x3c)[0]
+    struct.pack_into('<I', data, e_lfanew + 8, stamp)
+    return data
+
+
+# append random sign and point the security data directory to it
+def with_sign(data, size, is64=True):
+    data = bytearray(data)
+    e_lfanew = struct.unpack_from('<I', data, 0x3c)[0]
+    dd_offset = e_lfanew + 24 + (112 if is64 else 96) + 8 * 4
+    struct.pack_into('<II', data, dd_offset, len(data), size)
+    data += random.Random(size).randbytes(size)
+    return data
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(data)
+    return path
+
+
+# original with Rich Header and TimeDateStamp, donors with Rich Header, TimeDateStamp and sign.
+# "d3copy" is a copy of "d3", "junk" and "empty" are not PE files.
+@pytest.fixture(scope='session')
+def corpus(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp('corpus'))
+    with open(os.path.join(ROOT, 'checksum64.dll'), 'rb') as file:
+        pe64 = file.read()
+    with open(os.path.join(ROOT, 'checksum32.dll'), 'rb') as file:
+        pe32 = file.read()
+    donors = os.path.join(root, 'donors')
+    d3 = with_sign(with_stamp(with_rich(pe64, 3, 0x01020304), 0x9999), 700)
+    write_file(os.path.join(donors, 'd1.dll'), with_sign(with_stamp(with_rich(pe64, 2, 0x55667788), 0x1234), 1000))
+    write_file(os.path.join(donors, 'd2.dll'), with_sign(with_stamp(with_rich(pe64, 1, 0x0badf00d), 0x4321), 500))
+    write_file(os.path.join(donors, 'sub', 'd3.dll'), d3)
+    write_file(os.path.join(donors, 'sub', 'd3copy.dll'), d3)
+    write_file(os.path.join(donors, 'd4_32.dll'), with_sign(with_stamp(with_rich(pe32, 2, 0x77777777), 0x1111), 300, is64=False))
+    write_file(os.path.join(donors, 'junk.dll'), b'MZ' + random.Random(0).randbytes(500))
+    write_file(os.path.join(donors, 'empty.exe'), b'')
+    original = write_file(os.path.join(root, 'orig.dll'), with_stamp(with_rich(pe64, 3, 0x11223344), 0x5000))
+    return types.SimpleNamespace(root=root, donors=donors, original=original, size=len(pe64))
+
+
+# run PEmimic.py as the command line tool
+def run_mimic(*args, cwd=None):
+    result = subprocess.run([sys.executable, SCRIPT, *args], cwd=cwd, stdin=subprocess.DEVNULL,
+                            capture_output=True, text=True)
+    assert 'Traceback' not in result.stdout + result.stderr, result.stdout + result.stderr
+    return result
+
+
+# run PEmimic.py and press Ctrl + C when the file which name starts with "prefix" is opened
+def run_mimic_interrupted(prefix, *args):
+    code = ('import builtins, os, runpy, signal, sys\n'
+            'open_file = builtins.open\n'
+            'prefix = sys.argv[1]\n'
+            'def interrupting_open(path, *args, **kwargs):\n'
+            '    if os.path.basename(str(path)).startswith(prefix):\n'
+            '        os.kill(os.getpid(), signal.SIGINT)\n'
+            '    return open_file(path, *args, **kwargs)\n'
+            'builtins.open = interrupting_open\n'
+            'sys.argv = sys.argv[2:]\n'
+            'runpy.run_path(sys.argv[0], run_name="__main__")\n')
+    return subprocess.run([sys.executable, '-c', code, prefix, SCRIPT, *args], stdin=subprocess.DEVNULL,
+                          capture_output=True, text=True)
+
+
+# daemon started with "-serve" on a free port, "post" runs the job and returns its result
+class Daemon:
+    def __init__(self, *args):
+        self.process = subprocess.Popen([sys.executable, SCRIPT, '-serve', '0', *args], stdin=subprocess.DEVNULL,
+                                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        self.output = ''
+        for line in self.process.stdout:
+            self.output += line
+            match = re.search(r'http://[\d.]+:\d+', line)
+            if match:
+                self.url = match.group(0)
+                break
+        else:
+            raise AssertionError(f'Daemon is not started:\n{self.output}')
+
+    def post(self, job):
+        request = urllib.request.Request(self.url, data=json.dumps(job).encode(), method='POST')
+        try:
+            with urllib.request.urlopen(request) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            return json.load(e)
+
+    def get(self):
+        with urllib.request.urlopen(self.url) as response:
+            return json.load(response)
+
+    def stop(self):
+        self.process.send_signal(signal.SIGINT)
+        self.output += self.process.communicate(timeout=60)[0]
+        return self.output
+
+
+@pytest.fixture
+def daemon(corpus):
+    daemon = Daemon('-sd', corpus.donors)
+    yield daemon
+    if daemon.process.poll() is None:
+        daemon.stop()
+
+
+# files created in the output directory, except the logs and the other service files
+def get_samples(out_dir):
+    samples = {}
+    for root, dirs, files in os.walk(out_dir):
+        for name in files:
+            if not name.startswith('_mimic_'):
+                with open(os.path.join(root, name), 'rb') as file:
+                    samples[name] = file.read()
+    return samples
+
+
+# get the only file in the output directory which starts with "prefix"
+def find_file(out_dir, prefix):
+    found = [os.path.join(root, name) for root, dirs, files in os.walk(out_dir) for name in files if name.startswith(prefix)]
+    assert len(found) == 1, found
+    return found[0]
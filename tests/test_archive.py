@@ -0,0 +1,46 @@
+import json
+import tarfile
+import zipfile
+
+import pytest
+
+from conftest import find_file, get_samples, run_mimic
+
+
+def read_archive(path):
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            return {name: archive.read(name) for name in archive.namelist()}
+    with tarfile.open(path) as archive:
+        return {member.name: archive.extractfile(member).read() for member in archive.getmembers()}
+
+
+@pytest.mark.parametrize('archive_args', [('-archive', 'tar'), ('-archive', 'zip', '-compress')])
+def test_archive_contains_samples_index_and_log(corpus, tmp_path, archive_args):
+    files_dir = str(tmp_path / 'files')
+    archive_dir = str(tmp_path / 'archive')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', files_dir, '-rich', '-timePE')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', archive_dir, '-rich', '-timePE', *archive_args)
+    assert get_samples(archive_dir) == {}
+    files = read_archive(find_file(archive_dir, '_mimic_samples.'))
+    index = json.loads(files.pop('_mimic_index.json'))
+    logs = [name for name in files if name.startswith('_mimic_log')]
+    assert len(logs) == 1
+    assert b'Files savad in' in files.pop(logs[0])
+    samples = get_samples(files_dir)
+    assert files == samples
+    assert sorted(sample['name'] for sample in index) == sorted(samples)
+    assert all(sample['donor'] and 'rich' in sample['parts'] for sample in index)
+
+
+def test_daemon_jobs_write_own_archives(corpus, daemon, tmp_path):
+    names = []
+    for job_dir, options in ((tmp_path / 'first', ['-rich']), (tmp_path / 'second', ['-timePE'])):
+        result = daemon.post({'in': corpus.original, 'out': str(job_dir), 'options': options + ['-archive', 'zip']})
+        assert 'error' not in result, result
+        files = read_archive(find_file(str(job_dir), '_mimic_samples.'))
+        index = json.loads(files['_mimic_index.json'])
+        assert [sample['name'] for sample in index] == [sample['name'] for sample in result['samples']]
+        names.append(set(files))
+    assert len(result['samples']) == 5
+    assert not names[0] & names[1] - {'_mimic_index.json'}
@@ -0,0 +1,55 @@
+import os
+import shutil
+
+from conftest import get_samples, run_mimic
+
+
+def get_contents(out_dir):
+    return sorted(get_samples(out_dir).values())
+
+
+def make_originals(corpus, tmp_path):
+    originals = tmp_path / 'originals'
+    originals.mkdir()
+    shutil.copy(corpus.original, originals / 'a.dll')
+    shutil.copy(os.path.join(corpus.donors, 'd4_32.dll'), originals / 'c.dll')
+    return originals
+
+
+def test_samples_are_the_same_as_single_runs(corpus, tmp_path):
+    originals = make_originals(corpus, tmp_path)
+    out_dir = str(tmp_path / 'batch')
+    run_mimic('-batch', str(originals), '-sd', corpus.donors, '-out', out_dir, '-rich', '-timePE')
+    for name in ('a', 'c'):
+        single_dir = str(tmp_path / name)
+        run_mimic('-in', str(originals / f'{name}.dll'), '-sd', corpus.donors, '-out', single_dir, '-rich', '-timePE')
+        assert get_contents(os.path.join(out_dir, '_mimic_samples', f'{name}_mimics')) == get_contents(single_dir)
+    assert len(get_samples(out_dir)) == 8
+
+
+def test_failed_original_is_skipped(corpus, tmp_path):
+    originals = make_originals(corpus, tmp_path)
+    shutil.copy(os.path.join(corpus.donors, 'junk.dll'), originals / 'bad.dll')
+    out_dir = str(tmp_path / 'out')
+    result = run_mimic('-batch', str(originals), '-sd', corpus.donors, '-out', out_dir, '-rich')
+    assert f'Original skipped: {originals / "bad.dll"}' in result.stdout
+    assert 'Originals processed: 2' in result.stdout
+    assert not os.path.exists(os.path.join(out_dir, '_mimic_samples', 'bad_mimics'))
+
+
+def test_list_file_and_limit_per_original(corpus, tmp_path):
+    make_originals(corpus, tmp_path)
+    list_path = tmp_path / 'originals.txt'
+    list_path.write_text('originals/a.dll\noriginals/c.dll\n')
+    out_dir = str(tmp_path / 'out')
+    # relative paths of the list are taken from the current directory
+    run_mimic('-batch', str(list_path), '-sd', corpus.donors, '-out', out_dir, '-rich', '-limit', '2', cwd=str(tmp_path))
+    for name in ('a', 'c'):
+        assert len(get_samples(os.path.join(out_dir, '_mimic_samples', f'{name}_mimics'))) == 2
+
+
+def test_delta_is_rejected(corpus, tmp_path):
+    originals = make_originals(corpus, tmp_path)
+    result = run_mimic('-batch', str(originals), '-sd', corpus.donors, '-out', str(tmp_path / 'out'), '-rich', '-delta')
+    assert '"-delta" \tcannot be used with "-batch"' in result.stdout
+    assert get_samples(str(tmp_path / 'out')) == {}
@@ -0,0 +1,72 @@
+import json
+import os
+import shutil
+
+import PEmimic
+from conftest import find_file, get_samples, run_mimic, run_mimic_interrupted
+
+SEARCH_ARGS = ('-rich', '-timePE', '-dedup', '-dedup-samples')
+
+
+def test_interrupted_run_is_resumed(corpus, tmp_path):
+    full_dir = str(tmp_path / 'full')
+    resumed_dir = str(tmp_path / 'resumed')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', full_dir, *SEARCH_ARGS)
+    # Ctrl + C while the second sample is written
+    result = run_mimic_interrupted('2_', '-in', corpus.original, '-sd', corpus.donors, '-out', resumed_dir, *SEARCH_ARGS)
+    assert 'KeyboardInterrupt' in result.stdout
+    checkpoint = find_file(resumed_dir, '_mimic_checkpoint')
+    with open(checkpoint) as f:
+        state = json.load(f)
+    assert not state['finished']
+    assert not state['done']
+    assert len(state['donor_digests']) == 1
+    assert len(state['sample_digests']) == 1
+    assert len(get_samples(resumed_dir)) == 1
+
+    run_mimic('-resume', checkpoint)
+    samples = get_samples(full_dir)
+    assert len(samples) == 4  # the copy of "d3" is skipped
+    assert get_samples(resumed_dir) == samples
+    with open(checkpoint) as f:
+        assert json.load(f)['finished']
+
+
+def test_finished_run_is_not_resumed(corpus, tmp_path):
+    out_dir = str(tmp_path / 'out')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', out_dir, *SEARCH_ARGS)
+    result = run_mimic('-resume', find_file(out_dir, '_mimic_checkpoint'))
+    assert 'The run is already finished' in result.stdout
+    assert len(get_samples(out_dir)) == 4
+
+
+def test_changed_donors_are_not_resumed(corpus, tmp_path):
+    donors = str(tmp_path / 'donors')
+    shutil.copytree(corpus.donors, donors)
+    out_dir = str(tmp_path / 'out')
+    run_mimic_interrupted('2_', '-in', corpus.original, '-sd', donors, '-out', out_dir, *SEARCH_ARGS)
+    checkpoint = find_file(out_dir, '_mimic_checkpoint')
+    with open(checkpoint) as f:
+        os.remove(json.load(f)['path'])
+    result = run_mimic('-resume', checkpoint)
+    assert 'Donor files changed since the checkpoint' in result.stdout
+    assert len(get_samples(out_dir)) == 1
+
+
+def test_checkpoints_of_two_runs_are_independent(tmp_path):
+    runs = [PEmimic.MimicRun(f'{name}.exe', str(tmp_path / name), 10) for name in ('first', 'second')]
+    checkpoints = []
+    for run in runs:
+        os.makedirs(run.out_dir)
+        checkpoints.append(PEmimic.Checkpoint(run, ['-in', run.path]))
+    assert list(checkpoints[0].iter_loaded((path, b'') for path in checkpoints[0].iter_paths(['a', 'b']))) == \
+        [('a', b''), ('b', b'')]
+    checkpoints[0].finish()
+    checkpoints[1].close()
+    states = []
+    for run in runs:
+        with open(os.path.join(run.out_dir, PEmimic.CHECKPOINT_FILE_NAME)) as f:
+            states.append(json.load(f))
+    assert (states[0]['finished'], states[0]['position'], states[0]['path']) == (True, 1, 'b')
+    assert (states[1]['finished'], states[1]['position'], states[1]['path']) == (False, 0, None)
+    assert states[1]['argv'] == ['-in', 'second.exe']
@@ -0,0 +1,52 @@
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PEmimic  # noqa: E402
+
+
+# PE-like data with random content, only "e_lfanew" is required by the checksum
+def get_data(size, e_lfanew=0x80):
+    rnd = random.Random(size)
+    data = bytearray(rnd.randbytes(size))
+    data[0x3c:0x40] = e_lfanew.to_bytes(4, 'little')
+    return bytes(data)
+
+
+# splits data into FileRange, bytes and memoryview segments of unaligned sizes
+def get_sample_data(data, sizes):
+    segments = []
+    offset = 0
+    for i, size in enumerate(sizes):
+        part = data[offset:offset + size]
+        if i % 3 == 0:
+            segments.append(PEmimic.FileRange(offset, len(part)))
+        elif i % 3 == 1:
+            segments.append(bytes(part))
+        else:
+            segments.append(memoryview(part))
+        offset += size
+    segments.append(PEmimic.FileRange(offset, len(data) - offset))
+    return PEmimic.SampleData(data, 'original.exe', segments)
+
+
+@pytest.mark.parametrize('size, sizes, chunk_size', [
+    (0x1000, [0x200, 0x200, 0x200], 0x100000),
+    (0x1001, [0x201, 0x203, 0x1ff, 0x101, 0x102], 0x100000),
+    (0x2003, [0x3c1, 0x5, 0x7, 0x9, 0x11, 0x13, 0x17], 0x7),
+    (0x3002, [0x101, 0x303, 0x1, 0x2, 0x3, 0x500], 0x1fd),
+    (0x3000, [0x400, 0x400, 0x3ff, 0x400], 0x100000),
+])
+def test_update_checksum_segments_equals_py(monkeypatch, size, sizes, chunk_size):
+    monkeypatch.setattr(PEmimic, 'CHECKSUM_CHUNK_SIZE', chunk_size)
+    # keep the memoryview segments as they are instead of copying them into bytes
+    monkeypatch.setattr(PEmimic, 'SAMPLE_SLICE_BYTES_LIMIT', 0)
+    data = get_data(size)
+    result = PEmimic.update_checksum_segments(get_sample_data(data, sizes))
+    if isinstance(result, PEmimic.SampleData):
+        result = result.to_bytearray()
+    assert bytes(result) == bytes(PEmimic.update_checksum_py(data))
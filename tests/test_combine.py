@@ -0,0 +1,36 @@
+import json
+import os
+import sqlite3
+import tarfile
+
+from conftest import find_file, run_mimic
+
+COMBINE_ARGS = ('-rich', '-timePE', '-sign', '-combine', '-limit', '30')
+
+
+def test_combined_sample_names_are_bounded(corpus, tmp_path):
+    out_dir = str(tmp_path / 'out')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', out_dir, *COMBINE_ARGS,
+              '-archive', 'tar', '-manifest-db', '-log', 'jsonl')
+    with tarfile.open(find_file(out_dir, '_mimic_samples.')) as archive:
+        index = json.load(archive.extractfile('_mimic_index.json'))
+    assert len(index) == 30
+    combined = [sample for sample in index if len(set(sample['donors'].values())) > 1]
+    assert combined
+    for sample in combined:
+        assert '_combined_' in sample['name']
+        assert len(sample['name']) < 64
+        assert set(sample['donors']) == {'rich', 'stamp', 'sign'}
+        assert all(os.path.isfile(path) for path in sample['donors'].values())
+
+    # the sources of the parts are written to the jsonl log and the manifest
+    with open(find_file(out_dir, '_mimic_log')) as log:
+        records = {record['sample']: record for record in map(json.loads, log) if record['type'] == 'sample'}
+    with sqlite3.connect(find_file(out_dir, '_mimic_manifest')) as connection:
+        rows = connection.execute('SELECT sample, kind, parts.donor FROM samples JOIN parts ON sample_id = samples.id').fetchall()
+    manifest = {(sample, kind): donor for sample, kind, donor in rows}
+    for sample in combined:
+        assert records[sample['name']]['donors'] == sample['donors']
+        assert manifest[(sample['name'], 'rich')] == sample['donors']['rich']
+        assert manifest[(sample['name'], 'timePE')] == sample['donors']['stamp']
+        assert manifest[(sample['name'], 'sign')] == sample['donors']['sign']
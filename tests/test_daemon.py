@@ -0,0 +1,70 @@
+import json
+import os
+import shutil
+import urllib.request
+
+from conftest import Daemon, get_samples, run_mimic, with_stamp
+
+
+def test_job_samples_are_the_same_as_command_line(corpus, daemon, tmp_path):
+    for options in (['-rich'], ['-timePE', '-sign'], ['-rem-rich']):
+        job_dir = str(tmp_path / 'job' / options[0])
+        cli_dir = str(tmp_path / 'cli' / options[0])
+        result = daemon.post({'in': corpus.original, 'out': job_dir, 'options': options})
+        assert 'error' not in result, result
+        run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', cli_dir, *options)
+        samples = get_samples(job_dir)
+        assert samples == get_samples(cli_dir)
+        assert sorted(sample['name'] for sample in result['samples']) == sorted(samples)
+
+
+def test_donors_are_parsed_once(corpus, daemon, tmp_path):
+    for name in ('first', 'second'):
+        daemon.post({'in': corpus.original, 'out': str(tmp_path / name), 'options': ['-rich']})
+    # "-rem-rich" parses the original again, so it is not cached
+    daemon.post({'in': corpus.original, 'out': str(tmp_path / 'rem'), 'options': ['-rem-rich']})
+    stats = daemon.get()
+    assert stats['misses'] == 7
+    assert stats['hits'] == 7
+    assert stats['originals'] == 1
+
+
+def test_changed_donor_is_parsed_again(corpus, tmp_path):
+    donors = str(tmp_path / 'donors')
+    shutil.copytree(corpus.donors, donors)
+    daemon = Daemon('-sd', donors)
+    try:
+        first = daemon.post({'in': corpus.original, 'out': str(tmp_path / 'first'), 'options': ['-timePE']})
+        with open(os.path.join(donors, 'd1.dll'), 'rb') as file:
+            data = file.read()
+        with open(os.path.join(donors, 'd1.dll'), 'wb') as file:
+            file.write(with_stamp(data, 0x2468) + b'\0')
+        second = daemon.post({'in': corpus.original, 'out': str(tmp_path / 'second'), 'options': ['-timePE']})
+        stats = daemon.get()
+    finally:
+        daemon.stop()
+    assert 'error' not in first and 'error' not in second
+    assert stats['misses'] == 8
+    run_mimic('-in', corpus.original, '-sd', donors, '-out', str(tmp_path / 'cli'), '-timePE')
+    assert get_samples(str(tmp_path / 'second')) == get_samples(str(tmp_path / 'cli'))
+    assert get_samples(str(tmp_path / 'second')) != get_samples(str(tmp_path / 'first'))
+
+
+def test_invalid_jobs_are_rejected(corpus, daemon, tmp_path):
+    missing = daemon.post({'out': str(tmp_path / 'out')})
+    batch = daemon.post({'in': corpus.original, 'options': ['-batch', corpus.root]})
+    options = daemon.post({'in': corpus.original, 'options': ['-unknown']})
+    request = urllib.request.Request(daemon.url, data=b'{', method='POST')
+    try:
+        urllib.request.urlopen(request)
+    except urllib.error.HTTPError as e:
+        assert e.code == 400
+        assert json.load(e)['error'].startswith('Invalid job')
+    else:
+        raise AssertionError('Invalid JSON is accepted.')
+    assert missing == {'error': 'The "in" file is required.'}
+    assert batch['error'].startswith('"-batch"')
+    assert options['error'].startswith('Invalid job options')
+    # the daemon serves the next job after the rejected ones
+    result = daemon.post({'in': corpus.original, 'out': str(tmp_path / 'out'), 'options': ['-rich']})
+    assert len(result['samples']) == 5
@@ -0,0 +1,43 @@
+import argparse
+import os
+
+import PEmimic
+
+
+def get_args():
+    return argparse.Namespace(manifest_allowed=True, drop_cache=False, max_parse_ms=0, max_res_entries=0)
+
+
+def get_res_bytes(donor):
+    return [res_data.data_bytes for res_data in PEmimic.MimicCache.iter_res_data(donor)]
+
+
+def test_cache_budget_counts_resource_data(corpus):
+    cache = PEmimic.MimicCache()
+    donor = cache.get_donor(os.path.join(corpus.donors, 'd1.dll'), get_args())
+    res_size = sum(len(data_bytes) for data_bytes in get_res_bytes(donor))
+    assert res_size > 0  # the donor manifest
+    assert cache.data_size == donor.data.kept_size + res_size
+
+
+def test_cache_evicts_and_reloads_resource_data(corpus):
+    args = get_args()
+    d1_path = os.path.join(corpus.donors, 'd1.dll')
+    d2_path = os.path.join(corpus.donors, 'd2.dll')
+    cache = PEmimic.MimicCache()
+    d1 = cache.get_donor(d1_path, args)
+    d1_size = cache.data_size
+    res_bytes = get_res_bytes(d1)
+    cache.budget = d1_size  # only one donor fits the budget
+
+    d2 = cache.get_donor(d2_path, args)
+    assert cache.evictions == 1
+    assert d1.data is None
+    assert get_res_bytes(d1) == [None]
+    assert cache.data_size == cache.get_data_size(d2) <= cache.budget
+
+    assert cache.get_donor(d1_path, args) is d1
+    assert cache.reloads == 1
+    assert get_res_bytes(d1) == res_bytes
+    assert d2.data is None
+    assert cache.data_size == d1_size
@@ -0,0 +1,37 @@
+import os
+import shutil
+
+from conftest import get_samples, run_mimic, with_stamp
+
+
+def test_duplicate_donor_is_skipped(corpus, tmp_path):
+    result = run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', str(tmp_path / 'out'), '-rich', '-dedup')
+    # "d3copy" is the copy of "d3"
+    assert 'Duplicate donors skipped: 1.' in result.stdout
+    assert len(get_samples(str(tmp_path / 'out'))) == 4
+
+
+def test_donors_are_compared_by_selected_parts(corpus, tmp_path):
+    donors = str(tmp_path / 'donors')
+    shutil.copytree(corpus.donors, donors)
+    # the copy of "d1" with the other TimeDateStamp gives the same Rich Header
+    with open(os.path.join(donors, 'd1.dll'), 'rb') as file:
+        data = file.read()
+    with open(os.path.join(donors, 'd1stamp.dll'), 'wb') as file:
+        file.write(with_stamp(data, 0x7777))
+    rich = run_mimic('-in', corpus.original, '-sd', donors, '-out', str(tmp_path / 'rich'), '-rich', '-dedup')
+    stamp = run_mimic('-in', corpus.original, '-sd', donors, '-out', str(tmp_path / 'stamp'), '-timePE', '-dedup')
+    assert 'Duplicate donors skipped: 2.' in rich.stdout
+    assert 'Duplicate donors skipped: 1.' in stamp.stdout
+    assert len(get_samples(str(tmp_path / 'rich'))) == 4
+    assert len(get_samples(str(tmp_path / 'stamp'))) == 5
+
+
+def test_duplicate_sample_is_skipped(corpus, tmp_path):
+    result = run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', str(tmp_path / 'dedup'), '-rich',
+                       '-dedup-samples')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', str(tmp_path / 'all'), '-rich')
+    assert 'Duplicate samples skipped: 1.' in result.stdout
+    samples = get_samples(str(tmp_path / 'dedup'))
+    assert len(samples) == 4
+    assert set(samples.values()) == set(get_samples(str(tmp_path / 'all')).values())
@@ -0,0 +1,41 @@
+import os
+
+from conftest import find_file, get_samples, run_mimic
+
+
+def test_delta_materialize_equals_samples(corpus, tmp_path):
+    files_dir = str(tmp_path / 'files')
+    delta_dir = str(tmp_path / 'delta')
+    materialized_dir = str(tmp_path / 'materialized')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', files_dir, '-rich', '-timePE')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', delta_dir, '-rich', '-timePE', '-delta')
+    container = find_file(delta_dir, '_mimic_delta')
+    run_mimic('-materialize', container, '-out', materialized_dir)
+
+    samples = get_samples(files_dir)
+    assert len(samples) == 5
+    assert get_samples(delta_dir) == {}
+    assert get_samples(materialized_dir) == samples
+    # the samples are stored as patches against the original, the updated checksum included
+    assert os.path.getsize(container) < corpus.size // 2
+
+
+def test_materialize_selected_sample(corpus, tmp_path):
+    delta_dir = str(tmp_path / 'delta')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', delta_dir, '-rich', '-delta')
+    container = find_file(delta_dir, '_mimic_delta')
+    run_mimic('-materialize', container, '-out', str(tmp_path / 'all'))
+    samples = get_samples(str(tmp_path / 'all'))
+    name = sorted(samples)[0]
+    run_mimic('-materialize', container, '-out', str(tmp_path / 'one'), '-sample', name)
+    assert get_samples(str(tmp_path / 'one')) == {name: samples[name]}
+
+
+def test_daemon_jobs_write_own_delta_containers(corpus, daemon, tmp_path):
+    for name in ('first', 'second'):
+        result = daemon.post({'in': corpus.original, 'out': str(tmp_path / name), 'options': ['-rich', '-delta']})
+        assert 'error' not in result, result
+        run_mimic('-materialize', find_file(str(tmp_path / name), '_mimic_delta'), '-out', str(tmp_path / f'{name}_samples'))
+    samples = get_samples(str(tmp_path / 'first_samples'))
+    assert len(samples) == 5
+    assert get_samples(str(tmp_path / 'second_samples')) == samples
@@ -0,0 +1,46 @@
+import os
+import random
+
+import pytest
+
+import PEmimic
+from conftest import find_file, run_mimic
+
+
+def test_kept_ranges_are_sliced_as_donor_file():
+    data = random.Random(0).randbytes(1000)
+    # overlapping and adjacent ranges are merged, the range past the end is cut
+    donor_data = PEmimic.DonorData(data, [(500, 600), (100, 200), (150, 300), (300, 310), (990, 2000)])
+    assert len(donor_data) == len(data)
+    assert donor_data.kept_size == 210 + 100 + 10
+    for start, stop in ((100, 310), (120, 121), (500, 600), (990, 1000), (250, 250)):
+        assert donor_data[start:stop] == data[start:stop]
+        assert bytes(donor_data.view(start, stop)) == data[start:stop]
+    assert donor_data[-1] == data[-1]
+    assert donor_data[150] == data[150]
+    for key in (slice(90, 110), slice(300, 500), 50):
+        with pytest.raises(IndexError):
+            donor_data[key]
+
+
+def test_parsed_donor_keeps_only_transplanted_parts(corpus):
+    args = PEmimic.get_args(['-rich', '-timePE', '-sign'])
+    with open(corpus.original, 'rb') as file:
+        original = PEmimic.analyze(file.read(), args, corpus.original)
+    path = os.path.join(corpus.donors, 'd1.dll')
+    with open(path, 'rb') as file:
+        data = file.read()
+    donor = PEmimic.match_donor(original, data, args, path)
+    assert len(donor.data) == len(data)
+    # the Rich Header, the TimeDateStamp and the 1000 bytes of the sign
+    assert 1000 < donor.data.kept_size < 1200
+    assert donor.data[len(data) - 1000:] == data[len(data) - 1000:]
+
+
+def test_donor_copy_is_read_from_file(corpus, tmp_path):
+    out_dir = str(tmp_path / 'out')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', out_dir, '-rich', '-with-donor', '-limit', '1')
+    with open(os.path.join(corpus.donors, 'd1.dll'), 'rb') as file:
+        data = file.read()
+    with open(find_file(out_dir, '1_d1.dll'), 'rb') as file:
+        assert file.read() == data
@@ -0,0 +1,32 @@
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import PEmimic
+
+
+def get_args(max_parse_ms=0, max_res_entries=0):
+    return argparse.Namespace(max_parse_ms=max_parse_ms, max_res_entries=max_res_entries, manifest_allowed=False)
+
+
+def test_parallel_donors_have_own_limits(monkeypatch, corpus):
+    barrier = threading.Barrier(2)
+    get_rich = PEmimic.get_rich
+
+    # both donors are parsed at the same time, the limited one is out of time after the Rich Header
+    def get_rich_together(*args):
+        barrier.wait(timeout=10)
+        time.sleep(0.2)
+        return get_rich(*args)
+
+    monkeypatch.setattr(PEmimic, 'get_rich', get_rich_together)
+    donor_path = os.path.join(corpus.donors, 'd1.dll')
+    with open(donor_path, 'rb') as f:
+        data = f.read()
+    with ThreadPoolExecutor(2) as executor:
+        limited = executor.submit(PEmimic.parse_donor, donor_path, data, get_args(max_parse_ms=100), PEmimic.Options())
+        unlimited = executor.submit(PEmimic.parse_donor, donor_path, data, get_args(), PEmimic.Options())
+        assert limited.result() is None
+        assert unlimited.result() is not None
@@ -0,0 +1,40 @@
+import json
+import os
+
+import PEmimic
+from conftest import get_samples, run_mimic
+
+
+def get_paths(corpus, *argv):
+    return list(PEmimic.iter_donor_paths(PEmimic.get_args(['-sd', corpus.donors, *argv])))
+
+
+def test_walk_order_is_the_same_as_os_walk(corpus):
+    expected = [os.path.join(root, name) for root, dirs, files in os.walk(corpus.donors) for name in files]
+    assert get_paths(corpus) == expected
+
+
+def test_inode_order(corpus, tmp_path):
+    paths = get_paths(corpus, '-order', 'inode')
+    assert sorted(paths) == sorted(get_paths(corpus))
+    assert paths == sorted(paths, key=lambda path: (os.stat(path).st_dev, os.stat(path).st_ino))
+    for order in ('walk', 'inode'):
+        run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', str(tmp_path / order), '-rich', '-order', order)
+    samples = sorted(get_samples(str(tmp_path / 'inode')).values())
+    assert len(samples) == 5
+    assert samples == sorted(get_samples(str(tmp_path / 'walk')).values())
+
+
+def test_size_filters(corpus, tmp_path):
+    sizes = {path: os.path.getsize(path) for path in get_paths(corpus)}
+    max_size = sorted(sizes.values())[3]
+    assert get_paths(corpus, '-min-size', '1') == [path for path in sizes if sizes[path] >= 1]
+    assert get_paths(corpus, '-max-size', str(max_size)) == [path for path in sizes if sizes[path] <= max_size]
+    metrics_path = str(tmp_path / 'metrics.json')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', str(tmp_path / 'out'), '-rich', '-min-size', '1',
+              '-max-size', str(max_size), '-metrics', metrics_path)
+    with open(metrics_path) as file:
+        metrics = json.load(file)
+    # the skipped files are not opened
+    assert metrics['files_skipped'] == {'size': sum(not 1 <= size <= max_size for size in sizes.values())}
+    assert metrics['files_seen'] == sum(1 <= size <= max_size for size in sizes.values())
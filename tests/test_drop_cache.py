@@ -0,0 +1,50 @@
+import os
+import threading
+
+import pytest
+
+import PEmimic
+from conftest import get_samples, run_mimic
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'posix_fadvise'), reason='posix_fadvise is not available')
+
+
+@pytest.fixture
+def advices(monkeypatch):
+    advices = []
+    lock = threading.Lock()
+    posix_fadvise = os.posix_fadvise
+
+    def recording_fadvise(fd, offset, length, advice):
+        with lock:
+            advices.append(advice)
+        posix_fadvise(fd, offset, length, advice)
+
+    monkeypatch.setattr(os, 'posix_fadvise', recording_fadvise)
+    return advices
+
+
+def test_donor_pages_are_dropped_after_read(corpus, advices):
+    path = os.path.join(corpus.donors, 'd1.dll')
+    with open(path, 'rb') as file:
+        data = file.read()
+    assert PEmimic.load_donor(path) == data
+    assert advices == []
+    assert PEmimic.load_donor(path, True) == data
+    assert advices == [os.POSIX_FADV_SEQUENTIAL, os.POSIX_FADV_DONTNEED]
+
+
+def test_read_ahead_threads_drop_pages(corpus, advices):
+    paths = list(PEmimic.iter_donor_paths(PEmimic.get_args(['-sd', corpus.donors])))
+    assert len(list(PEmimic.iter_prefetched_donors(paths, 4, 1 << 20, True))) == 7
+    assert advices.count(os.POSIX_FADV_DONTNEED) == 7
+
+
+def test_samples_are_the_same(corpus, tmp_path):
+    for name, options in (('cached', ()), ('dropped', ('-drop-cache',))):
+        result = run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', str(tmp_path / name), '-rich',
+                           '-with-donor', *options)
+        assert 'is not supported on this system' not in result.stdout
+    samples = get_samples(str(tmp_path / 'dropped'))
+    assert len(samples) == 10
+    assert samples == get_samples(str(tmp_path / 'cached'))
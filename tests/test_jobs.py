@@ -0,0 +1,60 @@
+import os
+import shutil
+
+from conftest import find_file, get_samples, run_mimic
+
+
+def make_originals(corpus, tmp_path):
+    originals = tmp_path / 'originals'
+    originals.mkdir()
+    shutil.copy(corpus.original, originals / 'a.dll')
+    shutil.copy(os.path.join(corpus.donors, 'd1.dll'), originals / 'b.dll')
+    shutil.copy(os.path.join(corpus.donors, 'd4_32.dll'), originals / 'c.dll')
+    return originals
+
+
+def test_samples_are_the_same_as_one_process(corpus, tmp_path):
+    originals = make_originals(corpus, tmp_path)
+    for jobs in ('1', '3'):
+        run_mimic('-batch', str(originals), '-sd', corpus.donors, '-out', str(tmp_path / jobs), '-rem-rich', '-rem-sign',
+                  '-jobs', jobs)
+    samples = get_samples(str(tmp_path / '3'))
+    assert sorted(samples.values()) == sorted(get_samples(str(tmp_path / '1')).values())
+    assert len(samples) == 3
+
+
+def test_originals_with_the_same_name_get_own_directories(corpus, tmp_path):
+    list_path = tmp_path / 'originals.txt'
+    paths = []
+    for name, source in (('x', corpus.original), ('y', os.path.join(corpus.donors, 'd1.dll'))):
+        (tmp_path / name).mkdir()
+        paths.append(shutil.copy(source, tmp_path / name / 'a.dll'))
+    list_path.write_text(''.join(f'{path}\n' for path in paths))
+    out_dir = str(tmp_path / 'out')
+    run_mimic('-batch', str(list_path), '-sd', corpus.donors, '-out', out_dir, '-rem-rich', '-jobs', '2')
+    mimics_dir = os.path.join(out_dir, '_mimic_samples', 'a_mimics')
+    sample_dirs = sorted(os.listdir(mimics_dir))
+    assert len(sample_dirs) == 2
+    for sample_dir in sample_dirs:
+        # every worker writes its own log next to the sample
+        find_file(os.path.join(mimics_dir, sample_dir), '_mimic_log')
+        assert len(get_samples(os.path.join(mimics_dir, sample_dir))) == 1
+
+
+def test_failed_original_is_reported(corpus, tmp_path):
+    originals = make_originals(corpus, tmp_path)
+    shutil.copy(os.path.join(corpus.donors, 'junk.dll'), originals / 'bad.dll')
+    result = run_mimic('-batch', str(originals), '-sd', corpus.donors, '-out', str(tmp_path / 'out'), '-rem-rich',
+                       '-jobs', '2')
+    assert f'Original skipped: {originals / "bad.dll"}' in result.stdout
+    assert 'Originals processed: 3' in result.stdout
+
+
+def test_jobs_are_rejected_outside_batch_remove_mode(corpus, tmp_path):
+    originals = make_originals(corpus, tmp_path)
+    search = run_mimic('-batch', str(originals), '-sd', corpus.donors, '-out', str(tmp_path / 'out'), '-rich', '-jobs', '2')
+    archive = run_mimic('-batch', str(originals), '-sd', corpus.donors, '-out', str(tmp_path / 'out'), '-rem-rich',
+                        '-jobs', '2', '-archive', 'tar')
+    assert '"-jobs" \tcannot be used without "-batch" and "-rem-*" commands.' in search.stdout
+    assert '"-jobs" \tcannot be used at the same time with "-archive".' in archive.stdout
+    assert get_samples(str(tmp_path / 'out')) == {}
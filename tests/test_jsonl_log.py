@@ -0,0 +1,63 @@
+import json
+import os
+import struct
+
+from conftest import find_file, get_samples, run_mimic
+from test_archive import read_archive
+
+
+def read_records(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+
+def get_checksum(data):
+    e_lfanew = struct.unpack_from('<I', data, 0x3c)[0]
+    return struct.unpack_from('<I', data, e_lfanew + 24 + 64)[0]
+
+
+def find_log(out_dir, ext):
+    return next(os.path.join(root, name) for root, dirs, files in os.walk(out_dir) for name in files
+                if name.startswith('_mimic_log') and name.endswith(ext))
+
+
+def test_sample_records(corpus, tmp_path):
+    out_dir = str(tmp_path / 'out')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', out_dir, '-rich', '-log', 'jsonl')
+    records = read_records(find_log(out_dir, '.jsonl'))
+    assert not any(name.endswith('.txt') for root, dirs, files in os.walk(out_dir) for name in files)
+    assert records[0]['type'] == 'run'
+    assert records[0]['options'] == 'rich'
+    samples = get_samples(out_dir)
+    assert len(records) == len(samples) + 1 == 6
+    for record in records[1:]:
+        data = samples[record['sample']]
+        assert record['type'] == 'sample'
+        assert record['original'] == corpus.original
+        assert os.path.dirname(record['donor']).startswith(corpus.donors)
+        assert 'rich' in record['parts']
+        assert record['size'] == len(data)
+        assert record['checksum'] == get_checksum(data)
+        assert record['build_time'] >= 0
+        with open(record['path'], 'rb') as file:
+            assert file.read() == data
+
+
+def test_both_logs(corpus, tmp_path):
+    out_dir = str(tmp_path / 'out')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', out_dir, '-rich', '-log', 'both', '-limit', '2')
+    with open(find_log(out_dir, '.txt')) as file:
+        assert 'Files savad in' in file.read()
+    assert len(read_records(find_log(out_dir, '.jsonl'))) == 3
+
+
+def test_archived_samples_have_no_path(corpus, tmp_path):
+    out_dir = str(tmp_path / 'out')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', out_dir, '-rich', '-log', 'jsonl', '-archive', 'zip')
+    files = read_archive(find_file(out_dir, '_mimic_samples.'))
+    logs = [name for name in files if name.endswith('.jsonl')]
+    assert len(logs) == 1
+    records = [json.loads(line) for line in files[logs[0]].splitlines()]
+    samples = [record for record in records if record['type'] == 'sample']
+    assert sorted(record['sample'] for record in samples) == sorted(name for name in files if name.endswith('.dll'))
+    assert all(record.get('path') is None for record in samples)
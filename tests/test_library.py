@@ -0,0 +1,57 @@
+import concurrent.futures
+import os
+
+import pytest
+
+import PEmimic
+
+
+def read_donors(corpus):
+    donors = []
+    for root, dirs, files in os.walk(corpus.donors):
+        for name in sorted(files):
+            with open(os.path.join(root, name), 'rb') as file:
+                donors.append((os.path.join(root, name), file.read()))
+    return donors
+
+
+def test_samples_built_concurrently_are_the_same(corpus):
+    args = PEmimic.get_args(['-rich', '-timePE', '-sign'])
+    with open(corpus.original, 'rb') as file:
+        data = file.read()
+    donors = read_donors(corpus)
+
+    def mimic(path, donor_data):
+        original = PEmimic.analyze(data, args, corpus.original)
+        donor = PEmimic.match_donor(original, donor_data, args, path)
+        if donor is None:
+            return None
+        parts = {}
+        return PEmimic.build_sample(original, donor, args, parts), parts
+
+    expected = [mimic(path, donor_data) for path, donor_data in donors]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda donor: mimic(*donor), donors * 4))
+    assert results == expected * 4
+    # "junk" and "empty" are not PE files
+    assert sum(result is not None for result in expected) == 5
+    assert all('rich' in parts for sample, parts in filter(None, expected))
+
+
+def test_original_is_shared_by_threads(corpus):
+    args = PEmimic.get_args(['-rich'])
+    with open(corpus.original, 'rb') as file:
+        original = PEmimic.analyze(file.read(), args, corpus.original)
+    donors = [PEmimic.match_donor(original, donor_data, args, path) for path, donor_data in read_donors(corpus)]
+    donors = [donor for donor in donors if donor is not None]
+    expected = [PEmimic.build_sample(original, donor, args) for donor in donors]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        samples = list(executor.map(lambda donor: PEmimic.build_sample(original, donor, args), donors * 4))
+    assert samples == expected * 4
+    # "d3copy" gives the same sample as "d3"
+    assert len(set(samples)) == 4
+
+
+def test_invalid_original_raises_error():
+    with pytest.raises(PEmimic.OriginalError):
+        PEmimic.analyze(b'MZ' + bytes(100))
@@ -0,0 +1,66 @@
+import concurrent.futures
+import json
+import os
+import shutil
+import threading
+
+import PEmimic
+from conftest import find_file, run_mimic
+from test_archive import read_archive
+
+
+def read_records(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+
+def test_daemon_jobs_write_own_logs(corpus, daemon, tmp_path):
+    first = daemon.post({'in': corpus.original, 'out': str(tmp_path / 'first'), 'options': ['-rich', '-log', 'both']})
+    failed = daemon.post({'in': os.path.join(corpus.donors, 'junk.dll'), 'out': str(tmp_path / 'failed'),
+                          'options': ['-rich', '-log', 'both']})
+    assert 'error' not in first, first
+    # the failed job reports its own log instead of the log of the previous job
+    assert failed['error'] and os.path.dirname(failed['log']).startswith(str(tmp_path / 'failed'))
+    assert os.path.isfile(failed['log'])
+    records = read_records(first['jsonl_log'])
+    assert [record['type'] for record in records].count('run') == 1
+    assert sum(record['type'] == 'sample' for record in records) == 5
+
+
+def test_batch_archive_contains_log_of_all_originals(corpus, tmp_path):
+    originals = tmp_path / 'originals'
+    originals.mkdir()
+    for name in ('a.dll', 'b.dll'):
+        shutil.copy(corpus.original, originals / name)
+    out_dir = str(tmp_path / 'out')
+    run_mimic('-batch', str(originals), '-sd', corpus.donors, '-out', out_dir, '-rich', '-archive', 'tar')
+    files = read_archive(find_file(out_dir, '_mimic_samples.'))
+    logs = [name for name in files if name.startswith('_mimic_log')]
+    assert len(logs) == 1
+    assert b'Originals processed: 2' in files[logs[0]]
+
+
+def test_concurrent_runs_have_own_logs(corpus, tmp_path):
+    barrier = threading.Barrier(2)
+
+    def write(name, count):
+        args = PEmimic.get_args(['-rich', '-out', str(tmp_path / name)])
+        options = PEmimic.Options()
+        PEmimic.set_options(args, options)
+        log = PEmimic.Log(args, options)
+        log.start()
+        try:
+            barrier.wait()
+            for i in range(count):
+                PEmimic.Log.write(f'{name} {i}')
+        finally:
+            log.close()
+        with open(log.get_path()) as file:
+            return file.read()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(write, 'first', 3)
+        second = executor.submit(write, 'second', 5)
+        first, second = first.result(), second.result()
+    assert first.count('first') == 3 and 'second' not in first
+    assert second.count('second') == 5 and 'first' not in second
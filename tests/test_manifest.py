@@ -0,0 +1,58 @@
+import os
+import shutil
+import sqlite3
+import types
+
+import PEmimic
+from conftest import find_file, get_samples, run_mimic
+
+
+def read_manifest(path):
+    with sqlite3.connect(path) as connection:
+        return connection.execute('SELECT original, sample, path FROM samples').fetchall()
+
+
+def test_batch_manifest_lists_samples_of_all_originals(corpus, tmp_path):
+    originals = tmp_path / 'originals'
+    originals.mkdir()
+    for name in ('a.dll', 'b.dll'):
+        shutil.copy(corpus.original, originals / name)
+    out_dir = str(tmp_path / 'out')
+    run_mimic('-batch', str(originals), '-sd', corpus.donors, '-out', out_dir, '-rich', '-manifest-db')
+    rows = read_manifest(find_file(out_dir, '_mimic_manifest'))
+    assert {os.path.basename(original) for original, sample, path in rows} == {'a.dll', 'b.dll'}
+    assert sorted(sample for original, sample, path in rows) == sorted(get_samples(out_dir))
+    assert all(os.path.isfile(path) for original, sample, path in rows)
+
+
+def test_batch_jobs_write_to_one_manifest(corpus, tmp_path):
+    originals = tmp_path / 'originals'
+    originals.mkdir()
+    for name in ('a.dll', 'b.dll', 'c.dll'):
+        shutil.copy(corpus.original, originals / name)
+    out_dir = str(tmp_path / 'out')
+    run_mimic('-batch', str(originals), '-sd', corpus.donors, '-out', out_dir, '-rem-rich', '-jobs', '2', '-manifest-db')
+    rows = read_manifest(find_file(out_dir, '_mimic_manifest'))
+    assert sorted(os.path.basename(original) for original, sample, path in rows) == ['a.dll', 'b.dll', 'c.dll']
+
+
+def test_daemon_jobs_write_own_manifests(corpus, daemon, tmp_path):
+    results = [daemon.post({'in': corpus.original, 'out': str(tmp_path / name), 'options': [option, '-manifest-db']})
+               for name, option in (('rich', '-rich'), ('stamp', '-timePE'))]
+    for result in results:
+        assert 'error' not in result, result
+        rows = read_manifest(result['manifest'])
+        assert sorted(sample for original, sample, path in rows) == sorted(s['name'] for s in result['samples'])
+
+
+def test_manifests_of_two_runs_are_independent(corpus, tmp_path):
+    original = types.SimpleNamespace(path=corpus.original, size=corpus.size)
+    first = PEmimic.Manifest(str(tmp_path / 'first.db'))
+    second = PEmimic.Manifest(str(tmp_path / 'second.db'))
+    first.write(original, 'first.dll', None, None, None, {'rich': 'Rich'}, 1, 0, None)
+    first.close()
+    # closing the manifest of one run keeps the other one open
+    second.write(original, 'second.dll', None, None, None, {'rich': 'Rich'}, 1, 0, None)
+    second.close()
+    assert [sample for original, sample, path in read_manifest(first.get_path())] == ['first.dll']
+    assert [sample for original, sample, path in read_manifest(second.get_path())] == ['second.dll']
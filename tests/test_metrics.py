@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+
+import PEmimic
+from conftest import Daemon, run_mimic
+
+
+def read_metrics(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def get_donors_size(corpus):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, dirs, files in os.walk(corpus.donors) for name in files)
+
+
+def test_run_counters(corpus, tmp_path):
+    path = str(tmp_path / 'metrics.json')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', str(tmp_path / 'out'), '-rich', '-metrics', path)
+    metrics = read_metrics(path)
+    assert metrics['files_seen'] == 7
+    assert metrics['donors_accepted'] == 5
+    assert metrics['samples_written'] == 5
+    # "junk" and "empty" are not PE files
+    assert sum(metrics['donors_rejected'].values()) == 2
+    assert metrics['bytes_read'] == get_donors_size(corpus)
+
+
+def test_prefetch_and_batch_counters(corpus, tmp_path):
+    single = str(tmp_path / 'single.json')
+    batch = str(tmp_path / 'batch.json')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', str(tmp_path / 'single'), '-rich', '-prefetch', '4',
+              '-metrics', single)
+    originals = tmp_path / 'originals'
+    originals.mkdir()
+    for name in ('a.dll', 'b.dll'):
+        shutil.copy(corpus.original, originals / name)
+    run_mimic('-batch', str(originals), '-sd', corpus.donors, '-out', str(tmp_path / 'batch'), '-rich', '-metrics', batch)
+    single, batch = read_metrics(single), read_metrics(batch)
+    # the batch reads and evaluates every donor once for all originals
+    for name in ('files_seen', 'bytes_read', 'donors_accepted', 'donors_rejected'):
+        assert batch[name] == single[name]
+    assert batch['samples_written'] == 2 * single['samples_written']
+
+
+def test_prometheus_text(corpus, tmp_path):
+    path = str(tmp_path / 'metrics.prom')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', str(tmp_path / 'out'), '-rich', '-metrics', path)
+    with open(path) as file:
+        lines = file.read().splitlines()
+    assert f'{PEmimic.METRICS_PROM_PREFIX}_samples_written_total 5' in lines
+    assert f'# TYPE {PEmimic.METRICS_PROM_PREFIX}_elapsed gauge' in lines
+
+
+def test_daemon_jobs_share_counters(corpus, tmp_path):
+    path = str(tmp_path / 'metrics.json')
+    daemon = Daemon('-sd', corpus.donors, '-metrics', path)
+    try:
+        for name in ('first', 'second'):
+            result = daemon.post({'in': corpus.original, 'out': str(tmp_path / name), 'options': ['-rich']})
+            assert 'error' not in result, result
+    finally:
+        daemon.stop()
+    metrics = read_metrics(path)
+    assert metrics['files_seen'] == 14
+    assert metrics['samples_written'] == 10
+
+
+def test_metrics_are_independent(tmp_path):
+    first = PEmimic.Metrics(str(tmp_path / 'first.json'))
+    second = PEmimic.Metrics(str(tmp_path / 'second.json'))
+    first.count('files_seen')
+    first.count('donors_rejected', 'not_pe', 2)
+    first.close()
+    second.count('files_seen')
+    second.close()
+    assert read_metrics(str(tmp_path / 'first.json'))['donors_rejected'] == {'not_pe': 2}
+    assert 'donors_rejected' not in read_metrics(str(tmp_path / 'second.json'))
+    assert read_metrics(str(tmp_path / 'second.json'))['files_seen'] == 1
@@ -0,0 +1,61 @@
+import json
+import os
+import shutil
+
+import PEmimic
+from conftest import Daemon, get_samples, run_mimic
+
+
+def read_metrics(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def test_rerun_skips_invalid_donors(corpus, tmp_path):
+    args = ('-in', corpus.original, '-sd', corpus.donors, '-rich', '-negative-cache', str(tmp_path / 'negative.db'))
+    run_mimic(*args, '-out', str(tmp_path / 'first'), '-metrics', str(tmp_path / 'first.json'))
+    run_mimic(*args, '-out', str(tmp_path / 'second'), '-metrics', str(tmp_path / 'second.json'))
+    assert 'files_skipped' not in read_metrics(str(tmp_path / 'first.json'))
+    # "junk" and "empty" are not opened again
+    assert read_metrics(str(tmp_path / 'second.json'))['files_skipped'] == {'negative_cache': 2}
+    samples = get_samples(str(tmp_path / 'first'))
+    assert len(samples) == 5
+    assert get_samples(str(tmp_path / 'second')) == samples
+
+
+def test_changed_donor_is_parsed_again(corpus, tmp_path):
+    donors = str(tmp_path / 'donors')
+    shutil.copytree(corpus.donors, donors)
+    args = ('-in', corpus.original, '-sd', donors, '-rich', '-negative-cache', str(tmp_path / 'negative.db'))
+    run_mimic(*args, '-out', str(tmp_path / 'first'))
+    os.remove(os.path.join(donors, 'junk.dll'))
+    shutil.copy(os.path.join(donors, 'd1.dll'), os.path.join(donors, 'junk.dll'))
+    run_mimic(*args, '-out', str(tmp_path / 'second'))
+    assert len(get_samples(str(tmp_path / 'second'))) == 6
+
+
+def test_daemon_jobs_share_negative_cache(corpus, tmp_path):
+    metrics = str(tmp_path / 'metrics.json')
+    daemon = Daemon('-sd', corpus.donors, '-negative-cache', str(tmp_path / 'negative.db'), '-metrics', metrics)
+    try:
+        for name in ('first', 'second'):
+            result = daemon.post({'in': corpus.original, 'out': str(tmp_path / name), 'options': ['-rich']})
+            assert 'error' not in result, result
+    finally:
+        daemon.stop()
+    assert read_metrics(metrics)['files_skipped'] == {'negative_cache': 2}
+    assert get_samples(str(tmp_path / 'second')) == get_samples(str(tmp_path / 'first'))
+
+
+def test_negative_caches_are_independent(corpus, tmp_path):
+    args = PEmimic.get_args(['-rich'])
+    options_list = [PEmimic.Options()]
+    PEmimic.set_options(args, options_list[0])
+    junk = os.path.join(corpus.donors, 'junk.dll')
+    first = PEmimic.NegativeCache(str(tmp_path / 'first.db'))
+    second = PEmimic.NegativeCache(str(tmp_path / 'second.db'))
+    first.add(junk, options_list[0], None)
+    assert list(first.filter([junk], options_list, args)) == []
+    assert list(second.filter([junk], options_list, args)) == [junk]
+    first.close()
+    second.close()
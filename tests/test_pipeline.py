@@ -0,0 +1,36 @@
+import json
+import os
+
+import PEmimic
+from conftest import get_samples, run_mimic
+
+
+def get_paths(corpus, *argv):
+    args = PEmimic.get_args(['-sd', corpus.donors, *argv])
+    return sorted(os.path.relpath(path, corpus.donors) for path in PEmimic.iter_donor_paths(args))
+
+
+def test_depth_is_relative_to_search_directory(corpus):
+    top = ['d1.dll', 'd2.dll', 'd4_32.dll', 'empty.exe', 'junk.dll']
+    assert get_paths(corpus, '-d', '0') == top
+    assert get_paths(corpus, '-d', '1') == sorted(top + [os.path.join('sub', 'd3.dll'), os.path.join('sub', 'd3copy.dll')])
+    assert get_paths(corpus) == get_paths(corpus, '-d', '1')
+
+
+def test_search_directory_can_be_one_file(corpus, tmp_path):
+    donor = os.path.join(corpus.donors, 'd2.dll')
+    assert list(PEmimic.iter_donor_paths(PEmimic.get_args(['-sd', donor]))) == [donor]
+    run_mimic('-in', corpus.original, '-sd', donor, '-out', str(tmp_path / 'out'), '-rich')
+    assert len(get_samples(str(tmp_path / 'out'))) == 1
+
+
+def test_limit_stops_reading_donors(corpus, tmp_path):
+    path = str(tmp_path / 'metrics.json')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', str(tmp_path / 'out'), '-rich', '-limit', '1',
+              '-prefetch', '0', '-metrics', path)
+    with open(path) as file:
+        metrics = json.load(file)
+    # no donor is read after the one giving the sample
+    assert metrics['files_seen'] == sum(metrics.get('donors_rejected', {}).values()) + 1
+    assert metrics['samples_written'] == 1
+    assert len(get_samples(str(tmp_path / 'out'))) == 1
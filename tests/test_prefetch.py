@@ -0,0 +1,48 @@
+import threading
+
+import PEmimic
+from conftest import get_samples, run_mimic
+
+
+def get_donor_paths(corpus):
+    return list(PEmimic.iter_donor_paths(PEmimic.get_args(['-sd', corpus.donors])))
+
+
+def test_files_are_yielded_in_path_order(corpus, tmp_path):
+    paths = get_donor_paths(corpus) + [str(tmp_path / 'missing.dll')]
+    expected = list(PEmimic.iter_loaded_donors(paths))
+    assert len(expected) == 7
+    for count, max_bytes in ((1, 1 << 20), (4, 1 << 20), (8, 1)):
+        assert list(PEmimic.iter_prefetched_donors(paths, count, max_bytes)) == expected
+
+
+def test_samples_are_the_same_as_without_prefetch(corpus, tmp_path):
+    for prefetch in ('0', '4'):
+        run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', str(tmp_path / prefetch), '-rich', '-timePE',
+                  '-prefetch', prefetch)
+    samples = get_samples(str(tmp_path / '4'))
+    assert len(samples) == 5
+    assert samples == get_samples(str(tmp_path / '0'))
+
+
+def test_stopped_search_drops_pending_reads(corpus, monkeypatch):
+    paths = get_donor_paths(corpus)
+    started = []
+    load_donor = PEmimic.load_donor
+    release = threading.Event()
+
+    # the first file is read at once, the other reads wait until the search is stopped
+    def slow_load_donor(path, drop_cache=False):
+        started.append(path)
+        if path != paths[0]:
+            release.wait(5)
+        return load_donor(path, drop_cache)
+
+    monkeypatch.setattr(PEmimic, 'load_donor', slow_load_donor)
+    donors = PEmimic.iter_prefetched_donors(paths, 2, 1 << 20)
+    assert next(donors)[0] == paths[0]
+    threading.Timer(0.1, release.set).start()
+    donors.close()
+    # only the file read ahead of the first donor may be started
+    assert started == paths[:len(started)]
+    assert len(started) <= 2
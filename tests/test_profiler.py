@@ -0,0 +1,59 @@
+import concurrent.futures
+import json
+import threading
+
+import PEmimic
+from conftest import find_file, run_mimic
+
+
+def read_stages(path):
+    with open(path) as file:
+        return {stage['stage']: stage['calls'] for stage in json.load(file)['stages']}
+
+
+def test_prefetched_files_are_measured(corpus, tmp_path):
+    out_dir = str(tmp_path / 'out')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', out_dir, '-rich', '-prefetch', '4', '-profile')
+    stages = read_stages(find_file(out_dir, '_mimic_profile'))
+    # the files are read by the prefetch threads
+    assert stages['load_donor'] == 7
+    assert stages['parse_donor'] == 7
+    assert stages['save_sample'] == 5
+
+
+def test_daemon_jobs_are_measured_separately(corpus, daemon, tmp_path):
+    first = daemon.post({'in': corpus.original, 'out': str(tmp_path / 'first'), 'options': ['-rich', '-profile']})
+    second = daemon.post({'in': corpus.original, 'out': str(tmp_path / 'second'), 'options': ['-timePE']})
+    third = daemon.post({'in': corpus.original, 'out': str(tmp_path / 'third'), 'options': ['-rich', '-profile']})
+    assert 'profile' not in second
+    assert read_stages(first['profile'])['save_sample'] == 5
+    # the donors of the later jobs are taken from the daemon cache
+    assert 'parse_donor' in read_stages(first['profile'])
+    assert 'parse_donor' not in read_stages(third['profile'])
+    assert read_stages(third['profile'])['save_sample'] == 5
+
+
+def test_concurrent_runs_have_own_profilers(corpus, tmp_path):
+    with open(corpus.original, 'rb') as file:
+        data = file.read()
+    args = PEmimic.get_args(['-rich'])
+    barrier = threading.Barrier(2)
+
+    def profile(name, count):
+        profiler = PEmimic.Profiler()
+        profiler.start()
+        try:
+            barrier.wait()
+            for _ in range(count):
+                PEmimic.analyze(data, args)
+        finally:
+            profiler.stop()
+        (tmp_path / name).mkdir()
+        return profiler.save(str(tmp_path / name))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(profile, 'first', 3)
+        second = executor.submit(profile, 'second', 5)
+        first, second = first.result(), second.result()
+    assert read_stages(first)['parse_original'] == 3
+    assert read_stages(second)['parse_original'] == 5
@@ -0,0 +1,52 @@
+from conftest import find_file, get_samples, run_mimic
+
+
+def get_reused(out_dir):
+    with open(find_file(out_dir, '_mimic_log')) as log:
+        return log.read().count('Sample taken from the result cache')
+
+
+def test_rerun_takes_samples_from_cache(corpus, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    args = ('-in', corpus.original, '-sd', corpus.donors, '-rich', '-timePE', '-result-cache', cache_dir)
+    run_mimic(*args, '-out', str(tmp_path / 'first'))
+    run_mimic(*args, '-out', str(tmp_path / 'second'))
+    samples = get_samples(str(tmp_path / 'first'))
+    assert len(samples) == 5
+    assert get_samples(str(tmp_path / 'second')) == samples
+    # "d3copy" is the copy of "d3", so it takes the sample of "d3"
+    assert get_reused(str(tmp_path / 'first')) == 1
+    assert get_reused(str(tmp_path / 'second')) == 5
+
+
+def test_changed_sample_is_built_again(corpus, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    args = ('-in', corpus.original, '-sd', corpus.donors, '-rich', '-result-cache', cache_dir)
+    run_mimic(*args, '-out', str(tmp_path / 'first'))
+    # the output samples are links to the cached files
+    name, data = sorted(get_samples(str(tmp_path / 'first')).items())[0]
+    with open(find_file(str(tmp_path / 'first'), name), 'r+b') as file:
+        file.write(b'XX')
+    run_mimic(*args, '-out', str(tmp_path / 'second'))
+    assert get_samples(str(tmp_path / 'second'))[name] == data
+    assert get_reused(str(tmp_path / 'second')) == 4
+
+
+def test_options_are_part_of_the_key(corpus, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-rich', '-result-cache', cache_dir, '-out', str(tmp_path / 'rich'))
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-rich', '-seed', '1', '-result-cache', cache_dir,
+              '-out', str(tmp_path / 'seed'))
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-timePE', '-result-cache', cache_dir, '-out', str(tmp_path / 'stamp'))
+    assert get_reused(str(tmp_path / 'seed')) == 1
+    assert get_reused(str(tmp_path / 'stamp')) == 1
+
+
+def test_daemon_jobs_use_own_caches(corpus, daemon, tmp_path):
+    for name, cache in (('first', 'a'), ('second', 'b'), ('third', 'a')):
+        result = daemon.post({'in': corpus.original, 'out': str(tmp_path / name),
+                              'options': ['-rich', '-result-cache', str(tmp_path / cache)]})
+        assert 'error' not in result, result
+    assert get_reused(str(tmp_path / 'second')) == 1
+    assert get_reused(str(tmp_path / 'third')) == 5
+    assert get_samples(str(tmp_path / 'third')) == get_samples(str(tmp_path / 'first'))
@@ -0,0 +1,66 @@
+import os
+import random
+
+import PEmimic
+from conftest import get_samples, run_mimic
+
+
+def test_slicing_and_concatenation_are_the_same_as_bytearray():
+    rnd = random.Random(0)
+    data = rnd.randbytes(5000)
+    sample = PEmimic.SampleData(data, None, [PEmimic.FileRange(0, len(data))])
+    expected = bytearray(data)
+    for _ in range(100):
+        start = rnd.randrange(len(expected))
+        stop = min(start + rnd.randrange(20), len(expected))
+        patch = rnd.randbytes(rnd.randrange(20))
+        # the same changes as the transplant makes: replace the slice with new bytes
+        sample = sample[:start] + patch + sample[stop:]
+        expected = expected[:start] + patch + expected[stop:]
+        assert len(sample) == len(expected)
+        assert bytes(sample.to_bytearray()) == bytes(expected)
+        index = rnd.randrange(-len(expected), len(expected))
+        assert sample[index] == expected[index]
+    # unmodified ranges stay references to the original
+    assert sample.has_file_ranges()
+
+
+def test_written_sample_is_the_same_as_joined_segments(tmp_path):
+    rnd = random.Random(1)
+    path = str(tmp_path / 'original')
+    with open(path, 'wb') as file:
+        file.write(rnd.randbytes(300000))
+    with open(path, 'rb') as file:
+        data = file.read()
+    sample = PEmimic.SampleData(data, path, [PEmimic.FileRange(0, len(data))])
+    sample = sample[:1000] + b'changed' + sample[2000:150000] + rnd.randbytes(70000) + sample[150001:]
+    PEmimic.write_sample_data(str(tmp_path / 'sample'), sample)
+    with open(str(tmp_path / 'sample'), 'rb') as file:
+        assert file.read() == bytes(sample.to_bytearray())
+
+
+def test_mapped_original_gives_the_same_samples(corpus, tmp_path):
+    out_dir = str(tmp_path / 'out')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', out_dir, '-rich', '-timePE', '-sign')
+    samples = sorted(get_samples(out_dir).values())
+    # the library builds the samples from the original in memory
+    args = PEmimic.get_args(['-rich', '-timePE', '-sign'])
+    with open(corpus.original, 'rb') as file:
+        original = PEmimic.analyze(file.read(), args, corpus.original)
+    expected = []
+    for root, dirs, files in os.walk(corpus.donors):
+        for name in files:
+            with open(os.path.join(root, name), 'rb') as file:
+                donor = PEmimic.match_donor(original, file.read(), args, os.path.join(root, name))
+            if donor is not None:
+                expected.append(PEmimic.build_sample(original, donor, args))
+    assert len(samples) == 5
+    assert samples == sorted(expected)
+
+
+def test_empty_original_is_reported(corpus, tmp_path):
+    original = tmp_path / 'empty.dll'
+    original.write_bytes(b'')
+    result = run_mimic('-in', str(original), '-sd', corpus.donors, '-out', str(tmp_path / 'out'), '-rich')
+    assert 'Can not map the original file' in result.stdout
+    assert get_samples(str(tmp_path / 'out')) == {}
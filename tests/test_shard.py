@@ -0,0 +1,81 @@
+import json
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+import PEmimic
+from conftest import get_samples, run_mimic
+
+
+def get_shard_paths(donors, index, count):
+    args = PEmimic.get_args(['-sd', donors])
+    args.shard = (index, count)
+    return {os.path.relpath(path, donors) for path in PEmimic.iter_donor_paths(args)}
+
+
+# run every shard of N and return the sample directories
+def run_shards(corpus, tmp_path, count, *options):
+    sample_dirs = []
+    for index in range(1, count + 1):
+        out_dir = str(tmp_path / f'shard{index}')
+        run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', out_dir, '-rich', '-shard', f'{index}/{count}',
+                  *options)
+        mimics_dir = os.path.join(out_dir, '_mimic_samples', 'orig_mimics')
+        sample_dirs += [os.path.join(mimics_dir, name) for name in os.listdir(mimics_dir)]
+    return sample_dirs
+
+
+def test_shards_split_donors(corpus, tmp_path):
+    all_paths = get_shard_paths(corpus.donors, 1, 1)
+    shards = [get_shard_paths(corpus.donors, index, 3) for index in (1, 2, 3)]
+    assert set.union(*shards) == all_paths
+    assert sum(len(paths) for paths in shards) == len(all_paths) == 7
+    # the split depends only on the paths relative to "-sd", so every host gets the same split
+    donors = shutil.copytree(corpus.donors, str(tmp_path / 'host' / 'donors'))
+    assert [get_shard_paths(donors, index, 3) for index in (1, 2, 3)] == shards
+
+
+def test_shard_samples_are_numbered_apart(corpus, tmp_path):
+    for index, sample_dir in enumerate(run_shards(corpus, tmp_path, 3), 1):
+        numbers = [int(name.split('_')[0]) for name in get_samples(sample_dir)]
+        assert all(number % 3 == index % 3 for number in numbers)
+
+
+def test_merged_shards_are_the_same_as_one_run(corpus, tmp_path):
+    sample_dirs = run_shards(corpus, tmp_path, 3, '-manifest-db', '-log', 'both')
+    merged_dir = str(tmp_path / 'merged')
+    merge_args = [arg for sample_dir in sample_dirs for arg in ('-merge', sample_dir)]
+    result = run_mimic(*merge_args, '-out', merged_dir, '-manifest-db')
+    assert 'Samples merged: 5' in result.stdout
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', str(tmp_path / 'single'), '-rich')
+    samples = get_samples(merged_dir)
+    assert sorted(samples.values()) == sorted(get_samples(str(tmp_path / 'single')).values())
+    with sqlite3.connect(os.path.join(merged_dir, PEmimic.MANIFEST_FILE_NAME)) as connection:
+        rows = connection.execute('SELECT id, sample, path FROM samples').fetchall()
+    assert [row[0] for row in rows] == [1, 2, 3, 4, 5]
+    assert sorted(row[1] for row in rows) == sorted(samples)
+    assert all(path == os.path.join(merged_dir, sample) for _, sample, path in rows)
+    logs = sorted(name for name in os.listdir(merged_dir) if name.startswith('_mimic_log'))
+    with open(os.path.join(merged_dir, logs[0])) as file:
+        records = [json.loads(line) for line in file]
+    assert [record['time'] for record in records] == sorted(record['time'] for record in records)
+    assert sum(record['type'] == 'sample' for record in records) == 5
+    with open(os.path.join(merged_dir, logs[1])) as file:
+        assert file.read().count('Search directory') == 3
+
+
+@pytest.mark.parametrize('shard', ['0/2', '3/2', '1/0', 'x'])
+def test_invalid_shard_is_rejected(corpus, tmp_path, shard):
+    result = run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', str(tmp_path / 'out'), '-rich', '-shard', shard)
+    assert f'Invalid value for "-shard": {shard}.' in result.stdout
+    assert get_samples(str(tmp_path / 'out')) == {}
+
+
+def test_merge_of_output_directory_is_rejected(corpus, tmp_path):
+    out_dir = str(tmp_path / 'shard')
+    run_mimic('-in', corpus.original, '-sd', corpus.donors, '-out', out_dir, '-rich', '-shard', '1/2')
+    result = run_mimic('-merge', out_dir, '-out', str(tmp_path / 'merged'))
+    assert 'The shard directory contains directory' in result.stdout
+    assert not os.path.exists(str(tmp_path / 'merged'))